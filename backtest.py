@@ -0,0 +1,170 @@
+"""
+Backtesting rolling-origin de los modelos sobre historia horaria local.
+
+1) Descargar historia (una vez) a history/<ubicacion>.csv:
+    python backtest.py fetch --cities "Bogota,Medellin,Cali" --start 2024-01-01 --end 2024-03-31
+    python backtest.py fetch --points "4.61,-74.08;6.25,-75.56" --start 2024-01-01 --end 2024-03-31
+    python backtest.py fetch --synthetic --points "4.61,-74.08" --start 2024-01-01 --end 2024-02-29
+
+2) Evaluar (sin llamadas de red):
+    python backtest.py run --engine blend --train-hours 48 --horizon 24 --step 24 --workers 8
+
+   o sobre la historia que la API ya ingesto (history_store/, ver ECOPREDICT_HISTORY_TRAIN_DAYS):
+    python backtest.py run --source store --engine blend
+"""
+import argparse
+import asyncio
+import json
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import pandas as pd
+
+import config
+from services.backtest import SOURCES, read_locations, run_backtest, save_history, slugify, store_locations, summarize
+from services.engines import ENGINES
+from services.http_client import get_json_with_retries, new_client
+from services.model_service import TARGETS
+from services.weather_service import _archive_url, _hourly_frame
+
+
+def _parse_points(points: str):
+    out = []
+    for item in (points or "").split(";"):
+        if item.strip():
+            lat, lon = (float(v) for v in item.split(","))
+            out.append((f"{lat:.2f},{lon:.2f}", lat, lon))
+    return out
+
+
+async def _geocode(client, city: str):
+    url = f"{config.GEOCODING_URL}?name={city}&count=5&language=es"
+    data = (await get_json_with_retries(url, timeout=10, client=client, stage="geocode")).get("results") or []
+    if not data:
+        raise ValueError(f"Ciudad no encontrada: {city}")
+    best = next((r for r in data if r.get("country") == "Colombia"), data[0])
+    return best["name"], best["latitude"], best["longitude"]
+
+
+def _synthetic_history(lat: float, lon: float, start: date, end: date) -> pd.DataFrame:
+    from benchmarks.synthetic import VARIABLES, hourly_values
+
+    start_dt = datetime.combine(start, datetime.min.time())
+    hours = ((end - start).days + 1) * 24
+    values = hourly_values(start_dt, hours, seed=int(abs(lat) * 1000 + abs(lon) * 10) % 10_000)
+    df = pd.DataFrame({"time": pd.date_range(start_dt, periods=hours, freq="h")})
+    for name in VARIABLES:
+        df[name] = values[name]
+    return df
+
+
+async def _fetch(args):
+    start, end = date.fromisoformat(args.start), date.fromisoformat(args.end)
+    async with new_client() as client:
+        locations = _parse_points(args.points)
+        for city in [c.strip() for c in (args.cities or "").split(",") if c.strip()]:
+            locations.append(await _geocode(client, city))
+
+        for name, lat, lon in locations:
+            if args.synthetic:
+                df = _synthetic_history(lat, lon, start, end)
+            else:
+                payload = await get_json_with_retries(
+                    _archive_url(lat, lon, start, end), timeout=60, client=client, stage="archive"
+                )
+                df = _hourly_frame(payload)
+            if df.empty:
+                print(f"?? Sin datos para {name}")
+                continue
+            path = save_history(slugify(name), name, lat, lon, df, args.history_dir)
+            print(f"? {name} ({lat}, {lon}): {len(df)} filas -> {path}")
+
+
+def cmd_fetch(args):
+    if not args.cities and not args.points:
+        raise SystemExit("Indica --cities y/o --points")
+    asyncio.run(_fetch(args))
+
+
+def cmd_run(args):
+    if args.source == "store":
+        # Las ubicaciones del almacen se nombran por su carpeta (<lat>_<lon>)
+        available = store_locations(args.history_dir)
+        locations = [l.strip() for l in args.locations.split(",") if l.strip()] if args.locations else available
+        if not locations:
+            raise SystemExit("El almacen de historia esta vacio; activa la ingesta (ECOPREDICT_HISTORY_INGEST) en la API")
+    else:
+        available = read_locations(args.history_dir)
+        locations = [slugify(l) for l in args.locations.split(",") if l.strip()] if args.locations else sorted(available)
+        if not locations:
+            raise SystemExit("No hay historia local; ejecuta primero 'python backtest.py fetch ...'")
+    targets = [t for t in args.targets.split(",") if t]
+
+    print(f"Backtest: {len(locations)} ubicaciones, {len(targets)} variables, motor {args.engine}")
+    start = time.perf_counter()
+    folds = run_backtest(
+        locations, targets, args.engine, args.train_hours, args.horizon, args.step, args.workers, args.history_dir,
+        args.source,
+    )
+    elapsed = time.perf_counter() - start
+    mae, rain = summarize(folds)
+
+    out = Path(args.out or Path("backtests") / f"{args.engine}-{datetime.utcnow():%Y%m%dT%H%M%S}")
+    out.mkdir(parents=True, exist_ok=True)
+    folds.to_csv(out / "folds.csv", index=False)
+    mae.to_csv(out / "mae.csv", index=False)
+    if not rain.empty:
+        rain.to_csv(out / "rain.csv", index=False)
+    params = {k: v for k, v in vars(args).items() if k != "func"}
+    (out / "params.json").write_text(
+        json.dumps({**params, "locations": locations, "seconds": round(elapsed, 2)}, indent=2), encoding="utf-8"
+    )
+
+    with pd.option_context("display.width", 160, "display.max_rows", 200, "display.float_format", "{:.3f}".format):
+        print("\nMAE (todas las filas de prueba; skill = 1 - MAE / MAE persistencia):")
+        print(mae.to_string(index=False))
+        if not rain.empty:
+            print("\nLluvia (precision / recall / F1 agregados):")
+            print(rain.to_string(index=False))
+    print(f"\n{len(folds)} folds en {elapsed:.1f}s -> {out}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backtesting rolling-origin de EcoPredict")
+    parser.add_argument(
+        "--history-dir",
+        default=None,
+        help=f"Carpeta de historia (default {config.HISTORY_DIR}; con --source store, {config.HISTORY_STORE_DIR})",
+    )
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    fetch = sub.add_parser("fetch", help="Descarga historia horaria del archivo de Open-Meteo")
+    fetch.add_argument("--cities", default="", help="Ciudades separadas por comas")
+    fetch.add_argument("--points", default="", help="'lat,lon;lat,lon'")
+    yesterday = date.today() - timedelta(days=6)  # el archivo llega con unos dias de retraso
+    fetch.add_argument("--start", default=str(yesterday - timedelta(weeks=8)))
+    fetch.add_argument("--end", default=str(yesterday))
+    fetch.add_argument("--synthetic", action="store_true", help="Datos sinteticos (sin red) para probar")
+    fetch.set_defaults(func=cmd_fetch)
+
+    run = sub.add_parser("run", help="Evalua los modelos con origen rodante sobre la historia local")
+    run.add_argument(
+        "--source", default="csv", choices=list(SOURCES), help="csv: historia de 'fetch'; store: la ingerida por la API"
+    )
+    run.add_argument("--locations", default="", help="Ubicaciones (slugs o nombres; carpetas <lat>_<lon> con store); default todas")
+    run.add_argument("--targets", default=",".join(TARGETS))
+    run.add_argument("--engine", default=config.MODEL_ENGINE, choices=list(ENGINES))
+    run.add_argument("--train-hours", type=int, default=48, help="Horas de entrenamiento antes de cada origen")
+    run.add_argument("--horizon", type=int, default=24, help="Horas evaluadas despues de cada origen")
+    run.add_argument("--step", type=int, default=24, help="Horas entre origenes consecutivos")
+    run.add_argument("--workers", type=int, default=None, help="Procesos (default: CPUs)")
+    run.add_argument("--out", default=None, help="Carpeta de salida (default backtests/<motor>-<fecha>)")
+    run.set_defaults(func=cmd_run)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
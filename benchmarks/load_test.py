@@ -0,0 +1,231 @@
+"""
+End-to-end concurrent load test against /api/predict.
+
+With --spawn it starts the upstream stub and a uvicorn server wired to it (isolated model
+registry in a temp dir), so no request reaches Open-Meteo / Nominatim:
+
+    python -m benchmarks.load_test --spawn --requests 300 --concurrency 32 --locations 40 --latency-ms 80
+
+Against an already running server (RSS only if --pid is given):
+
+    python -m benchmarks.load_test --url http://127.0.0.1:8000 --pid 12345
+
+Reports p50/p95/p99 latency, throughput, errors and peak RSS (server + worker processes),
+and saves them under benchmarks/results/ for --compare.
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import httpx
+import numpy as np
+
+from benchmarks.results import compare, save_results
+from benchmarks.stub_server import serve, upstream_env
+from services.model_service import TARGETS
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _rss_bytes(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status", encoding="utf-8") as fh:
+            for line in fh:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def _children(pid: int):
+    out = []
+    try:
+        for tid in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{tid}/children", encoding="utf-8") as fh:
+                out.extend(int(c) for c in fh.read().split())
+    except OSError:
+        pass
+    return out
+
+
+def _tree_rss(pid: int) -> int:
+    """RSS of pid and its descendants (psutil if installed, /proc otherwise)."""
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+    if psutil is not None:
+        try:
+            proc = psutil.Process(pid)
+            procs = [proc] + proc.children(recursive=True)
+            return sum(p.memory_info().rss for p in procs if p.is_running())
+        except psutil.Error:
+            return 0
+    total, stack = 0, [pid]
+    while stack:
+        current = stack.pop()
+        total += _rss_bytes(current)
+        stack.extend(_children(current))
+    return total
+
+
+class RssSampler:
+    def __init__(self, pid: int | None, interval: float = 0.1):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, _tree_rss(self.pid))
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        if self.pid:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self.pid:
+            self._thread.join()
+
+
+def _spawn_server(port: int, env_extra: dict):
+    env = {**os.environ, **env_extra}
+    cmd = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+    return subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL)
+
+
+def _wait_ready(url: str, timeout: float = 30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"{url}/api/cache_stats", timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"El servidor en {url} no respondio en {timeout}s")
+
+
+def _locations(n: int, seed: int):
+    rnd = random.Random(seed)
+    # Caja aproximada de Colombia
+    return [(round(rnd.uniform(-4.0, 12.0), 4), round(rnd.uniform(-79.0, -67.0), 4)) for _ in range(n)]
+
+
+async def _run_load(url: str, n_requests: int, concurrency: int, locations, targets, engine: str, seed: int):
+    rnd = random.Random(seed)
+    plan = [(rnd.choice(locations), rnd.choice(targets)) for _ in range(n_requests)]
+    latencies = []
+    statuses = {}
+    limit = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=url, timeout=120, limits=limits) as client:
+        async def one(point, target):
+            params = {"lat": point[0], "lon": point[1], "target": target}
+            if engine:
+                params["engine"] = engine
+            async with limit:
+                start = time.perf_counter()
+                try:
+                    resp = await client.get("/api/predict", params=params)
+                    status = resp.status_code
+                except httpx.HTTPError:
+                    status = "error"
+                latencies.append((time.perf_counter() - start) * 1000)
+                statuses[status] = statuses.get(status, 0) + 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*[one(point, target) for point, target in plan])
+        elapsed = time.perf_counter() - start
+
+    return latencies, statuses, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga concurrente de /api/predict")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--spawn", action="store_true", help="Levanta stub + uvicorn locales")
+    parser.add_argument("--port", type=int, default=8801, help="Puerto del servidor con --spawn")
+    parser.add_argument("--stub-port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=50, help="Latencia del stub upstream")
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--pid", type=int, help="PID del servidor para medir RSS (sin --spawn)")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--locations", type=int, default=20, help="Ubicaciones distintas (controla el hit ratio)")
+    parser.add_argument("--targets", default=",".join(TARGETS))
+    parser.add_argument("--engine", default="")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--out")
+    parser.add_argument("--compare")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+
+    url, proc, stub, pid = args.url, None, None, args.pid
+    tmp = None
+    if args.spawn:
+        stub, stub_state = serve("127.0.0.1", args.stub_port, args.latency_ms, args.jitter_ms)
+        tmp = tempfile.TemporaryDirectory(prefix="ecopredict-bench-")
+        env = {**upstream_env("127.0.0.1", args.stub_port), "ECOPREDICT_MODEL_DIR": tmp.name}
+        proc = _spawn_server(args.port, env)
+        url, pid = f"http://127.0.0.1:{args.port}", proc.pid
+
+    try:
+        _wait_ready(url)
+        targets = [t for t in args.targets.split(",") if t]
+        with RssSampler(pid) as sampler:
+            latencies, statuses, elapsed = asyncio.run(
+                _run_load(url, args.requests, args.concurrency, _locations(args.locations, args.seed), targets, args.engine, args.seed)
+            )
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(timeout=10)
+        if stub is not None:
+            stub.shutdown()
+        if tmp is not None:
+            tmp.cleanup()
+
+    lat = np.asarray(latencies)
+    ok = statuses.get(200, 0)
+    metrics = {
+        "latency_p50_ms": float(np.percentile(lat, 50)),
+        "latency_p95_ms": float(np.percentile(lat, 95)),
+        "latency_p99_ms": float(np.percentile(lat, 99)),
+        "latency_max_ms": float(lat.max()),
+        "throughput_rps": len(lat) / elapsed,
+        "ok_rps": ok / elapsed,
+        "errors": len(lat) - ok,
+    }
+    if pid:
+        metrics["peak_rss_mb"] = sampler.peak / (1024 * 1024)
+
+    print(f"Peticiones: {len(lat)} en {elapsed:.2f}s, estados: {statuses}")
+    for name, value in metrics.items():
+        print(f"  {name:20s} {value:10.2f}")
+    if stub is not None:
+        print(f"  upstream: {stub_state.requests} ({stub_state.bytes_sent / 1024:.0f} KiB)")
+
+    params = {k: v for k, v in vars(args).items() if k not in ("out", "compare")}
+    path = save_results("load", metrics, params, args.out)
+    print(f"\nResultados: {path}")
+    if args.compare and not compare(metrics, args.compare, args.tolerance):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+Microbenchmarks for the feature builders and train_and_predict, per target and engine.
+
+    python -m benchmarks.micro --sizes 72,192,720 --engines blend,ridge --repeat 5
+    python -m benchmarks.micro --compare benchmarks/results/micro-<fecha>.json
+"""
+import argparse
+import contextlib
+import io
+import os
+import pickle
+import statistics
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import StandardScaler
+
+from benchmarks.results import compare, save_results
+from benchmarks.synthetic import make_hourly_frame, make_hourly_payload
+from services import compact_model
+from services.hourly import HourlyFrame
+from services.engines import ENGINES, get_engine
+from services.features import build_design_matrix
+from services.model_service import (
+    TARGETS,
+    _get_lags_for_target,
+    _lag_spec,
+    train_and_predict,
+    train_and_predict_many,
+)
+
+
+def _add_lag_features(df: pd.DataFrame, target: str) -> pd.DataFrame:
+    """
+    Pandas lag builder (shift + concat + dropna), kept here only as the reference that
+    build_design_matrix is measured against.
+    """
+    lags = _get_lags_for_target(target)
+    lag_cols = pd.DataFrame({f"{target}_lag{lag}": df[target].shift(lag) for lag in lags}, index=df.index)
+    return pd.concat([df, lag_cols], axis=1).dropna().reset_index(drop=True)
+
+
+def _median_ms(fn, repeat: int, warmup: int = 1) -> float:
+    # train_and_predict imprime el MAE en cada llamada; se silencia durante la medicion
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(warmup):
+            fn()
+        samples = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def _peak_kb(fn) -> float:
+    """Peak Python heap (KiB) allocated while fn runs, measured with tracemalloc."""
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def _legacy_merge(archive_json, forecast_json) -> pd.DataFrame:
+    # Ruta anterior: listas -> DataFrames float64 -> concat -> parseo de fechas -> dedupe + sort
+    frames = []
+    for payload in (archive_json, forecast_json):
+        df = pd.DataFrame(payload["hourly"])
+        df["time"] = pd.to_datetime(df["time"])
+        frames.append(df)
+    df = pd.concat(frames, ignore_index=True)
+    return df.drop_duplicates(subset=["time"]).sort_values("time").reset_index(drop=True)
+
+
+def _array_merge(archive_json, forecast_json) -> HourlyFrame:
+    return HourlyFrame.merge([HourlyFrame.from_payload(archive_json), HourlyFrame.from_payload(forecast_json)])
+
+
+def ingestion(hours: int, repeat: int) -> dict:
+    """
+    Upstream JSON -> merged frame: the pandas path (concat / to_datetime / drop_duplicates /
+    sort) against the float32 array path, with time, tracemalloc peak, resulting frame size
+    and the pickled size of the model job input.
+    """
+    start = datetime.utcnow().replace(minute=0, second=0, microsecond=0) - timedelta(hours=48)
+    archive_json = make_hourly_payload(start, 72)
+    forecast_json = make_hourly_payload(start + timedelta(hours=48), hours - 48)
+
+    legacy = _legacy_merge(archive_json, forecast_json)
+    view = _array_merge(archive_json, forecast_json)
+    frame = view.to_frame()
+    return {
+        f"ingest.legacy.{hours}_ms": _median_ms(lambda: _legacy_merge(archive_json, forecast_json), repeat * 10),
+        f"ingest.arrays.{hours}_ms": _median_ms(lambda: _array_merge(archive_json, forecast_json), repeat * 10),
+        f"ingest.arrays_to_frame.{hours}_ms": _median_ms(lambda: _array_merge(archive_json, forecast_json).to_frame(), repeat * 10),
+        f"ingest_peak.legacy.{hours}_kb": _peak_kb(lambda: _legacy_merge(archive_json, forecast_json)),
+        f"ingest_peak.arrays.{hours}_kb": _peak_kb(lambda: _array_merge(archive_json, forecast_json)),
+        f"frame_size.legacy.{hours}_kb": legacy.memory_usage(deep=True).sum() / 1024,
+        f"frame_size.arrays.{hours}_kb": frame.memory_usage(deep=True).sum() / 1024,
+        f"job_input.dataframe.{hours}_kb": len(pickle.dumps(legacy)) / 1024,
+        f"job_input.hourly_frame.{hours}_kb": len(pickle.dumps(view)) / 1024,
+        f"ingest_max_gap.{hours}": float(np.nanmax(np.abs(
+            legacy.drop(columns="time").to_numpy(dtype=np.float64) - frame.drop(columns="time").to_numpy(dtype=np.float64)
+        ))),
+    }
+
+
+def model_formats(engine_name: str, repeat: int) -> dict:
+    """Size, load time and prediction gap of the joblib vs compact (mmap) model files."""
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(192, 40)).astype(np.float32)
+    y = X[:, 0] * 2 + np.sin(X[:, 1]) + rng.normal(size=len(X)) * 0.1
+    X_future = rng.normal(size=(24, 40)).astype(np.float32)
+    engine = get_engine(engine_name)
+    scaler = StandardScaler().fit(X)
+    bundle = {"scaler": scaler, "engine": engine_name, "models": engine.fit(X, scaler.transform(X), y)}
+    if not compact_model.packable(bundle):
+        return {}
+
+    metrics = {}
+    with tempfile.TemporaryDirectory() as folder:
+        paths = {"joblib": os.path.join(folder, "m.joblib"), "compact": os.path.join(folder, "m.cmodel")}
+        joblib.dump(bundle, paths["joblib"])
+        with open(paths["compact"], "wb") as fh:
+            compact_model.dump(bundle, fh)
+        loaders = {"joblib": joblib.load, "compact": compact_model.load}
+        for fmt, path in paths.items():
+            metrics[f"model_load.{engine_name}.{fmt}_ms"] = _median_ms(lambda: loaders[fmt](path), repeat * 4)
+            metrics[f"model_size.{engine_name}.{fmt}_kb"] = os.path.getsize(path) / 1024
+        loaded = compact_model.load(paths["compact"])
+        expected = engine.predict(bundle["models"], X_future, scaler.transform(X_future))
+        got = engine.predict(loaded["models"], X_future, loaded["scaler"].transform(X_future))
+        metrics[f"model_predict_gap.{engine_name}"] = float(np.abs(expected - got).max())
+    return metrics
+
+
+def run(sizes, engines, targets, repeat: int, past_hours: int) -> dict:
+    metrics = {}
+    for size in sizes:
+        df = make_hourly_frame(hours=size, past_hours=min(past_hours, size - 24))
+        print(f"\n== {size} filas ==")
+
+        if size > 72:
+            for name, value in ingestion(size, repeat).items():
+                metrics[name] = value
+                print(f"  {name}: {value:10.3f}")
+
+        for target in targets:
+            ms = _median_ms(lambda: _add_lag_features(df, target), repeat * 10)
+            metrics[f"add_lag_features.{target}.{size}_ms"] = ms
+            print(f"  _add_lag_features[{target}]: {ms:8.3f} ms")
+
+        ms = _median_ms(lambda: build_design_matrix(df, _lag_spec(targets)), repeat * 10)
+        metrics[f"design_matrix.all.{size}_ms"] = ms
+        print(f"  build_design_matrix[todas]: {ms:8.3f} ms")
+
+        for engine in engines:
+            for target in targets:
+                ms = _median_ms(lambda: train_and_predict(df, target=target, engine=engine), repeat)
+                metrics[f"train_and_predict.{engine}.{target}.{size}_ms"] = ms
+                print(f"  train_and_predict[{engine}, {target}]: {ms:8.2f} ms")
+            ms = _median_ms(lambda: train_and_predict_many(df, targets=targets, engine=engine), repeat)
+            metrics[f"train_and_predict_many.{engine}.{size}_ms"] = ms
+            print(f"  train_and_predict_many[{engine}]: {ms:8.2f} ms")
+
+    print("\n== Formato de modelos (joblib vs compacto) ==")
+    for engine in engines:
+        formats = model_formats(engine, repeat)
+        metrics.update(formats)
+        for name, value in formats.items():
+            print(f"  {name}: {value:10.3f}")
+    return metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmarks de features y entrenamiento")
+    parser.add_argument("--sizes", default="72,192,720", help="Filas por frame, separadas por comas")
+    parser.add_argument("--past-hours", type=int, default=48, help="Horas antes de la hora actual (entrenamiento)")
+    parser.add_argument("--engines", default=",".join(ENGINES))
+    parser.add_argument("--targets", default=",".join(TARGETS))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--out", help="Ruta del JSON de resultados")
+    parser.add_argument("--compare", help="JSON previo para detectar regresiones")
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    engines = [e for e in args.engines.split(",") if e]
+    targets = [t for t in args.targets.split(",") if t]
+    metrics = run(sizes, engines, targets, args.repeat, args.past_hours)
+
+    params = {"sizes": sizes, "engines": engines, "targets": targets, "repeat": args.repeat, "past_hours": args.past_hours}
+    path = save_results("micro", metrics, params, args.out)
+    print(f"\nResultados: {path}")
+    if args.compare and not compare(metrics, args.compare, args.tolerance):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Saving benchmark results as JSON and comparing them against a previous run.
+"""
+import json
+import platform
+import subprocess
+from datetime import datetime
+from pathlib import Path
+
+RESULTS_DIR = Path(__file__).resolve().parent / "results"
+
+
+def _git_rev() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_results(kind: str, metrics: dict, params: dict, out: str | None = None) -> Path:
+    """
+    Writes {kind, params, metrics, env} to ``out`` or benchmarks/results/<kind>-<timestamp>.json.
+    metrics is a flat {name: number} dict so runs can be diffed.
+    """
+    path = Path(out) if out else RESULTS_DIR / f"{kind}-{datetime.utcnow():%Y%m%dT%H%M%S}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    payload = {
+        "kind": kind,
+        "created_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "git_rev": _git_rev(),
+        "env": {"python": platform.python_version(), "machine": platform.machine(), "system": platform.system()},
+        "params": params,
+        "metrics": metrics,
+    }
+    path.write_text(json.dumps(payload, indent=2), encoding="utf-8")
+    return path
+
+
+def compare(current: dict, baseline_path: str, tolerance: float = 0.10) -> bool:
+    """
+    Prints per-metric change vs a baseline file. Metrics ending in ``_ms`` / ``_mb`` are
+    "lower is better", ``*_rps`` is "higher is better". Returns False if any metric regressed
+    by more than ``tolerance`` (relative).
+    """
+    baseline = json.loads(Path(baseline_path).read_text(encoding="utf-8"))["metrics"]
+    ok = True
+    print(f"\nComparacion contra {baseline_path} (tolerancia {tolerance:.0%}):")
+    for name, value in current.items():
+        base = baseline.get(name)
+        if not isinstance(value, (int, float)) or not isinstance(base, (int, float)) or base == 0:
+            continue
+        change = (value - base) / base
+        higher_is_better = name.endswith("_rps")
+        regressed = change < -tolerance if higher_is_better else change > tolerance
+        ok = ok and not regressed
+        flag = "REGRESION" if regressed else ""
+        print(f"  {name:48s} {base:12.3f} -> {value:12.3f} ({change:+.1%}) {flag}")
+    return ok
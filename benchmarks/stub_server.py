@@ -0,0 +1,187 @@
+"""
+Local stand-in for the upstream APIs used by EcoPredict, with tunable latency.
+
+Serves:
+  /v1/archive   (Open-Meteo archive: start_date / end_date)
+  /v1/forecast  (Open-Meteo forecast: 7 days from today, or start_hour / end_hour)
+  /v1/search    (Open-Meteo geocoding)
+  /reverse      (Nominatim reverse geocoding)
+
+    python -m benchmarks.stub_server --port 8765 --latency-ms 80 --jitter-ms 40
+
+Point the app at it with:
+    ECOPREDICT_ARCHIVE_URL=http://127.0.0.1:8765/v1/archive
+    ECOPREDICT_FORECAST_URL=http://127.0.0.1:8765/v1/forecast
+    ECOPREDICT_GEOCODING_URL=http://127.0.0.1:8765/v1/search
+    ECOPREDICT_REVERSE_GEOCODING_URL=http://127.0.0.1:8765/reverse
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks.synthetic import make_hourly_payload
+
+FORECAST_DAYS = 7
+
+
+class StubState:
+    def __init__(self, latency_ms: float = 0, jitter_ms: float = 0, error_rate: float = 0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.requests = {}
+        self.bytes_sent = 0
+        self._lock = threading.Lock()
+
+    def count(self, path: str, size: int):
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+            self.bytes_sent += size
+
+
+def _points(query: dict):
+    lats = [float(v) for v in query.get("latitude", ["4.61"])[0].split(",")]
+    lons = [float(v) for v in query.get("longitude", ["-74.08"])[0].split(",")]
+    return list(zip(lats, lons))
+
+
+def _seed(lat: float, lon: float) -> int:
+    return int(abs(lat) * 1000 + abs(lon) * 10) % 10_000
+
+
+def _archive(query: dict):
+    start = datetime.fromisoformat(query["start_date"][0])
+    end = datetime.fromisoformat(query["end_date"][0]) + timedelta(days=1)
+    hours = int((end - start).total_seconds() // 3600)
+    return [make_hourly_payload(start, hours, _seed(lat, lon), lat, lon) for lat, lon in _points(query)]
+
+
+def _forecast(query: dict):
+    if "start_hour" in query and "end_hour" in query:
+        start = datetime.fromisoformat(query["start_hour"][0])
+        end = datetime.fromisoformat(query["end_hour"][0])
+        hours = int((end - start).total_seconds() // 3600) + 1
+    else:
+        start = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        hours = 24 * FORECAST_DAYS
+    # Mismo seed que el archivo: las horas solapadas coinciden
+    return [make_hourly_payload(start, hours, _seed(lat, lon), lat, lon) for lat, lon in _points(query)]
+
+
+def _search(query: dict):
+    name = query.get("name", [""])[0]
+    if not name or name.lower().startswith("zzz"):
+        return {}
+    rnd = random.Random(name.lower())
+    return {
+        "results": [
+            {
+                "name": name.title(),
+                "latitude": round(rnd.uniform(-4, 12), 4),
+                "longitude": round(rnd.uniform(-79, -67), 4),
+                "country": "Colombia",
+            }
+        ]
+    }
+
+
+def _reverse(query: dict):
+    lat = float(query.get("lat", ["0"])[0])
+    lon = float(query.get("lon", ["0"])[0])
+    return {"address": {"city": f"Stub {lat:.2f},{lon:.2f}", "country": "Colombia"}}
+
+
+ROUTES = {
+    "/v1/archive": _archive,
+    "/v1/forecast": _forecast,
+    "/v1/search": _search,
+    "/reverse": _reverse,
+}
+
+
+def make_handler(state: StubState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            route = ROUTES.get(url.path)
+            delay = max(0.0, state.latency_ms + random.uniform(-state.jitter_ms, state.jitter_ms)) / 1000
+            if delay:
+                time.sleep(delay)
+
+            if route is None:
+                return self._send(404, {"error": True, "reason": "not found"}, url.path)
+            if state.error_rate and random.random() < state.error_rate:
+                return self._send(503, {"error": True, "reason": "stub error"}, url.path)
+            try:
+                payload = route(parse_qs(url.query))
+            except (KeyError, ValueError) as err:
+                return self._send(400, {"error": True, "reason": str(err)}, url.path)
+            # Open-Meteo devuelve un objeto para un punto y una lista para varios
+            if isinstance(payload, list) and len(payload) == 1:
+                payload = payload[0]
+            self._send(200, payload, url.path)
+
+        def _send(self, status: int, payload, path: str):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            state.count(path, len(body))
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(host: str = "127.0.0.1", port: int = 8765, latency_ms: float = 0, jitter_ms: float = 0, error_rate: float = 0):
+    """Starts the stub in a daemon thread. Returns (server, state)."""
+    state = StubState(latency_ms, jitter_ms, error_rate)
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state
+
+
+def upstream_env(host: str, port: int) -> dict:
+    base = f"http://{host}:{port}"
+    return {
+        "ECOPREDICT_ARCHIVE_URL": f"{base}/v1/archive",
+        "ECOPREDICT_FORECAST_URL": f"{base}/v1/forecast",
+        "ECOPREDICT_GEOCODING_URL": f"{base}/v1/search",
+        "ECOPREDICT_REVERSE_GEOCODING_URL": f"{base}/reverse",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub local de Open-Meteo / Nominatim")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter-ms", type=float, default=20)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server, state = serve(args.host, args.port, args.latency_ms, args.jitter_ms, args.error_rate)
+    print(f"Stub escuchando en http://{args.host}:{args.port} (latencia {args.latency_ms}±{args.jitter_ms} ms)")
+    for key, value in upstream_env(args.host, args.port).items():
+        print(f"  {key}={value}")
+    try:
+        while True:
+            time.sleep(10)
+            print(f"  peticiones: {state.requests} bytes: {state.bytes_sent}")
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Synthetic hourly frames shaped like fetch_weather_data output (and the raw Open-Meteo
+``hourly`` payloads behind it), so benchmarks do not depend on the live API.
+"""
+import math
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+VARIABLES = ("temperature_2m", "relative_humidity_2m", "pressure_msl", "precipitation", "wind_speed_10m")
+
+
+def _utc_hour(now: datetime | None = None) -> datetime:
+    now = now or datetime.utcnow()
+    return now.replace(minute=0, second=0, microsecond=0)
+
+
+def _noise(h: np.ndarray, seed: int, k: int) -> np.ndarray:
+    """Deterministic pseudo-noise in [-0.5, 0.5) per absolute hour (no RNG state)."""
+    return (np.sin(h * 12.9898 + seed * 78.233 + k * 37.719) * 43758.5453) % 1.0 - 0.5
+
+
+def hourly_values(start: datetime, hours: int, seed: int = 0) -> dict:
+    """
+    Plausible tropical-Andes hourly series (daily cycles + noise) for every variable.
+    Values depend only on the absolute hour and seed, so overlapping windows agree.
+    """
+    t0 = int((start - datetime(2020, 1, 1)).total_seconds() // 3600)
+    h = np.arange(t0, t0 + hours, dtype=np.float64)
+    daily = np.sin(2 * math.pi * (h % 24) / 24)
+
+    temperature = 14 + 6 * daily + 1.2 * _noise(h, seed, 1)
+    humidity = np.clip(75 - 15 * daily + 6 * _noise(h, seed, 2), 20, 100)
+    pressure = 1013 + 2 * np.sin(2 * math.pi * h / (24 * 5)) + _noise(h, seed, 3)
+    rain_signal = np.sin(2 * math.pi * h / 37) + 2 * _noise(h, seed, 4)
+    precipitation = np.where(rain_signal > 1.0, np.round(4 * (_noise(h, seed, 5) + 0.5), 1), 0.0)
+    wind = np.clip(3 + 1.5 * daily + 2 * _noise(h, seed, 6), 0, None)
+
+    return {
+        "temperature_2m": np.round(temperature, 1),
+        "relative_humidity_2m": np.round(humidity, 0),
+        "pressure_msl": np.round(pressure, 1),
+        "precipitation": precipitation,
+        "wind_speed_10m": np.round(wind, 1),
+    }
+
+
+def make_hourly_frame(hours: int = 192, past_hours: int = 48, seed: int = 0, now: datetime | None = None) -> pd.DataFrame:
+    """
+    DataFrame like fetch_weather_data: naive UTC ``time`` + the five variables,
+    ``past_hours`` rows before the current hour and the rest in the future.
+    """
+    start = _utc_hour(now) - timedelta(hours=past_hours)
+    values = hourly_values(start, hours, seed)
+    df = pd.DataFrame({"time": pd.date_range(start, periods=hours, freq="h")})
+    for name in VARIABLES:
+        df[name] = values[name]
+    return df
+
+
+def make_hourly_payload(start: datetime, hours: int, seed: int = 0, lat: float = 4.61, lon: float = -74.08) -> dict:
+    """Open-Meteo style JSON body (``hourly`` arrays with ISO minute timestamps)."""
+    values = hourly_values(start, hours, seed)
+    times = [(start + timedelta(hours=i)).strftime("%Y-%m-%dT%H:%M") for i in range(hours)]
+    hourly = {"time": times}
+    hourly.update({name: values[name].tolist() for name in VARIABLES})
+    return {
+        "latitude": lat,
+        "longitude": lon,
+        "timezone": "UTC",
+        "hourly_units": {"time": "iso8601"},
+        "hourly": hourly,
+    }
@@ -0,0 +1,107 @@
+import os
+from dotenv import load_dotenv
+
+# Configuracion por variables de entorno (o archivo .env en la raiz)
+load_dotenv()
+
+
+def _int_env(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value not in (None, "") else default
+
+
+def _float_env(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value not in (None, "") else default
+
+
+# Motor de ejecucion para entrenamiento/inferencia (CPU-bound)
+EXECUTOR_KIND = os.getenv("ECOPREDICT_EXECUTOR", "process")  # "process" | "thread"
+EXECUTOR_WORKERS = _int_env("ECOPREDICT_WORKERS", min(4, os.cpu_count() or 1))
+EXECUTOR_QUEUE_SIZE = _int_env("ECOPREDICT_QUEUE_SIZE", 16)  # trabajos en espera de un worker
+EXECUTOR_QUEUE_TIMEOUT = _float_env("ECOPREDICT_QUEUE_TIMEOUT", 5.0)  # espera maxima en la cola
+EXECUTOR_JOB_TIMEOUT = _float_env("ECOPREDICT_JOB_TIMEOUT", 60.0)
+
+# Registro de modelos entrenados (disco local)
+MODEL_REGISTRY_DIR = os.getenv("ECOPREDICT_MODEL_DIR", "models")
+MODEL_REGISTRY_DECIMALS = _int_env("ECOPREDICT_MODEL_DECIMALS", 2)  # ~1 km
+MODEL_REGISTRY_KEEP = _int_env("ECOPREDICT_MODEL_KEEP", 3)  # versiones guardadas por clave
+MODEL_MAX_AGE_SECONDS = _float_env("ECOPREDICT_MODEL_MAX_AGE", 6 * 3600)
+MODEL_FORMAT = os.getenv("ECOPREDICT_MODEL_FORMAT", "compact")  # "compact" (arreglos + mmap) | "joblib"
+
+# Caches en memoria (limites por cache)
+CACHE_SWEEP_INTERVAL = _float_env("ECOPREDICT_CACHE_SWEEP_INTERVAL", 30.0)
+PREDICT_CACHE_MAX_ENTRIES = _int_env("ECOPREDICT_PREDICT_CACHE_MAX_ENTRIES", 2000)
+PREDICT_CACHE_MAX_MB = _float_env("ECOPREDICT_PREDICT_CACHE_MAX_MB", 64)
+GEO_CACHE_MAX_ENTRIES = _int_env("ECOPREDICT_GEO_CACHE_MAX_ENTRIES", 5000)
+GEO_CACHE_TTL = _float_env("ECOPREDICT_GEO_CACHE_TTL", 7 * 24 * 3600)
+FRAME_CACHE_MAX_ENTRIES = _int_env("ECOPREDICT_FRAME_CACHE_MAX_ENTRIES", 500)
+FRAME_CACHE_MAX_MB = _float_env("ECOPREDICT_FRAME_CACHE_MAX_MB", 128)
+
+# Segundo nivel de cache compartido entre procesos (varios workers de uvicorn)
+CACHE_BACKEND = os.getenv("ECOPREDICT_CACHE_BACKEND", "memory")  # "memory" | "sqlite" | "redis"
+CACHE_SQLITE_PATH = os.getenv("ECOPREDICT_CACHE_SQLITE_PATH", "cache/ecopredict.sqlite3")
+CACHE_REDIS_URL = os.getenv("ECOPREDICT_CACHE_REDIS_URL", "redis://localhost:6379/0")
+CACHE_SHARED_TIMEOUT = _float_env("ECOPREDICT_CACHE_SHARED_TIMEOUT", 0.25)  # segundos por operacion
+
+# Resolucion (grados) de la grilla a la que se ajustan las coordenadas antes de cache,
+# descarga y registro de modelos; ~ la del modelo de Open-Meteo. 0 desactiva el ajuste.
+GRID_RESOLUTION = _float_env("ECOPREDICT_GRID_RESOLUTION", 0.1)
+
+# Descargas agrupadas: peticiones de varias ubicaciones dentro de la ventana van en una sola
+# llamada multi-ubicacion a Open-Meteo. 0 desactiva el agrupamiento.
+FETCH_BATCH_WINDOW_MS = _float_env("ECOPREDICT_FETCH_BATCH_WINDOW_MS", 5)
+FETCH_BATCH_MAX_LOCATIONS = _int_env("ECOPREDICT_FETCH_BATCH_MAX_LOCATIONS", 50)
+
+# Reentrenamientos por cliente (POST /api/update): rafaga y recarga por minuto; 0 desactiva
+UPDATE_RATE_PER_MINUTE = _float_env("ECOPREDICT_UPDATE_RATE_PER_MINUTE", 6)
+UPDATE_RATE_BURST = _int_env("ECOPREDICT_UPDATE_RATE_BURST", 3)
+
+# Prediccion por lotes
+BATCH_MAX_LOCATIONS = _int_env("ECOPREDICT_BATCH_MAX_LOCATIONS", 200)
+BATCH_CONCURRENCY = _int_env("ECOPREDICT_BATCH_CONCURRENCY", EXECUTOR_WORKERS)
+
+# Motor de modelo por defecto: blend | ridge | hgb | rf_fast
+MODEL_ENGINE = os.getenv("ECOPREDICT_MODEL_ENGINE", "blend")
+
+# Endpoints externos (sobrescribibles para apuntar a un stub local en benchmarks)
+ARCHIVE_URL = os.getenv("ECOPREDICT_ARCHIVE_URL", "https://archive-api.open-meteo.com/v1/archive")
+FORECAST_URL = os.getenv("ECOPREDICT_FORECAST_URL", "https://api.open-meteo.com/v1/forecast")
+GEOCODING_URL = os.getenv("ECOPREDICT_GEOCODING_URL", "https://geocoding-api.open-meteo.com/v1/search")
+REVERSE_GEOCODING_URL = os.getenv("ECOPREDICT_REVERSE_GEOCODING_URL", "https://nominatim.openstreetmap.org/reverse")
+
+# Historia horaria local para backtesting (python backtest.py fetch / run)
+HISTORY_DIR = os.getenv("ECOPREDICT_HISTORY_DIR", "history")
+
+# Historia local columnar por ubicacion (particiones diarias mmap) para entrenar con mas dias
+HISTORY_STORE_DIR = os.getenv("ECOPREDICT_HISTORY_STORE_DIR", "history_store")
+HISTORY_TRAIN_DAYS = _int_env("ECOPREDICT_HISTORY_TRAIN_DAYS", 0)  # 0: solo la ventana descargada
+HISTORY_STORE_DAYS = _int_env("ECOPREDICT_HISTORY_STORE_DAYS", 90)  # profundidad que mantiene el ingestor
+HISTORY_INGEST_ENABLED = os.getenv("ECOPREDICT_HISTORY_INGEST", "1" if HISTORY_TRAIN_DAYS > 0 else "0") not in ("0", "false", "no")
+HISTORY_INGEST_INTERVAL_SECONDS = _float_env("ECOPREDICT_HISTORY_INGEST_INTERVAL", 600)
+HISTORY_INGEST_CONCURRENCY = _int_env("ECOPREDICT_HISTORY_INGEST_CONCURRENCY", 2)
+HISTORY_INGEST_MAX_LOCATIONS = _int_env("ECOPREDICT_HISTORY_INGEST_MAX_LOCATIONS", 200)
+
+# Pre-calentamiento de ubicaciones populares tras cada actualizacion horaria de Open-Meteo
+PREWARM_ENABLED = os.getenv("ECOPREDICT_PREWARM", "1") not in ("0", "false", "no")
+PREWARM_TOP_N = _int_env("ECOPREDICT_PREWARM_TOP_N", 20)
+PREWARM_MIN_HITS = _float_env("ECOPREDICT_PREWARM_MIN_HITS", 2)
+PREWARM_INTERVAL_SECONDS = _float_env("ECOPREDICT_PREWARM_INTERVAL", 3600)
+PREWARM_OFFSET_SECONDS = _float_env("ECOPREDICT_PREWARM_OFFSET", 300)  # segundos despues de la hora
+PREWARM_CONCURRENCY = _int_env("ECOPREDICT_PREWARM_CONCURRENCY", 2)
+PREWARM_DECAY = _float_env("ECOPREDICT_PREWARM_DECAY", 0.5)
+PREWARM_MAX_TRACKED = _int_env("ECOPREDICT_PREWARM_MAX_TRACKED", 1000)
+
+# Informe de memoria por peticion con tracemalloc (header X-Memory-Usage + histograma)
+MEMORY_PROFILE = os.getenv("ECOPREDICT_MEMORY_PROFILE", "0") not in ("0", "false", "no")
+
+# Gazetteer local (formato GeoNames) para geocoding / reverse geocoding sin red
+GAZETTEER_PATH = os.getenv("ECOPREDICT_GAZETTEER_PATH", "data/gazetteer_co.tsv")  # vacio: solo APIs remotas
+GAZETTEER_MIN_POPULATION = _int_env("ECOPREDICT_GAZETTEER_MIN_POPULATION", 0)
+GAZETTEER_REVERSE_KM = _float_env("ECOPREDICT_GAZETTEER_REVERSE_KM", 5)  # reverse local antes de Nominatim (~media celda)
+GAZETTEER_MAX_KM = _float_env("ECOPREDICT_GAZETTEER_MAX_KM", 25)  # reverse local solo si Nominatim falla
+GAZETTEER_FUZZY_CUTOFF = _float_env("ECOPREDICT_GAZETTEER_FUZZY_CUTOFF", 0.8)
+
+# Cuerpos de respuesta ya codificados (por ETag y compresion)
+ENCODED_CACHE_MAX_ENTRIES = _int_env("ECOPREDICT_ENCODED_CACHE_MAX_ENTRIES", 1000)
+ENCODED_CACHE_MAX_MB = _float_env("ECOPREDICT_ENCODED_CACHE_MAX_MB", 32)
@@ -1,9 +1,69 @@
-from fastapi import FastAPI
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from routers import dashboard, api
+from routers import dashboard, api, metrics as metrics_router
+import config
+from services.cache import sweep_forever
+from services.executor import model_executor
+from services.http_client import close_client
+from services.prewarm import prewarmer
+from services.history_store import history_ingester
+from services.gazetteer import get_gazetteer
+from services import metrics
 
-app = FastAPI(title="EcoPredict")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Informe de memoria por peticion (tracemalloc), solo si se pide: tiene costo
+    if config.MEMORY_PROFILE:
+        metrics.start_memory_profile()
+    # Pool de procesos para entrenamiento/inferencia
+    model_executor.start()
+    # Indices del gazetteer local cargados antes de la primera peticion
+    get_gazetteer()
+    # Barrido periodico de entradas vencidas en las caches
+    sweeper = asyncio.create_task(sweep_forever(config.CACHE_SWEEP_INTERVAL))
+    # Recalculo de ubicaciones populares tras cada actualizacion horaria
+    prewarm = asyncio.create_task(prewarmer.run_forever()) if config.PREWARM_ENABLED else None
+    # Llenado de la historia local desde el archivo de Open-Meteo
+    ingest = asyncio.create_task(history_ingester.run_forever()) if config.HISTORY_INGEST_ENABLED else None
+    yield
+    sweeper.cancel()
+    for task in (prewarm, ingest):
+        if task is not None:
+            task.cancel()
+    model_executor.shutdown()
+    # Cierra el pool de conexiones HTTP compartido
+    await close_client()
+
+
+app = FastAPI(title="EcoPredict", lifespan=lifespan)
+
+
+@app.middleware("http")
+async def stage_timing(request: Request, call_next):
+    # Tiempos por etapa de la peticion -> histograma + header Server-Timing
+    stages, token = metrics.begin_request()
+    memory_start = metrics.memory_begin()
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        metrics.end_request(token)
+    elapsed = time.perf_counter() - start
+
+    # Nombre del endpoint (no la ruta cruda) para no disparar la cardinalidad de etiquetas
+    handler = getattr(request.scope.get("endpoint"), "__name__", "other")
+    metrics.REQUEST_SECONDS.observe(elapsed, method=request.method, handler=handler, status=str(response.status_code))
+    response.headers["Server-Timing"] = metrics.server_timing(stages, elapsed)
+    if memory_start is not None:
+        memory = metrics.memory_end(memory_start)
+        metrics.REQUEST_MEMORY_BYTES.observe(memory["peak"], handler=handler)
+        response.headers["X-Memory-Usage"] = f"peak={memory['peak']}, retained={memory['retained']}"
+    return response
 
 # Archivos estáticos
 app.mount("/static", StaticFiles(directory="static"), name="static")
@@ -15,3 +75,4 @@ templates = Jinja2Templates(directory="templates")
 app.include_router(dashboard.router, tags=["Dashboard"])
 # 👈 Este es el punto clave
 app.include_router(api.router, prefix="/api", tags=["API"])
+app.include_router(metrics_router.router, tags=["Metricas"])
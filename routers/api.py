@@ -1,99 +1,372 @@
-from fastapi import APIRouter, Body, HTTPException
+from fastapi import APIRouter, Body, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
+import json
+import math
 import time
-import requests
-from services.weather_service import fetch_weather_data
-from services.model_service import train_and_predict
+import asyncio
+import httpx
+import config
+from services.cache import TTLCache, all_stats
+from services.shared_cache import JSON_CODEC, get_backend
+from services.executor import ClientDisconnectedError, JobTimeoutError, QueueFullError, model_executor
+from services.http_client import get_json_with_retries
+from services.metrics import observe_stage, timed
+from services.prewarm import prewarmer
+from services.rate_limit import RateLimiter
+from services.history_store import history_ingester
+from services import encoding
+from services.gazetteer import GEOCODE_LOOKUPS, local_geocode, local_reverse, normalize_name
+from services.weather_service import get_weather_frame, grid_cell, snap_to_grid
+from services.engines import ENGINES
+from services.model_service import TARGETS, observed_and_baseline, train_and_predict, train_and_predict_many
 
 router = APIRouter()
 
-geo_cache = {}
-predict_cache: dict = {}
 CACHE_TTL_SECONDS = 300  # 5 minutes
+CACHE_STALE_SECONDS = 900  # ventana extra en la que se sirve lo vencido mientras se refresca
+_MB = 1024 * 1024
+
+# geo y predict se comparten entre workers si hay backend (ECOPREDICT_CACHE_BACKEND)
+geo_cache = TTLCache(
+    "geo",
+    ttl=config.GEO_CACHE_TTL,
+    max_entries=config.GEO_CACHE_MAX_ENTRIES,
+    backend=get_backend(),
+    codec=JSON_CODEC,
+)
+# Cuerpos ya codificados/comprimidos por (ETag, content-coding): los sondeos repetidos no re-serializan
+encoded_cache = TTLCache(
+    "encoded",
+    ttl=CACHE_TTL_SECONDS + CACHE_STALE_SECONDS,
+    max_entries=config.ENCODED_CACHE_MAX_ENTRIES,
+    max_bytes=int(config.ENCODED_CACHE_MAX_MB * _MB),
+)
+predict_cache = TTLCache(
+    "predict",
+    ttl=CACHE_TTL_SECONDS,
+    stale_ttl=CACHE_STALE_SECONDS,
+    max_entries=config.PREDICT_CACHE_MAX_ENTRIES,
+    max_bytes=int(config.PREDICT_CACHE_MAX_MB * _MB),
+    backend=get_backend(),
+    codec=JSON_CODEC,
+)
+
+def _track_history(lat: float, lon: float):
+    # La ubicacion entra al ingestor de historia local (se llena en segundo plano)
+    if config.HISTORY_INGEST_ENABLED:
+        history_ingester.track(lat, lon)
+
+
+update_limiter = RateLimiter("update", config.UPDATE_RATE_PER_MINUTE, config.UPDATE_RATE_BURST)
+
+# Calculos en curso por clave de cache (single-flight)
+_inflight: dict = {}
+
+
+def _location_key(lat: float, lon: float):
+    # Las coordenadas ya llegan ajustadas a la grilla; el redondeo solo evita ruido decimal
+    return (round(lat, 4), round(lon, 4))
+
+
+def _cache_key(lat: float, lon: float, target, engine: str):
+    return (*_location_key(lat, lon), target, engine)
+
+
+async def _get_cached_prediction(lat: float, lon: float, target: str, engine: str, allow_stale: bool = False):
+    """
+    Returns (value, is_stale) or None. Stale entries are only returned when allow_stale is set
+    and they are still inside the stale-while-revalidate window.
+    """
+    entry = await predict_cache.aget_entry(_cache_key(lat, lon, target, engine), allow_stale=allow_stale)
+    if not entry:
+        return None
+    value, is_stale, _ = entry
+    return value, is_stale
 
 
-def _cache_key(lat: float, lon: float, target: str):
-    # Redondea para evitar claves diferentes por ruido decimal
-    return (round(lat, 4), round(lon, 4), target)
+def _set_cached_prediction(lat: float, lon: float, target: str, engine: str, value: dict, ttl: float | None = None):
+    predict_cache.set(_cache_key(lat, lon, target, engine), value, ttl=ttl)
 
 
-def _get_cached_prediction(lat: float, lon: float, target: str):
-    key = _cache_key(lat, lon, target)
-    entry = predict_cache.get(key)
-    now = time.time()
-    if not entry:
+class _Flight:
+    """
+    One shared computation for a cache key. The job is only cancelled when every
+    waiting client has disconnected; background refreshes have no clients and always finish.
+    ttl: cache TTL for the results (None: the cache default); a caller joining the flight
+    (the pre-warm scheduler) can raise it before the results are stored. stored_ttl is the
+    one actually used, once stored.
+    """
+
+    def __init__(self):
+        self.task: asyncio.Task | None = None
+        self.probes = []
+        self.ttl: float | None = None
+        self.stored_ttl: float | None = None
+
+    async def all_disconnected(self) -> bool:
+        if not self.probes:
+            return False
+        for probe in list(self.probes):
+            if not await probe():
+                return False
+        return True
+
+
+def _start_flight(key, compute) -> _Flight:
+    """
+    Returns the in-flight computation for key, starting compute(flight) if none is running.
+    The result is written to predict_cache by compute itself.
+    """
+    flight = _inflight.get(key)
+    if flight is not None:
+        return flight
+
+    flight = _Flight()
+    flight.task = asyncio.create_task(compute(flight))
+
+    def _done(task: asyncio.Task):
+        _inflight.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"?? Calculo fallido para {key}: {task.exception()}")
+
+    flight.task.add_done_callback(_done)
+    _inflight[key] = flight
+    return flight
+
+
+async def _get_or_compute_prediction(request: Request | None, lat: float, lon: float, target: str, engine: str, compute):
+    """
+    Cache lookup with single-flight deduplication and stale-while-revalidate.
+    compute(flight) must build the response and store it with _set_cached_prediction.
+    """
+    cached = await _get_cached_prediction(lat, lon, target, engine, allow_stale=True)
+    key = _cache_key(lat, lon, target, engine)
+    if cached:
+        value, is_stale = cached
+        if is_stale:
+            # Sirve lo vencido y refresca una sola vez en segundo plano
+            _start_flight(key, compute)
+        return value
+
+    flight = _start_flight(key, compute)
+    if request is not None:
+        flight.probes.append(request.is_disconnected)
+    # shield: la desconexion de un cliente no cancela el calculo compartido
+    return await asyncio.shield(flight.task)
+
+
+async def _run_model_job(is_disconnected, fn, *args, **kwargs):
+    """
+    Runs a model job on the worker pool, mapping executor errors to HTTP errors.
+    is_disconnected: optional coroutine function; the job is cancelled once it returns True.
+    """
+    try:
+        with timed("model_job"):
+            return await model_executor.run(fn, *args, is_disconnected=is_disconnected, **kwargs)
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except JobTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except ClientDisconnectedError as e:
+        raise HTTPException(status_code=499, detail=str(e))
+
+
+def _observe_model_stages(results):
+    """
+    Records the timings measured inside the worker (features, fit, predict, registry save)
+    for the current request; the design matrix is shared, so features counts once.
+    """
+    infos = [r.get("model") or {} for r in results]
+    features = [i["features_ms"] for i in infos if i.get("features_ms") is not None]
+    if features:
+        observe_stage("features", features[0] / 1000)
+    for field, stage in (("fit_ms", "fit"), ("predict_ms", "predict"), ("save_ms", "registry_save")):
+        values = [i[field] for i in infos if i.get(field) is not None]
+        if values:
+            observe_stage(stage, sum(values) / 1000)
+
+
+def _parse_format(request: Request, fmt: str) -> str:
+    try:
+        return encoding.resolve_format(fmt, request.headers.get("accept", ""))
+    except encoding.FormatUnavailableError as e:
+        raise HTTPException(status_code=406, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def _validators(keys, scope):
+    """
+    (version, remaining_ttl, stale_keys, scope) of the predict_cache entries behind a
+    response, or None when any of them is not cached (then the response gets no ETag).
+    stale_keys lists the entries already past their TTL (served from the stale window).
+    scope identifies the response built from them (endpoint, label, targets): it goes into
+    the ETag and so into the memo key of the encoded body.
+    """
+    metas = [await predict_cache.ameta(key) for key in keys]
+    if not metas or any(meta is None for meta in metas):
         return None
-    if entry["expires_at"] < now:
-        predict_cache.pop(key, None)
+    now = time.time()
+    version = ".".join(format(meta[0], "x") for meta in metas)
+    ttl = max(0, min(meta[1] for meta in metas) - now)
+    stale = [key for key, meta in zip(keys, metas) if meta[1] < now]
+    return version, ttl, stale, scope
+
+
+def _cache_headers(validators, fmt: str) -> dict:
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if validators is not None:
+        version, ttl, _, scope = validators
+        headers["ETag"] = encoding.make_etag(version, fmt, scope)
+        headers["Cache-Control"] = f"max-age={int(ttl)}"
+    return headers
+
+
+def _not_modified(request: Request, validators, fmt: str) -> Response | None:
+    """304 when If-None-Match matches the current cache entry version."""
+    if validators is None:
         return None
-    return entry["value"]
+    headers = _cache_headers(validators, fmt)
+    if encoding.etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return None
 
 
-def _set_cached_prediction(lat: float, lon: float, target: str, value: dict):
-    key = _cache_key(lat, lon, target)
-    predict_cache[key] = {"value": value, "expires_at": time.time() + CACHE_TTL_SECONDS}
+def _encoded_response(request: Request, payload, fmt: str = "json", validators=None) -> Response:
+    """
+    Serializes payload in fmt (json / columnar / msgpack), compresses it per Accept-Encoding
+    and adds ETag / Cache-Control from validators. Versioned bodies are memoized.
+    """
+    headers = _cache_headers(validators, fmt)
+    coding = encoding.negotiate_encoding(request.headers.get("accept-encoding", ""))
+    memo_key = (headers.get("ETag"), coding)
+    with timed("serialize"):
+        cached = encoded_cache.get(memo_key) if validators is not None else None
+        if cached is None:
+            body, media_type = encoding.encode(payload, fmt)
+            if len(body) < encoding.MIN_COMPRESS_BYTES:
+                coding = None  # no compensa comprimir
+            body = encoding.compress(body, coding)
+            cached = (body, media_type, coding)
+            if validators is not None:
+                encoded_cache.set(memo_key, cached)
+    body, media_type, coding = cached
+    if coding is not None:
+        headers["Content-Encoding"] = coding
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
+async def get_cached_coords(city_norm: str):
+    cached = await geo_cache.aget(city_norm)
+    if cached:
+        GEOCODE_LOOKUPS.inc(direction="forward", source="cache")
+        return cached
 
+    # Coincidencia exacta en el gazetteer local primero; la API de Open-Meteo como respaldo
+    local = local_geocode(city_norm)
+    if local:
+        GEOCODE_LOOKUPS.inc(direction="forward", source="local")
+        geo_cache.set(city_norm, local)
+        return local
 
-def _get_json_with_retries(url: str, *, timeout: int = 10, attempts: int = 3, backoff: float = 1.5, headers=None):
-    """GET with retries + backoff; raises last exception on failure."""
-    last_err = None
-    for attempt in range(attempts):
-        try:
-            resp = requests.get(url, timeout=timeout, headers=headers)
-            resp.raise_for_status()
-            return resp.json()
-        except requests.RequestException as err:
-            last_err = err
-            if attempt == attempts - 1:
-                raise
-            time.sleep(backoff ** attempt)
-    if last_err:
-        raise last_err
-    raise RuntimeError("Unexpected error fetching remote data")
-
-
-def get_cached_coords(city_norm: str):
-    if city_norm in geo_cache:
-        return geo_cache[city_norm]
-
-    geo_url = f"https://geocoding-api.open-meteo.com/v1/search?name={city_norm}&count=5&language=es"
-    geo_json = _get_json_with_retries(geo_url, timeout=10)
+    geo_url = f"{config.GEOCODING_URL}?name={city_norm}&count=5&language=es"
+    try:
+        geo_json = await get_json_with_retries(geo_url, timeout=10, stage="geocode")
+    except Exception:
+        # API caida: el gazetteer aproximado evita el error, pero no se cachea
+        approx = local_geocode(city_norm, approximate=True)
+        if approx is None:
+            raise
+        GEOCODE_LOOKUPS.inc(direction="forward", source="local_approx")
+        return approx
     data = geo_json.get("results", []) if geo_json else []
 
     if not data:
+        # Prefijo / difuso local solo cuando la API no conoce el nombre
+        approx = local_geocode(city_norm, approximate=True)
+        if approx:
+            GEOCODE_LOOKUPS.inc(direction="forward", source="local_approx")
+            geo_cache.set(city_norm, approx)
+            return approx
+        GEOCODE_LOOKUPS.inc(direction="forward", source="miss")
         return None
 
+    GEOCODE_LOOKUPS.inc(direction="forward", source="remote")
     preferred = next((r for r in data if r.get("country") == "Colombia"), data[0])
     lat, lon = preferred["latitude"], preferred["longitude"]
     city = preferred["name"]
 
-    geo_cache[city_norm] = (lat, lon, city)
+    geo_cache.set(city_norm, (lat, lon, city))
     return lat, lon, city
 
 
-@router.get("/predict")
-async def predict(
-    city: str = "",
-    lat: float | None = None,
-    lon: float | None = None,
-    target: str = "temperature_2m"
-):
-    import unicodedata
+async def _reverse_geocode(lat: float, lon: float) -> str:
+    """
+    City label for coordinates: a gazetteer place within GAZETTEER_REVERSE_KM, then cached,
+    then Nominatim. If Nominatim fails, the nearest place within GAZETTEER_MAX_KM (not
+    cached); a "Lat/Lon" label when nothing is found.
+    """
+    fallback = f"Lat: {lat:.2f}, Lon: {lon:.2f}"
+    local = local_reverse(lat, lon)
+    if local:
+        GEOCODE_LOOKUPS.inc(direction="reverse", source="local")
+        return local
+
+    key = ("reverse", round(lat, 3), round(lon, 3))
+    cached = await geo_cache.aget(key)
+    if cached:
+        GEOCODE_LOOKUPS.inc(direction="reverse", source="cache")
+        return cached
 
+    try:
+        geo_url = f"{config.REVERSE_GEOCODING_URL}?format=jsonv2&lat={lat}&lon={lon}"
+        resp_json = await get_json_with_retries(
+            geo_url,
+            headers={"User-Agent": "EcoPredict"},
+            timeout=10,
+            stage="reverse_geocode",
+        )
+    except Exception as e:
+        print(f"?? Error en reverse geocoding: {e}")
+        # Nominatim caido: el vecino del gazetteer es mejor que nada, pero no se cachea
+        nearby = local_reverse(lat, lon, config.GAZETTEER_MAX_KM)
+        if nearby:
+            GEOCODE_LOOKUPS.inc(direction="reverse", source="local_approx")
+        return nearby or fallback
+
+    address = resp_json.get("address", {}) if resp_json else {}
+    city = (
+        address.get("city")
+        or address.get("town")
+        or address.get("village")
+        or address.get("municipality")
+        or address.get("county")
+    )
+    GEOCODE_LOOKUPS.inc(direction="reverse", source="remote" if city else "miss")
+    city = city or fallback
+    geo_cache.set(key, city)
+    return city
+
+
+async def _resolve_location(city: str, lat: float | None, lon: float | None, reverse_geocode: bool = True):
+    """
+    Resolves a city name or a coordinate pair into (lat, lon, city_label), with lat/lon
+    snapped to the upstream grid cell (snap_to_grid) so that nearby points and a city typed
+    as name or as coordinates share cache entries, fetches and models.
+    With reverse_geocode=False coordinates are labelled without calling Nominatim.
+    Raises HTTPException when neither is usable.
+    """
     # Caso 1: nombre de ciudad
     if city:
         try:
-            city_norm = (
-                unicodedata.normalize("NFD", city)
-                .encode("ascii", "ignore")
-                .decode("utf-8")
-                .strip()
-            )
-
-            result = get_cached_coords(city_norm)
+            city_norm = normalize_name(city)
+
+            result = await get_cached_coords(city_norm)
             if not result:
                 raise HTTPException(status_code=404, detail=f"La ciudad '{city}' no existe o esta mal escrita.")
 
             lat, lon, city = result
+            lat, lon = snap_to_grid(lat, lon)
             print(f"? Resolved city '{city}' -> ({lat}, {lon})")
 
         except HTTPException:
@@ -103,54 +376,27 @@ async def predict(
 
     # Caso 2: coordenadas
     elif lat is not None and lon is not None:
-        try:
-            if abs(lat) > 90 and abs(lon) < 90:
-                lat, lon = lon, lat
-            if lon > 0:
-                lon = -lon
-
-            geo_url = f"https://nominatim.openstreetmap.org/reverse?format=jsonv2&lat={lat}&lon={lon}"
-            resp_json = _get_json_with_retries(
-                geo_url,
-                headers={"User-Agent": "EcoPredict"},
-                timeout=10,
-            )
-
-            address = resp_json.get("address", {}) if resp_json else {}
-            city = (
-                address.get("city")
-                or address.get("town")
-                or address.get("village")
-                or address.get("municipality")
-                or address.get("county")
-                or f"Lat: {lat:.2f}, Lon: {lon:.2f}"
-            )
-
-        except Exception as e:
-            print(f"?? Error en reverse geocoding: {e}")
-            city = f"Lat: {lat:.2f}, Lon: {lon:.2f}"
+        if abs(lat) > 90 and abs(lon) < 90:
+            lat, lon = lon, lat
+        if lon > 0:
+            lon = -lon
+        # Etiqueta del centro de la celda: la misma para todos los puntos que la comparten
+        lat, lon = snap_to_grid(lat, lon)
+        if not reverse_geocode:
+            # Sin red: solo el gazetteer local
+            return lat, lon, local_reverse(lat, lon) or f"Lat: {lat:.2f}, Lon: {lon:.2f}"
+        city = await _reverse_geocode(lat, lon)
 
     else:
         raise HTTPException(status_code=400, detail="Debes ingresar una ciudad o coordenadas validas.")
 
-    # Cache de prediccion
-    cached = _get_cached_prediction(lat, lon, target)
-    if cached:
-        return cached
-
-    # Obtiene datos y predicciones
-    try:
-        df = fetch_weather_data(lat, lon)
-    except requests.HTTPError as http_err:
-        status = http_err.response.status_code if http_err.response is not None else 502
-        raise HTTPException(status_code=status, detail="Error al obtener datos meteorologicos.")
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"No se pudo obtener datos meteorologicos: {e}")
+    return lat, lon, city
 
-    result = train_and_predict(df, target=target)
 
-    response = {
-        "city": city,
+def _build_response(target: str, result: dict, lat: float, lon: float) -> dict:
+    """Cacheable prediction payload: depends only on the grid cell, target and engine."""
+    return {
+        "grid": grid_cell(lat, lon),
         "target": target,
         "predictions": result.get("predictions", []),
         "actual": result.get("actual", []),
@@ -159,41 +405,461 @@ async def predict(
         "rain_metrics": result.get("rain_metrics"),
         "observed_past": result.get("observed_past", []),
         "observed_timestamps": result.get("observed_timestamps", []),
+        "model": result.get("model"),
     }
 
-    _set_cached_prediction(lat, lon, target, response)
 
+def _labelled(city: str, payload: dict) -> dict:
+    """
+    Response for one caller: its own label (city as resolved for it, batch id) first, then
+    the shared payload. Labels never go into predict_cache, which every caller of the cell shares.
+    """
+    response = {"city": city}
+    response.update((key, value) for key, value in payload.items() if key != "city")
     return response
 
 
+async def _fetch_frame(lat: float, lon: float):
+    try:
+        return await get_weather_frame(lat, lon)
+    except httpx.HTTPStatusError as http_err:
+        status = http_err.response.status_code
+        raise HTTPException(status_code=status, detail="Error al obtener datos meteorologicos.")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"No se pudo obtener datos meteorologicos: {e}")
+
+
+@router.get("/predict")
+async def predict(
+    request: Request,
+    city: str = "",
+    lat: float | None = None,
+    lon: float | None = None,
+    target: str = "temperature_2m",
+    engine: str = "",
+    format: str = "",
+):
+    # Variable desconocida: 400 antes de geocodificar, seguir la ubicacion o lanzar el modelo
+    target = _parse_targets(target)[0]
+    engine = _parse_engine(engine)
+    fmt = _parse_format(request, format)
+    lat, lon, city = await _resolve_location(city, lat, lon)
+    prewarmer.track(_location_key(lat, lon), engine, lat=lat, lon=lon, city=city)
+    _track_history(lat, lon)
+
+    async def compute(flight: _Flight):
+        return await _compute_prediction(flight, lat, lon, target, engine)
+
+    # Sondeo repetido sobre la misma entrada de cache: 304 sin tocar el cuerpo
+    keys = [_cache_key(lat, lon, target, engine)]
+    scope = ("predict", city, target)
+    validators = await _validators(keys, scope)
+    not_modified = _not_modified(request, validators, fmt)
+    if not_modified is not None:
+        if validators[2]:
+            # Vencida: el 304 no se salta el refresco en segundo plano (stale-while-revalidate)
+            _start_flight(keys[0], compute)
+        return not_modified
+
+    payload = await _get_or_compute_prediction(request, lat, lon, target, engine, compute)
+    return _encoded_response(request, _labelled(city, payload), fmt, await _validators(keys, scope))
+
+
+async def _compute_prediction(flight: _Flight, lat: float, lon: float, target: str, engine: str):
+    """Fetches data, runs the model job and caches the (label-free) payload."""
+    frame = await _fetch_frame(lat, lon)
+    result = await _run_model_job(
+        flight.all_disconnected, train_and_predict, frame, target=target, location=(lat, lon), engine=engine
+    )
+    _observe_model_stages([result])
+
+    payload = _build_response(target, result, lat, lon)
+    _set_cached_prediction(lat, lon, target, engine, payload)
+
+    return payload
+
+
+@router.get("/predict_all")
+async def predict_all(
+    request: Request,
+    city: str = "",
+    lat: float | None = None,
+    lon: float | None = None,
+    targets: str = "",
+    engine: str = "",
+    format: str = "",
+):
+    """
+    Predicciones para varias variables en una sola llamada (default: las cinco).
+    Descarga una vez y entrena todos los modelos en un solo trabajo; reutiliza la cache por variable.
+    """
+    target_list = _parse_targets(targets)
+    engine = _parse_engine(engine)
+    fmt = _parse_format(request, format)
+    lat, lon, city = await _resolve_location(city, lat, lon)
+    prewarmer.track(_location_key(lat, lon), engine, lat=lat, lon=lon, city=city)
+    _track_history(lat, lon)
+
+    keys = [_cache_key(lat, lon, target, engine) for target in target_list]
+    scope = ("predict_all", city, tuple(target_list))
+    validators = await _validators(keys, scope)
+    not_modified = _not_modified(request, validators, fmt)
+    if not_modified is not None:
+        if validators[2]:
+            # Vencidas: refresco compartido en segundo plano, igual que sin If-None-Match
+            _start_targets_flight(lat, lon, [key[2] for key in validators[2]], engine)
+        return not_modified
+
+    results = await _predict_targets(request, lat, lon, target_list, engine)
+    targets = {target: _labelled(city, payload) for target, payload in results.items()}
+    return _encoded_response(
+        request, {"city": city, "grid": grid_cell(lat, lon), "targets": targets}, fmt, await _validators(keys, scope)
+    )
+
+
+@router.get("/predict_stream")
+async def predict_stream(
+    request: Request,
+    city: str = "",
+    lat: float | None = None,
+    lon: float | None = None,
+    targets: str = "temperature_2m",
+    engine: str = "",
+    format: str = "",
+):
+    """
+    Variante en streaming de /api/predict: emite eventos a medida que estan listos.
+    city -> observed (ultimas 24 h) -> baseline (forecast) -> prediction por variable -> done.
+    NDJSON por defecto; SSE con format=sse o Accept: text/event-stream.
+    """
+    target_list = _parse_targets(targets)
+    engine = _parse_engine(engine)
+    sse = format == "sse" or "text/event-stream" in request.headers.get("accept", "")
+    # Ubicacion antes de abrir el stream: errores de ciudad siguen siendo 4xx normales
+    lat, lon, city = await _resolve_location(city, lat, lon)
+    prewarmer.track(_location_key(lat, lon), engine, lat=lat, lon=lon, city=city)
+    _track_history(lat, lon)
+
+    def encode(event: str, payload: dict) -> str:
+        if sse:
+            return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+        return json.dumps({"event": event, **payload}) + "\n"
+
+    async def events():
+        yield encode(
+            "city",
+            {"city": city, "lat": lat, "lon": lon, "grid": grid_cell(lat, lon), "targets": target_list, "engine": engine},
+        )
+        try:
+            frame = await _fetch_frame(lat, lon)
+        except HTTPException as e:
+            yield encode("error", {"status": e.status_code, "detail": e.detail})
+            return
+
+        series = observed_and_baseline(frame, target_list)
+        yield encode("observed", {"timestamps": series["observed_timestamps"], "values": series["observed"]})
+        yield encode("baseline", {"timestamps": series["timestamps"], "values": series["baseline"]})
+
+        # Un trabajo por variable: cada una se emite al terminar, sin esperar al ajuste mas lento
+        async def one(target):
+            async def compute(flight: _Flight):
+                return await _compute_prediction(flight, lat, lon, target, engine)
+
+            try:
+                return target, await _get_or_compute_prediction(request, lat, lon, target, engine, compute), None
+            except HTTPException as e:
+                return target, None, e
+
+        for next_done in asyncio.as_completed([one(t) for t in target_list]):
+            target, response, error = await next_done
+            if error is not None:
+                yield encode("error", {"target": target, "status": error.status_code, "detail": error.detail})
+            else:
+                yield encode("prediction", _labelled(city, response))
+        yield encode("done", {})
+
+    media_type = "text/event-stream" if sse else "application/x-ndjson"
+    return StreamingResponse(events(), media_type=media_type, headers={"Cache-Control": "no-cache"})
+
+
+def _parse_targets(targets: str):
+    target_list = [t.strip() for t in targets.split(",") if t.strip()] or list(TARGETS)
+    unknown = [t for t in target_list if t not in TARGETS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Variables no soportadas: {', '.join(unknown)}")
+    return list(dict.fromkeys(target_list))
+
+
+def _parse_engine(engine: str | None) -> str:
+    engine = (engine or "").strip() or config.MODEL_ENGINE
+    if engine not in ENGINES:
+        raise HTTPException(status_code=400, detail=f"Motor no soportado: {engine}. Opciones: {', '.join(ENGINES)}")
+    return engine
+
+
+async def _predict_targets(request: Request | None, lat: float, lon: float, target_list, engine: str):
+    """
+    Serves every target from cache when possible; the rest (missing or stale) is computed
+    in one shared fetch + train_and_predict_many job.
+    """
+    results = {}
+    refresh = []
+    missing = []
+    for target in target_list:
+        cached = await _get_cached_prediction(lat, lon, target, engine, allow_stale=True)
+        if cached:
+            results[target], is_stale = cached
+            if is_stale:
+                refresh.append(target)
+        else:
+            missing.append(target)
+
+    pending = missing + refresh
+    if not pending:
+        return results
+
+    flight = _start_targets_flight(lat, lon, pending, engine)
+    if not missing:
+        # Todo servible (algunas vencidas): refresco en segundo plano
+        return results
+
+    if request is not None:
+        flight.probes.append(request.is_disconnected)
+    computed = await asyncio.shield(flight.task)
+    for target in missing:
+        results[target] = computed[target]
+    return {target: results[target] for target in target_list}
+
+
+def _start_targets_flight(lat: float, lon: float, targets, engine: str, ttl: float | None = None) -> _Flight:
+    """
+    Shared fetch + train_and_predict_many job for several targets; every result is written
+    to predict_cache (with ttl when given, e.g. by the pre-warm scheduler). Joining a running
+    flight with a ttl sets it on that flight, so its results are stored with it.
+    """
+    async def compute(flight: _Flight):
+        frame = await _fetch_frame(lat, lon)
+        many = await _run_model_job(
+            flight.all_disconnected, train_and_predict_many, frame, targets=targets, location=(lat, lon), engine=engine
+        )
+        _observe_model_stages(many.values())
+        payloads = {}
+        flight.stored_ttl = flight.ttl
+        for target, result in many.items():
+            payloads[target] = _build_response(target, result, lat, lon)
+            _set_cached_prediction(lat, lon, target, engine, payloads[target], ttl=flight.ttl)
+        return payloads
+
+    flight = _start_flight(_cache_key(lat, lon, tuple(targets), engine), compute)
+    if ttl is not None:
+        flight.ttl = ttl
+    return flight
+
+
+async def _prewarm_location(entry: dict, ttl: float):
+    """Recomputes every target of a hot location; registered as the pre-warm refresh callback."""
+    lat, lon, engine = entry["lat"], entry["lon"], entry["engine"]
+    flight = _start_targets_flight(lat, lon, list(TARGETS), engine, ttl=ttl)
+    payloads = await asyncio.shield(flight.task)
+    if flight.stored_ttl != ttl:
+        # Se unio a un calculo que ya habia guardado con el TTL por defecto: se extiende
+        for target, payload in payloads.items():
+            _set_cached_prediction(lat, lon, target, engine, payload, ttl=ttl)
+
+
+prewarmer.set_refresh(_prewarm_location)
+
+
 @router.post("/update")
-async def update_model(payload: dict = Body(default={})):
+async def update_model(request: Request, payload: dict = Body(default={})):
     """
     Reentrena el modelo rapido usando coordenadas dadas (o Bogota por defecto).
     Pensado para el boton "Update Model" del navbar.
     """
+    # Por cliente: un reentrenamiento en bucle no puede acaparar los workers
+    wait = update_limiter.acquire(request.client.host if request.client else "unknown")
+    if wait > 0:
+        raise HTTPException(
+            status_code=429,
+            detail="Demasiadas actualizaciones de modelo; intenta de nuevo mas tarde.",
+            headers={"Retry-After": str(math.ceil(wait))},
+        )
+
     lat = payload.get("lat", 4.61)
     lon = payload.get("lon", -74.08)
     target = payload.get("target", "temperature_2m")
+    engine = _parse_engine(payload.get("engine"))
 
     try:
         if lon > 0:
             lon = -lon
+        lat, lon = snap_to_grid(lat, lon)
 
-        df = fetch_weather_data(lat, lon)
-        train_and_predict(df, target=target, retrain=True)
+        frame = await get_weather_frame(lat, lon)
+        result = await _run_model_job(
+            request.is_disconnected, train_and_predict, frame,
+            target=target, retrain=True, location=(lat, lon), engine=engine,
+        )
+        _observe_model_stages([result])
+        # La proxima prediccion debe usar el modelo recien registrado
+        predict_cache.pop(_cache_key(lat, lon, target, engine), None)
 
         return {
             "status": "ok",
             "message": f"Modelo actualizado para lat={lat}, lon={lon}, target={target}",
+            "model": result.get("model"),
         }
-    except requests.HTTPError as http_err:
-        status = http_err.response.status_code if http_err.response is not None else 502
+    except httpx.HTTPStatusError as http_err:
+        status = http_err.response.status_code
         raise HTTPException(
             status_code=status,
             detail="Error al obtener datos meteorologicos para actualizar el modelo.",
         )
+    except HTTPException:
+        raise
     except ValueError as ve:
         raise HTTPException(status_code=400, detail=str(ve))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"No se pudo actualizar el modelo: {e}")
+
+
+@router.post("/predict_batch")
+async def predict_batch(request: Request, payload: dict = Body(default={})):
+    """
+    Predicciones para muchas ubicaciones en una llamada.
+    Body: {"locations": [{"city": "Cali"} | {"lat": 4.6, "lon": -74.1, "id": "est-1"}, ...],
+           "bbox": [lat_min, lon_min, lat_max, lon_max], "step": 0.25, "targets": [...], "engine": "blend"}
+    Ubicaciones con la misma clave de cache se calculan una sola vez; los errores se devuelven por item.
+    """
+    fmt = _parse_format(request, payload.get("format", ""))
+    targets = payload.get("targets") or []
+    if isinstance(targets, str):
+        targets = targets.split(",")
+    target_list = _parse_targets(",".join(targets))
+    engine = _parse_engine(payload.get("engine"))
+
+    items = list(payload.get("locations") or [])
+    if payload.get("bbox") is not None:
+        items.extend(_grid_points(payload.get("bbox"), payload.get("step", 0.25)))
+    if not items:
+        raise HTTPException(status_code=400, detail="Debes enviar 'locations' o 'bbox'.")
+    if len(items) > config.BATCH_MAX_LOCATIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Maximo {config.BATCH_MAX_LOCATIONS} ubicaciones por lote (recibidas {len(items)}).",
+        )
+
+    # Sin reverse geocoding por item: Nominatim no admite rafagas
+    resolved = await asyncio.gather(
+        *[_resolve_batch_item(item) for item in items],
+        return_exceptions=True,
+    )
+
+    # Agrupa items que comparten clave de cache
+    groups = {}
+    for index, res in enumerate(resolved):
+        if isinstance(res, BaseException):
+            continue
+        lat, lon, _ = res
+        groups.setdefault(_location_key(lat, lon), (lat, lon, []))[2].append(index)
+
+    limit = asyncio.Semaphore(max(1, config.BATCH_CONCURRENCY))
+
+    async def run_group(lat, lon):
+        async with limit:
+            return await _predict_targets(None, lat, lon, target_list, engine)
+
+    group_list = list(groups.values())
+    outcomes = await asyncio.gather(
+        *[run_group(lat, lon) for lat, lon, _ in group_list],
+        return_exceptions=True,
+    )
+
+    results = [None] * len(items)
+    for index, res in enumerate(resolved):
+        if isinstance(res, BaseException):
+            results[index] = _batch_error(index, items[index], res)
+    for (lat, lon, indexes), outcome in zip(group_list, outcomes):
+        for index in indexes:
+            if isinstance(outcome, BaseException):
+                results[index] = _batch_error(index, items[index], outcome)
+            else:
+                # Etiqueta del item (id o ciudad) solo en su respuesta, no en la cache
+                label = resolved[index][2]
+                results[index] = {
+                    "index": index,
+                    "input": items[index],
+                    "ok": True,
+                    "lat": lat,
+                    "lon": lon,
+                    "city": label,
+                    "targets": {target: _labelled(label, payload) for target, payload in outcome.items()},
+                }
+
+    return _encoded_response(request, {
+        "count": len(items),
+        "unique_locations": len(group_list),
+        "failed": sum(1 for r in results if not r["ok"]),
+        "results": results,
+    }, fmt)
+
+
+def _grid_points(bbox, step):
+    try:
+        lat_min, lon_min, lat_max, lon_max = (float(v) for v in bbox)
+        step = float(step)
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="'bbox' debe ser [lat_min, lon_min, lat_max, lon_max] y 'step' numerico.")
+    if step <= 0 or lat_min > lat_max or lon_min > lon_max:
+        raise HTTPException(status_code=400, detail="'bbox' o 'step' invalidos.")
+
+    n_lat = int(round((lat_max - lat_min) / step)) + 1
+    n_lon = int(round((lon_max - lon_min) / step)) + 1
+    if n_lat * n_lon > config.BATCH_MAX_LOCATIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"La grilla genera {n_lat * n_lon} puntos (maximo {config.BATCH_MAX_LOCATIONS}).",
+        )
+    return [
+        {"lat": round(lat_min + i * step, 4), "lon": round(lon_min + j * step, 4)}
+        for i in range(n_lat)
+        for j in range(n_lon)
+    ]
+
+
+async def _resolve_batch_item(item):
+    if not isinstance(item, dict):
+        raise HTTPException(status_code=400, detail="Cada ubicacion debe ser un objeto con 'city' o 'lat'/'lon'.")
+    try:
+        lat = float(item["lat"]) if item.get("lat") is not None else None
+        lon = float(item["lon"]) if item.get("lon") is not None else None
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="'lat'/'lon' deben ser numericos.")
+    lat, lon, city = await _resolve_location(str(item.get("city") or ""), lat, lon, reverse_geocode=False)
+    return lat, lon, item.get("id") or city
+
+
+def _batch_error(index: int, item, err: BaseException) -> dict:
+    if isinstance(err, HTTPException):
+        status, detail = err.status_code, err.detail
+    else:
+        status, detail = 500, str(err)
+    return {"index": index, "input": item, "ok": False, "status": status, "error": detail}
+
+
+@router.get("/history")
+async def history_status():
+    """Estado de la historia local: ubicaciones seguidas, dias completos y ultima ingesta."""
+    return history_ingester.stats()
+
+
+@router.get("/cache_stats")
+async def cache_stats():
+    """Contadores de las caches en memoria (entradas, bytes, hits/misses, evictions)."""
+    return all_stats()
+
+
+@router.get("/prewarm")
+async def prewarm_status():
+    """Estado del pre-calentamiento: proxima corrida, conjunto caliente y contadores."""
+    return prewarmer.stats()
@@ -0,0 +1,12 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from services import metrics
+
+router = APIRouter()
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Metricas en formato de texto de Prometheus (histogramas por etapa, caches, reintentos)."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,266 @@
+import json
+import os
+import re
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import StandardScaler
+
+import config
+from services.engines import get_engine
+from services.features import build_design_matrix, take_rows, valid_rows
+from services.history_store import HistoryStore, location_of
+from services.model_service import (
+    RAIN_THRESHOLD,
+    TARGETS,
+    _from_model_space,
+    _lag_spec,
+    _target_to_model_space,
+)
+
+# Backtesting rolling-origin sobre historia horaria guardada localmente: los CSV de
+# `backtest.py fetch` (history/<slug>.csv) o el almacen que llena la ingesta de la API
+# (history_store/<lat>_<lon>/, ver services/history_store.py), segun `source`.
+
+LOCATIONS_FILE = "locations.json"
+SOURCES = ("csv", "store")
+
+
+def slugify(name: str) -> str:
+    ascii_name = unicodedata.normalize("NFD", name).encode("ascii", "ignore").decode("utf-8")
+    return re.sub(r"[^a-z0-9]+", "-", ascii_name.lower()).strip("-") or "location"
+
+
+def history_path(slug: str, history_dir: str | None = None, source: str = "csv") -> Path:
+    """CSV file of a slug, or the store folder of a location (slug = folder name) with source="store"."""
+    if source == "store":
+        return Path(history_dir or config.HISTORY_STORE_DIR) / slug
+    return Path(history_dir or config.HISTORY_DIR) / f"{slug}.csv"
+
+
+def store_locations(history_dir: str | None = None) -> list:
+    """Slugs (folder names) of every location in the history store."""
+    store = HistoryStore(history_dir or config.HISTORY_STORE_DIR)
+    return [store.location_dir(lat, lon).name for lat, lon in store.locations()]
+
+
+def read_locations(history_dir: str | None = None) -> dict:
+    path = Path(history_dir or config.HISTORY_DIR) / LOCATIONS_FILE
+    if not path.exists():
+        return {}
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def save_history(slug: str, name: str, lat: float, lon: float, df: pd.DataFrame, history_dir: str | None = None) -> Path:
+    """
+    Stores an hourly frame (``time`` + variables, naive UTC) as history/<slug>.csv, merging with
+    rows already stored (new rows win), and records the location in locations.json.
+    """
+    path = history_path(slug, history_dir)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.exists():
+        old = pd.read_csv(path, parse_dates=["time"])
+        df = pd.concat([old, df], ignore_index=True)
+    df = df.drop_duplicates(subset=["time"], keep="last").sort_values("time").reset_index(drop=True)
+    tmp = path.with_suffix(".csv.tmp")
+    df.to_csv(tmp, index=False)
+    os.replace(tmp, path)
+
+    locations = read_locations(history_dir)
+    locations[slug] = {
+        "name": name,
+        "lat": lat,
+        "lon": lon,
+        "start": str(df["time"].iloc[0]),
+        "end": str(df["time"].iloc[-1]),
+        "rows": len(df),
+    }
+    index = path.parent / LOCATIONS_FILE
+    index.write_text(json.dumps(locations, indent=2, ensure_ascii=False), encoding="utf-8")
+    return path
+
+
+def load_history(path) -> pd.DataFrame:
+    """
+    Stored history reindexed to a complete hourly range (gaps become NaN rows). path is a
+    CSV from save_history or a location folder of the history store.
+    """
+    path = Path(path)
+    if path.is_dir():
+        lat, lon = location_of(path.name)
+        return HistoryStore(path.parent).read_all(lat, lon).to_frame()
+    df = pd.read_csv(path, parse_dates=["time"])
+    df = df.drop_duplicates(subset=["time"]).set_index("time").sort_index()
+    full = pd.date_range(df.index[0], df.index[-1], freq="h", name="time")
+    return df.reindex(full).reset_index()
+
+
+@lru_cache(maxsize=8)
+def _design(path: str, mtime: float, targets: tuple):
+    """
+    Design matrix of one location's full history, built once per worker process and reused
+    by every fold (and by later tasks of the same location landing on this worker). mtime
+    (of the CSV or the store folder) invalidates it when the history changes.
+    """
+    df = load_history(path)
+    X, layout = build_design_matrix(df, _lag_spec(targets))
+    times = df["time"].to_numpy(dtype="datetime64[ns]")
+    y = {target: df[target].to_numpy(dtype=np.float64) for target in targets}
+    return X, layout, times, y
+
+
+def fold_origins(n_rows: int, train_hours: int, horizon: int, step: int):
+    """Row positions where each fold's test window starts (train: the train_hours rows before it)."""
+    return list(range(train_hours, n_rows - horizon + 1, step))
+
+
+def run_folds(path: str, slug: str, origins, targets, engine_name: str, train_hours: int, horizon: int) -> list:
+    """
+    Evaluates the given fold origins of one location (runs inside a worker process).
+    Same model path as train_and_predict: shared design matrix, per-target scaler fitted on
+    the training rows, engine fit in model space, predictions mapped back to target units.
+    The test rows use observed values as features (a perfect-forecast upper bound for the
+    forecast inputs the live model gets). Returns one record per (fold, target).
+    """
+    X, layout, times, y = _design(path, os.path.getmtime(path), tuple(targets))
+    engine = get_engine(engine_name)
+    n_base = len(layout.base_cols)
+    records = []
+
+    for target in targets:
+        cols = layout.indices_for(target)
+        ok = valid_rows(X, np.concatenate([np.arange(n_base), layout.lag_indices(target)])) & ~np.isnan(y[target])
+        for origin in origins:
+            train = np.flatnonzero(ok[origin - train_hours:origin]) + origin - train_hours
+            test = np.flatnonzero(ok[origin:origin + horizon]) + origin
+            if len(train) < 2 or len(test) == 0:
+                continue
+
+            scaler = StandardScaler()
+            X_train = take_rows(X, train)[:, cols]
+            models = engine.fit(X_train, scaler.fit_transform(X_train), _target_to_model_space(target, y[target][train]))
+            X_test = take_rows(X, test)[:, cols]
+            preds = _from_model_space(target, engine.predict(models, X_test, scaler.transform(X_test)))
+
+            y_true = y[target][test]
+            last = y[target][origin - 1]
+            record = {
+                "location": slug,
+                "target": target,
+                "origin": str(times[origin]),
+                "n": len(test),
+                "abs_err": float(np.abs(preds - y_true).sum()),
+                # Persistencia: el ultimo valor observado antes del origen
+                "abs_err_persistence": float(np.abs(last - y_true).sum()) if not np.isnan(last) else 0.0,
+                "n_persistence": 0 if np.isnan(last) else len(test),
+            }
+            if target == "precipitation":
+                true_rain = y_true > RAIN_THRESHOLD
+                pred_rain = preds > RAIN_THRESHOLD
+                record.update(
+                    tp=int((true_rain & pred_rain).sum()),
+                    fp=int((~true_rain & pred_rain).sum()),
+                    fn=int((true_rain & ~pred_rain).sum()),
+                )
+            records.append(record)
+    return records
+
+
+def _chunks(items, n_chunks: int):
+    size = max(1, -(-len(items) // max(1, n_chunks)))
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+def run_backtest(
+    locations,
+    targets=TARGETS,
+    engine: str | None = None,
+    train_hours: int = 48,
+    horizon: int = 24,
+    step: int = 24,
+    workers: int | None = None,
+    history_dir: str | None = None,
+    source: str = "csv",
+) -> pd.DataFrame:
+    """
+    Rolling-origin backtest over stored histories (source: "csv" files from save_history or
+    the ingested history "store"). Folds of every location are split into chunks and fanned
+    out across a process pool; each worker builds a location's design matrix once and reuses
+    it for all its folds. Returns one row per (location, target, fold).
+    """
+    if source not in SOURCES:
+        raise ValueError(f"Fuente de historia no soportada: {source}. Opciones: {', '.join(SOURCES)}")
+    engine = engine or config.MODEL_ENGINE
+    get_engine(engine)
+    workers = workers or os.cpu_count() or 1
+    targets = list(targets)
+
+    jobs = []
+    for slug in locations:
+        path = history_path(slug, history_dir, source)
+        if not path.exists():
+            raise FileNotFoundError(f"No hay historia para '{slug}' en {path}")
+        n_rows = len(load_history(path))
+        origins = fold_origins(n_rows, train_hours, horizon, step)
+        # Pocas tareas grandes por ubicacion: la matriz se reutiliza dentro de cada tarea
+        for chunk in _chunks(origins, max(1, workers // max(1, len(locations)))):
+            jobs.append((str(path), slug, chunk, targets, engine, train_hours, horizon))
+
+    records = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_folds, *job) for job in jobs]
+        for done, future in enumerate(as_completed(futures), start=1):
+            records.extend(future.result())
+            print(f"  {done}/{len(futures)} tareas", end="\r", flush=True)
+    print()
+    return pd.DataFrame.from_records(records)
+
+
+def _rain_scores(tp, fp, fn):
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return precision, recall, f1
+
+
+def summarize(folds: pd.DataFrame):
+    """
+    Aggregates fold records into (mae_table, rain_table). MAE is pooled over every test row
+    (sum of errors / rows); rain precision/recall/F1 come from pooled confusion counts.
+    Each table has one row per (location, target) plus an "ALL" row per target.
+    """
+    if folds.empty:
+        return pd.DataFrame(), pd.DataFrame()
+
+    frames = [folds, folds.assign(location="ALL")]
+    pooled = pd.concat(frames, ignore_index=True)
+
+    grouped = pooled.groupby(["location", "target"], sort=True)
+    mae = grouped.agg(
+        folds=("origin", "count"),
+        rows=("n", "sum"),
+        abs_err=("abs_err", "sum"),
+        abs_err_persistence=("abs_err_persistence", "sum"),
+        rows_persistence=("n_persistence", "sum"),
+    )
+    mae["mae"] = mae["abs_err"] / mae["rows"]
+    mae["mae_persistence"] = mae["abs_err_persistence"] / mae["rows_persistence"].replace(0, np.nan)
+    mae["skill"] = 1 - mae["mae"] / mae["mae_persistence"]
+    mae = mae.drop(columns=["abs_err", "abs_err_persistence", "rows_persistence"]).reset_index()
+
+    rain = pd.DataFrame()
+    if "tp" in pooled.columns:
+        counts = pooled.dropna(subset=["tp"]).groupby("location")[["tp", "fp", "fn"]].sum().astype(int)
+        scores = [_rain_scores(*row) for row in counts.itertuples(index=False)]
+        rain = counts.assign(
+            precision=[s[0] for s in scores],
+            recall=[s[1] for s in scores],
+            f1=[s[2] for s in scores],
+            threshold=RAIN_THRESHOLD,
+        ).reset_index()
+
+    return mae, rain
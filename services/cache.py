@@ -0,0 +1,326 @@
+import asyncio
+import itertools
+import random
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import numpy as np
+
+from services.hourly import HourlyFrame
+from services.metrics import register_collector
+from services.shared_cache import CacheBackend, key_text
+
+# Todas las caches creadas, para el barrido periodico y las estadisticas
+_caches: dict = {}
+# Version de cada escritura (base de los ETag). Arranca en un valor aleatorio para que
+# workers distintos y reinicios no repitan versiones al compartir el backend.
+_versions = itertools.count(random.getrandbits(52) << 8)
+# Tras un error del backend compartido, segundos sin consultarlo
+SHARED_RETRY_SECONDS = 5.0
+# Escrituras al backend compartido (set / delete / sweep): un solo hilo, en orden y fuera del
+# event loop. Nadie las espera; un error solo activa el modo solo-memoria.
+_shared_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cache-shared")
+
+
+def approx_size(obj, _depth: int = 0) -> int:
+    """
+    Rough deep size in bytes of typical cache values (dicts/lists of floats and strings,
+    DataFrames, HourlyFrames, NumPy arrays). Good enough for a memory cap, not an exact accounting.
+    """
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(index=True, deep=True).sum())
+    if isinstance(obj, np.ndarray):
+        return int(obj.nbytes)
+    if isinstance(obj, HourlyFrame):
+        return int(obj.values.nbytes) + sys.getsizeof(obj)
+    size = sys.getsizeof(obj)
+    if _depth > 6:
+        return size
+    if isinstance(obj, dict):
+        size += sum(approx_size(k, _depth + 1) + approx_size(v, _depth + 1) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(approx_size(v, _depth + 1) for v in obj)
+    return size
+
+
+class TTLCache:
+    """
+    In-process LRU cache with TTL, optional stale window, entry and approximate byte limits.
+    Entries past their TTL are still readable with allow_stale=True until stale_ttl runs out;
+    the background sweeper removes them afterwards.
+
+    With a shared backend (and a codec to turn values into bytes) the cache becomes the first
+    tier of a two-level cache: writes go through to the backend, and local misses or expired
+    entries are looked up there before reporting a miss, so every worker process sees the
+    values (and versions) computed by the others. Backend I/O never runs on the event loop:
+    the async readers (aget_entry / aget / ameta) query it in a worker thread, the sync ones
+    only see this process, and writes are queued fire-and-forget on a single writer thread.
+    Backend errors never fail a lookup: the cache falls back to in-process only for a few
+    seconds.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        ttl: float,
+        max_entries: int,
+        max_bytes: int | None = None,
+        stale_ttl: float = 0,
+        backend: CacheBackend | None = None,
+        codec=None,
+    ):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max_bytes if max_bytes and max_bytes > 0 else None
+        self._data: OrderedDict = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.backend = backend if codec is not None else None
+        self.codec = codec
+        self.shared_hits = 0
+        self.shared_errors = 0
+        self._shared_down_until = 0.0
+        _caches[name] = self
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get_entry(key, count=False) is not None
+
+    def get_entry(self, key, allow_stale: bool = False, count: bool = True):
+        """
+        Returns (value, is_stale, expires_at) or None. In-process tier only.
+        """
+        return self._lookup(key, self._data.get(key), allow_stale, count)
+
+    async def aget_entry(self, key, allow_stale: bool = False, count: bool = True):
+        """get_entry() that also looks up the shared backend on a local miss or expiry."""
+        return self._lookup(key, await self._load_shared(key), allow_stale, count)
+
+    def _lookup(self, key, entry, allow_stale: bool, count: bool):
+        now = time.time()
+        if entry is None:
+            if count:
+                self.misses += 1
+            return None
+        if entry["expires_at"] >= now:
+            self._touch(key)
+            if count:
+                self.hits += 1
+            return entry["value"], False, entry["expires_at"]
+        if allow_stale and entry["stale_until"] >= now:
+            self._touch(key)
+            if count:
+                self.stale_hits += 1
+            return entry["value"], True, entry["expires_at"]
+        if entry["stale_until"] < now:
+            self._remove(key)
+            self.expirations += 1
+        if count:
+            self.misses += 1
+        return None
+
+    def _touch(self, key):
+        if key in self._data:
+            self._data.move_to_end(key)
+
+    def meta(self, key):
+        """
+        (version, expires_at) of a readable entry (fresh or inside the stale window) or None.
+        Does not count as a hit nor touch the LRU order. version changes on every set().
+        In-process tier only.
+        """
+        return self._meta(self._data.get(key))
+
+    async def ameta(self, key):
+        """meta() that also looks up the shared backend on a local miss or expiry."""
+        return self._meta(await self._load_shared(key))
+
+    @staticmethod
+    def _meta(entry):
+        if entry is None or entry["stale_until"] < time.time():
+            return None
+        return entry["version"], entry["expires_at"]
+
+    def get(self, key, default=None):
+        entry = self.get_entry(key)
+        return entry[0] if entry else default
+
+    async def aget(self, key, default=None):
+        entry = await self.aget_entry(key)
+        return entry[0] if entry else default
+
+    def set(self, key, value, ttl: float | None = None):
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        version = next(_versions)
+        self._store(key, value, expires_at, expires_at + self.stale_ttl, version)
+        if self.backend is not None:
+            self._shared_submit(self._shared_set, key_text(key), value, expires_at, expires_at + self.stale_ttl, version)
+
+    def _store(self, key, value, expires_at: float, stale_until: float, version: int):
+        size = approx_size(value)
+        self._remove(key)
+        if self.max_bytes is not None and size > self.max_bytes:
+            # No cabe ni sola: no se guarda en memoria
+            return None
+        entry = self._data[key] = {
+            "value": value,
+            "expires_at": expires_at,
+            "stale_until": stale_until,
+            "size": size,
+            "version": version,
+        }
+        self.bytes += size
+        self._evict()
+        return entry
+
+    def _shared_call(self, method, *args):
+        """Calls the backend unless it failed recently; errors are counted, never raised."""
+        if time.time() < self._shared_down_until:
+            return None
+        try:
+            return method(*args)
+        except Exception as e:
+            self.shared_errors += 1
+            self._shared_down_until = time.time() + SHARED_RETRY_SECONDS
+            print(f"?? Cache compartida '{self.name}' no disponible ({e}); solo memoria por {SHARED_RETRY_SECONDS:.0f}s")
+            return None
+
+    def _shared_submit(self, method, *args):
+        """Queues a backend write on the writer thread without waiting for it."""
+        if time.time() < self._shared_down_until:
+            return
+        _shared_writer.submit(self._shared_call, method, *args)
+
+    def _shared_set(self, text: str, value, expires_at: float, stale_until: float, version: int):
+        # Corre en el hilo escritor: la serializacion tampoco ocupa el event loop
+        self.backend.set(self.name, text, self.codec.dumps(value), expires_at, stale_until, version)
+
+    def _shared_fetch(self, text: str, local_version):
+        """
+        Worker thread: (value, expires_at, stale_until, version) of a newer shared entry, or
+        None when there is none (or it is the version this process already holds).
+        """
+        found = self._shared_call(self.backend.get, self.name, text)
+        if found is None:
+            return None
+        payload, expires_at, stale_until, version = found
+        if version == local_version:
+            return None
+        try:
+            value = self.codec.loads(payload)
+        except Exception as e:
+            print(f"?? Entrada compartida ilegible en '{self.name}': {e}")
+            return None
+        return value, expires_at, stale_until, version
+
+    async def _load_shared(self, key):
+        """
+        Local entry for key, replaced by a newer one from the shared backend when the local
+        copy is missing or expired. The backend is read (and decoded) off the event loop.
+        """
+        local = self._data.get(key)
+        if self.backend is None or (local is not None and local["expires_at"] >= time.time()):
+            return local
+        if time.time() < self._shared_down_until:
+            return local
+        found = await asyncio.to_thread(self._shared_fetch, key_text(key), local["version"] if local else None)
+        if found is None:
+            return self._data.get(key, local)
+        value, expires_at, stale_until, version = found
+        current = self._data.get(key)
+        if current is not None and current["version"] != (local["version"] if local else None):
+            # Se escribio localmente mientras se leia el backend: lo local es mas reciente
+            return current
+        self.shared_hits += 1
+        return self._store(key, value, expires_at, stale_until, version) or {
+            "value": value,
+            "expires_at": expires_at,
+            "stale_until": stale_until,
+            "size": 0,
+            "version": version,
+        }
+
+    def pop(self, key, default=None):
+        entry = self._remove(key)
+        if self.backend is not None:
+            self._shared_submit(self.backend.delete, self.name, key_text(key))
+        return entry["value"] if entry else default
+
+    def clear(self):
+        self._data.clear()
+        self.bytes = 0
+
+    def _remove(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry["size"]
+        return entry
+
+    def _evict(self):
+        while len(self._data) > self.max_entries or (self.max_bytes is not None and self.bytes > self.max_bytes):
+            key, entry = self._data.popitem(last=False)
+            self.bytes -= entry["size"]
+            self.evictions += 1
+
+    def sweep(self) -> int:
+        """Removes entries past their stale window. Returns how many were dropped."""
+        now = time.time()
+        dead = [key for key, entry in self._data.items() if entry["stale_until"] < now]
+        for key in dead:
+            self._remove(key)
+        self.expirations += len(dead)
+        if self.backend is not None:
+            self._shared_submit(self.backend.sweep, self.name)
+        return len(dead)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._data),
+            "bytes": self.bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "shared": self.backend.describe() if self.backend is not None else None,
+            "shared_hits": self.shared_hits,
+            "shared_errors": self.shared_errors,
+        }
+
+
+def all_stats() -> dict:
+    return {name: cache.stats() for name, cache in _caches.items()}
+
+
+_COUNTERS = ("hits", "stale_hits", "misses", "evictions", "expirations", "shared_hits", "shared_errors")
+
+
+@register_collector
+def _cache_metrics():
+    stats = all_stats()
+    for field in _COUNTERS:
+        samples = [({"cache": name}, s[field]) for name, s in stats.items()]
+        yield f"ecopredict_cache_{field}_total", "counter", f"Cache {field.replace('_', ' ')} per cache.", samples
+    yield "ecopredict_cache_entries", "gauge", "Entries per cache.", [({"cache": n}, s["entries"]) for n, s in stats.items()]
+    yield "ecopredict_cache_bytes", "gauge", "Approximate bytes per cache.", [({"cache": n}, s["bytes"]) for n, s in stats.items()]
+
+
+async def sweep_forever(interval: float):
+    """Background task: periodically drops expired entries from every cache."""
+    while True:
+        await asyncio.sleep(interval)
+        for cache in list(_caches.values()):
+            cache.sweep()
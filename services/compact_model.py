@@ -0,0 +1,232 @@
+import json
+import os
+import struct
+
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.linear_model import LinearRegression
+from sklearn.preprocessing import StandardScaler
+
+# Formato compacto de modelos: arreglos planos en un solo archivo que se abre con mmap
+# (solo lectura), asi varios procesos comparten las mismas paginas del page cache.
+
+MAGIC = b"ECOMDL1\0"
+ALIGN = 64
+_HEADER_LEN = struct.Struct("<Q")
+
+
+class CompactScaler:
+    """StandardScaler.transform from mean/scale arrays."""
+
+    def __init__(self, mean, scale):
+        self.mean_ = mean
+        self.scale_ = scale
+
+    def transform(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        if self.mean_ is not None:
+            X = X - self.mean_
+        if self.scale_ is not None:
+            X = X / self.scale_
+        return X
+
+
+class CompactLinear:
+    """LinearRegression.predict from coef/intercept."""
+
+    def __init__(self, coef, intercept: float):
+        self.coef_ = coef
+        self.intercept_ = intercept
+
+    def predict(self, X):
+        return np.asarray(X, dtype=np.float64) @ self.coef_ + self.intercept_
+
+
+class CompactForest:
+    """
+    Every tree of a fitted regression forest flattened into shared node arrays:
+    feature (int32), threshold (float32), left / right (int32, absolute node ids), value
+    (float32), missing_left (bool) and one root id per tree. Leaves point to themselves and
+    use feature 0, so the traversal is a fixed number of gather + compare steps over all
+    trees and rows at once (depth = deepest tree), with no per-node Python loop.
+
+    Thresholds are rounded down to float32: sklearn compares float32 inputs against float64
+    thresholds, and x32 <= t64 holds exactly when x32 <= the largest float32 not above t64,
+    so routing matches rf.predict; only leaf values lose precision (float32).
+    """
+
+    def __init__(self, feature, threshold, left, right, value, missing_left, roots, depth: int):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.value = value
+        self.missing_left = missing_left
+        self.roots = roots
+        self.depth = depth
+
+    @classmethod
+    def from_sklearn(cls, forest: RandomForestRegressor) -> "CompactForest":
+        features, thresholds, lefts, rights, values, missing, roots = [], [], [], [], [], [], []
+        offset = 0
+        depth = 0
+        for estimator in forest.estimators_:
+            tree = estimator.tree_
+            ids = np.arange(tree.node_count)
+            leaf = tree.children_left == -1
+            threshold = tree.threshold.astype(np.float32)
+            # Redondeo hacia abajo cuando float32 quedo por encima del umbral float64
+            above = threshold.astype(np.float64) > tree.threshold
+            threshold[above] = np.nextafter(threshold[above], np.float32(-np.inf))
+
+            features.append(np.where(leaf, 0, tree.feature).astype(np.int32))
+            thresholds.append(np.where(leaf, np.float32(0), threshold).astype(np.float32))
+            lefts.append((np.where(leaf, ids, tree.children_left) + offset).astype(np.int32))
+            rights.append((np.where(leaf, ids, tree.children_right) + offset).astype(np.int32))
+            values.append(tree.value[:, 0, 0].astype(np.float32))
+            mgl = getattr(tree, "missing_go_to_left", None)
+            missing.append(np.asarray(mgl, dtype=bool) if mgl is not None else np.zeros(tree.node_count, dtype=bool))
+            roots.append(offset)
+            offset += tree.node_count
+            depth = max(depth, tree.max_depth)
+        return cls(
+            np.concatenate(features),
+            np.concatenate(thresholds),
+            np.concatenate(lefts),
+            np.concatenate(rights),
+            np.concatenate(values),
+            np.concatenate(missing),
+            np.asarray(roots, dtype=np.int32),
+            depth,
+        )
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        rows = np.arange(X.shape[0])[None, :]
+        nodes = np.repeat(self.roots[:, None], X.shape[0], axis=1)  # (arboles, filas)
+        for _ in range(self.depth):
+            x = X[rows, self.feature[nodes]]
+            go_left = (x <= self.threshold[nodes]) | (np.isnan(x) & self.missing_left[nodes])
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return self.value[nodes].mean(axis=0, dtype=np.float64)
+
+
+def _linear_arrays(model) -> tuple:
+    return np.asarray(model.coef_, dtype=np.float64), float(model.intercept_)
+
+
+def packable(bundle: dict) -> bool:
+    """True when every part of the bundle has a compact representation (HGB models do not)."""
+    scaler = bundle.get("scaler")
+    if not isinstance(scaler, (StandardScaler, CompactScaler)):
+        return False
+    for model in bundle.get("models", {}).values():
+        if isinstance(model, RandomForestRegressor):
+            if model.n_outputs_ != 1:
+                return False
+        elif not isinstance(model, (LinearRegression, CompactLinear, CompactForest, np.ndarray, float, int)):
+            return False
+    return True
+
+
+def _flatten(bundle: dict):
+    """(arrays {name: ndarray}, header meta) for a packable bundle."""
+    arrays = {}
+    scaler = bundle["scaler"]
+    # Escalado y coeficientes lineales en float64: son pocos numeros y los rezagos colineales
+    # dan coeficientes grandes que se cancelan (float32 amplificaria el error)
+    if getattr(scaler, "mean_", None) is not None:
+        arrays["scaler.mean"] = np.asarray(scaler.mean_, dtype=np.float64)
+    if getattr(scaler, "scale_", None) is not None:
+        arrays["scaler.scale"] = np.asarray(scaler.scale_, dtype=np.float64)
+
+    models = {}
+    for name, model in bundle["models"].items():
+        if isinstance(model, RandomForestRegressor):
+            model = CompactForest.from_sklearn(model)
+        if isinstance(model, CompactForest):
+            for field in ("feature", "threshold", "left", "right", "value", "missing_left", "roots"):
+                arrays[f"{name}.{field}"] = getattr(model, field)
+            models[name] = {"kind": "forest", "depth": int(model.depth)}
+        elif isinstance(model, (LinearRegression, CompactLinear)):
+            coef, intercept = _linear_arrays(model)
+            arrays[f"{name}.coef"] = coef
+            models[name] = {"kind": "linear", "intercept": intercept}
+        elif isinstance(model, np.ndarray):
+            arrays[name] = model
+            models[name] = {"kind": "array"}
+        else:
+            models[name] = {"kind": "scalar", "value": model}
+
+    meta = {k: v for k, v in bundle.items() if k not in ("scaler", "models")}
+    return arrays, {"meta": meta, "models": models}
+
+
+def dump(bundle: dict, fh):
+    """
+    Writes a bundle in the compact layout: magic, header length, JSON header (array name ->
+    dtype / shape / offset) and the raw arrays, each aligned to 64 bytes.
+    """
+    arrays, header = _flatten(bundle)
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        arrays[name] = array
+        offset = -(-offset // ALIGN) * ALIGN
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += array.nbytes
+    header["arrays"] = layout
+    raw = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    data_start = -(-(len(MAGIC) + _HEADER_LEN.size + len(raw)) // ALIGN) * ALIGN
+
+    fh.write(MAGIC + _HEADER_LEN.pack(len(raw)) + raw)
+    fh.write(b"\0" * (data_start - len(MAGIC) - _HEADER_LEN.size - len(raw)))
+    written = 0
+    for name, array in arrays.items():
+        fh.write(b"\0" * (layout[name]["offset"] - written))
+        fh.write(array.tobytes())
+        written = layout[name]["offset"] + array.nbytes
+
+
+def load(path) -> dict:
+    """
+    Opens a compact model file memory-mapped read-only. Returns a bundle usable exactly like
+    the pickled one: scaler.transform and engine.predict(bundle["models"], ...).
+    """
+    if os.path.getsize(path) < len(MAGIC) + _HEADER_LEN.size:
+        raise EOFError(f"Archivo de modelo incompleto: {path}")
+    mm = np.memmap(path, dtype=np.uint8, mode="r")
+    if bytes(mm[: len(MAGIC)]) != MAGIC:
+        raise ValueError(f"No es un modelo compacto: {path}")
+    (header_len,) = _HEADER_LEN.unpack(bytes(mm[len(MAGIC): len(MAGIC) + _HEADER_LEN.size]))
+    start = len(MAGIC) + _HEADER_LEN.size
+    header = json.loads(bytes(mm[start: start + header_len]))
+    data_start = -(-(start + header_len) // ALIGN) * ALIGN
+
+    def array(name):
+        spec = header["arrays"][name]
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"], dtype=np.int64))
+        begin = data_start + spec["offset"]
+        return mm[begin: begin + count * dtype.itemsize].view(dtype).reshape(spec["shape"])
+
+    names = header["arrays"]
+    scaler = CompactScaler(
+        array("scaler.mean") if "scaler.mean" in names else None,
+        array("scaler.scale") if "scaler.scale" in names else None,
+    )
+    models = {}
+    for name, spec in header["models"].items():
+        if spec["kind"] == "forest":
+            models[name] = CompactForest(
+                *(array(f"{name}.{field}") for field in ("feature", "threshold", "left", "right", "value", "missing_left", "roots")),
+                depth=spec["depth"],
+            )
+        elif spec["kind"] == "linear":
+            models[name] = CompactLinear(array(f"{name}.coef"), spec["intercept"])
+        elif spec["kind"] == "array":
+            models[name] = array(name)
+        else:
+            models[name] = spec["value"]
+    return {**header["meta"], "scaler": scaler, "models": models}
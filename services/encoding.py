@@ -0,0 +1,147 @@
+import gzip
+import hashlib
+import json
+from datetime import datetime
+
+try:
+    import orjson
+except ImportError:  # opcional: serializador JSON rapido
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # opcional: formato binario
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:  # opcional: compresion br
+    brotli = None
+
+# Codificacion compacta de respuestas: formatos json / columnar / msgpack,
+# compresion negociada y validadores (ETag) derivados de la version de la cache.
+
+FORMATS = ("json", "columnar", "msgpack")
+MEDIA_TYPES = {
+    "json": "application/json",
+    "columnar": "application/json",
+    "msgpack": "application/x-msgpack",
+}
+MIN_COMPRESS_BYTES = 1024
+TIMESTAMP_KEYS = ("timestamps", "observed_timestamps")
+
+
+class FormatUnavailableError(ValueError):
+    """Known format whose optional dependency is not installed."""
+
+
+def dumps_json(payload) -> bytes:
+    """Compact JSON; orjson when installed (NaN -> null there, error with the stdlib)."""
+    if orjson is not None:
+        return orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False, allow_nan=False).encode("utf-8")
+
+
+def _time_range(values):
+    """{"start", "step_seconds", "count"} when values are evenly spaced timestamps, else None."""
+    if not values:
+        return None
+    try:
+        times = [datetime.fromisoformat(v) for v in values]
+    except (TypeError, ValueError):
+        return None
+    step = (times[1] - times[0]).total_seconds() if len(times) > 1 else 3600.0
+    for prev, cur in zip(times, times[1:]):
+        if (cur - prev).total_seconds() != step:
+            return None
+    return {"start": values[0], "step_seconds": step, "count": len(values)}
+
+
+def columnar(response: dict) -> dict:
+    """
+    Same response with timestamp arrays replaced by start + step + count (kept as arrays
+    when not evenly spaced). Applied recursively to nested per-target responses.
+    """
+    out = {}
+    for key, value in response.items():
+        if key in TIMESTAMP_KEYS and isinstance(value, list):
+            out[key] = _time_range(value) or value
+        elif isinstance(value, dict):
+            out[key] = columnar(value)
+        elif isinstance(value, list) and value and isinstance(value[0], dict):
+            out[key] = [columnar(v) for v in value]
+        else:
+            out[key] = value
+    return out
+
+
+def resolve_format(fmt: str, accept: str = "") -> str:
+    """Explicit ?format= wins; otherwise Accept: application/(x-)msgpack selects msgpack."""
+    fmt = (fmt or "").strip().lower()
+    if not fmt:
+        fmt = "msgpack" if "msgpack" in (accept or "") else "json"
+    if fmt not in FORMATS:
+        raise ValueError(f"Formato no soportado: {fmt}. Opciones: {', '.join(FORMATS)}")
+    if fmt == "msgpack" and msgpack is None:
+        raise FormatUnavailableError("Formato msgpack no disponible (instalar el paquete 'msgpack').")
+    return fmt
+
+
+def encode(payload, fmt: str):
+    """Returns (body bytes, media type) for the given format."""
+    if fmt == "json":
+        return dumps_json(payload), MEDIA_TYPES[fmt]
+    compact = columnar(payload)
+    if fmt == "msgpack":
+        return msgpack.packb(compact, use_bin_type=True), MEDIA_TYPES[fmt]
+    return dumps_json(compact), MEDIA_TYPES[fmt]
+
+
+def negotiate_encoding(accept_encoding: str) -> str | None:
+    """Preferred supported content coding from Accept-Encoding (br over gzip), honouring q=0."""
+    offered = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if name:
+            offered[name.strip().lower()] = q
+    for coding in ("br", "gzip"):
+        if coding == "br" and brotli is None:
+            continue
+        if offered.get(coding, offered.get("*", 0)) > 0:
+            return coding
+    return None
+
+
+def compress(body: bytes, coding: str | None) -> bytes:
+    if coding == "br":
+        return brotli.compress(body, quality=5)
+    if coding == "gzip":
+        return gzip.compress(body, compresslevel=6)
+    return body
+
+
+def make_etag(version: str, fmt: str, scope=()) -> str:
+    """
+    Weak validator: the same version in gzip / br / identity is equivalent. Versions never
+    repeat across restarts or workers (see services/cache.py); scope (endpoint, label,
+    target set...) tells apart different responses built from the same cache entries.
+    """
+    tag = hashlib.blake2s(repr(tuple(scope)).encode("utf-8"), digest_size=4).hexdigest()
+    return f'W/"{version}-{tag}-{fmt}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    opaque = etag.removeprefix("W/")
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == opaque:
+            return True
+    return False
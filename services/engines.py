@@ -0,0 +1,95 @@
+import numpy as np
+from sklearn.ensemble import HistGradientBoostingRegressor, RandomForestRegressor
+from sklearn.linear_model import LinearRegression
+
+
+class BlendEngine:
+    """
+    Default: LinearRegression on scaled features + 200-tree RandomForest on raw features, averaged 50/50.
+    Most accurate of the built-ins, and by far the slowest to fit.
+    """
+
+    name = "blend"
+
+    def fit(self, X_train, X_train_scaled, y_train):
+        lr = LinearRegression()
+        rf = RandomForestRegressor(n_estimators=200, random_state=42)
+
+        lr.fit(X_train_scaled, y_train)
+        rf.fit(X_train, y_train)  # RF no necesita escalado
+        return {"lr": lr, "rf": rf}
+
+    def predict(self, models, X_future, X_future_scaled):
+        preds_lr = models["lr"].predict(X_future_scaled)
+        preds_rf = models["rf"].predict(X_future)
+        return (preds_lr + preds_rf) / 2
+
+
+class RidgeEngine:
+    """
+    Closed-form ridge regression in NumPy on the scaled features: solves (X'X + aI) w = X'y.
+    Sub-millisecond fit; linear only.
+    """
+
+    name = "ridge"
+    alpha = 1.0
+
+    def fit(self, X_train, X_train_scaled, y_train):
+        X = np.asarray(X_train_scaled, dtype=np.float64)
+        y = np.asarray(y_train, dtype=np.float64)
+        x_mean = X.mean(axis=0)
+        y_mean = y.mean()
+        Xc = X - x_mean
+        gram = Xc.T @ Xc + self.alpha * np.eye(X.shape[1])
+        coef = np.linalg.solve(gram, Xc.T @ (y - y_mean))
+        intercept = y_mean - x_mean @ coef
+        return {"coef": coef, "intercept": float(intercept)}
+
+    def predict(self, models, X_future, X_future_scaled):
+        return np.asarray(X_future_scaled, dtype=np.float64) @ models["coef"] + models["intercept"]
+
+
+class HistGBEngine:
+    """
+    Histogram gradient boosting on raw features. Non-linear like RF at a fraction of the fit cost.
+    """
+
+    name = "hgb"
+
+    def fit(self, X_train, X_train_scaled, y_train):
+        # Ventanas de entrenamiento cortas: hojas pequenas para que el modelo no quede plano
+        hgb = HistGradientBoostingRegressor(max_iter=100, learning_rate=0.1, min_samples_leaf=5, random_state=42)
+        hgb.fit(X_train, y_train)
+        return {"hgb": hgb}
+
+    def predict(self, models, X_future, X_future_scaled):
+        return models["hgb"].predict(X_future)
+
+
+class FastRFEngine:
+    """
+    Same LR + RF blend with a small, shallow forest (30 trees, depth 8).
+    """
+
+    name = "rf_fast"
+
+    def fit(self, X_train, X_train_scaled, y_train):
+        lr = LinearRegression()
+        rf = RandomForestRegressor(n_estimators=30, max_depth=8, random_state=42)
+
+        lr.fit(X_train_scaled, y_train)
+        rf.fit(X_train, y_train)
+        return {"lr": lr, "rf": rf}
+
+    def predict(self, models, X_future, X_future_scaled):
+        return (models["lr"].predict(X_future_scaled) + models["rf"].predict(X_future)) / 2
+
+
+ENGINES = {engine.name: engine for engine in (BlendEngine(), RidgeEngine(), HistGBEngine(), FastRFEngine())}
+
+
+def get_engine(name: str):
+    engine = ENGINES.get(name)
+    if engine is None:
+        raise ValueError(f"Motor '{name}' no soportado. Opciones: {', '.join(ENGINES)}")
+    return engine
@@ -0,0 +1,212 @@
+import asyncio
+import math
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+import config
+from services.metrics import Counter, Histogram, register_collector
+
+ADMISSIONS = Counter(
+    "ecopredict_admissions_total",
+    "Model job admission decisions (admitted, queued, rejected_full, rejected_deadline).",
+    ("result",),
+)
+QUEUE_WAIT_SECONDS = Histogram(
+    "ecopredict_admission_wait_seconds",
+    "Time model jobs spent in the admission queue before getting a worker.",
+)
+
+
+class QueueFullError(RuntimeError):
+    """
+    Raised when a job is not admitted: the wait queue is full or its deadline passed.
+    retry_after: suggested seconds before retrying (estimated time to drain the queue).
+    """
+
+    def __init__(self, message: str, retry_after: int = 5):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class JobTimeoutError(TimeoutError):
+    """Raised when a job exceeds its per-job timeout."""
+
+
+class ClientDisconnectedError(RuntimeError):
+    """Raised when the waiting client went away before the job finished."""
+
+
+class ModelExecutor:
+    """
+    Runs CPU-bound model jobs (fit + inference) on a worker pool so the event loop stays free.
+
+    Admission control: at most ``max_workers`` jobs run at once. Further jobs wait in a FIFO
+    queue of ``queue_size`` places for at most ``queue_timeout`` seconds; when the queue is full,
+    or the deadline passes, they fail with QueueFullError carrying a Retry-After estimate
+    (average job duration times the jobs ahead, per worker). Nothing piles up inside the pool,
+    so latency stays bounded under overload. Slots are released when the worker actually
+    finishes, so abandoned jobs (timeout / disconnect) still count until the pool is done with
+    them; a released slot is handed straight to the oldest waiter.
+    """
+
+    def __init__(self, max_workers: int, queue_size: int, timeout: float, kind: str = "process", queue_timeout: float = 5.0):
+        self.max_workers = max(1, max_workers)
+        self.queue_size = max(0, queue_size)
+        self.timeout = timeout
+        self.queue_timeout = queue_timeout
+        self.kind = kind
+        self.in_flight = 0
+        self.avg_job_seconds = 1.0
+        self._waiters: deque = deque()
+        self._pool: Executor | None = None
+
+    @property
+    def capacity(self) -> int:
+        return self.max_workers + self.queue_size
+
+    def start(self):
+        if self._pool is not None:
+            return
+        if self.kind == "thread":
+            self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="model")
+        else:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers)
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.cancel()
+        self._waiters.clear()
+        self.in_flight = 0
+
+    def _release(self):
+        # El cupo pasa directo al primero en espera (sin que otro se lo gane entre medio)
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight = max(0, self.in_flight - 1)
+
+    def _job_done(self, seconds: float):
+        # Media movil de la duracion por trabajo, base del Retry-After
+        self.avg_job_seconds = 0.8 * self.avg_job_seconds + 0.2 * seconds
+        self._release()
+
+    def retry_after(self) -> int:
+        ahead = len(self._waiters) + 1
+        return min(60, max(1, math.ceil(self.avg_job_seconds * ahead / self.max_workers)))
+
+    async def _admit(self):
+        """Takes a worker slot, waiting in the FIFO queue when all are busy."""
+        if self.in_flight < self.max_workers and not self._waiters:
+            self.in_flight += 1
+            ADMISSIONS.inc(result="admitted")
+            return
+        if len(self._waiters) >= self.queue_size:
+            ADMISSIONS.inc(result="rejected_full")
+            raise QueueFullError(
+                f"Cola de entrenamiento llena ({self.max_workers} en curso, {len(self._waiters)} en espera)",
+                retry_after=self.retry_after(),
+            )
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(waiter, timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._discard(waiter)
+            ADMISSIONS.inc(result="rejected_deadline")
+            raise QueueFullError(
+                f"Sin cupo de entrenamiento tras esperar {self.queue_timeout:g}s", retry_after=self.retry_after()
+            )
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release()  # ya tenia cupo asignado
+            else:
+                self._discard(waiter)
+            raise
+        # in_flight no cambia: el cupo liberado se transfirio a este trabajo
+        QUEUE_WAIT_SECONDS.observe(time.perf_counter() - start)
+        ADMISSIONS.inc(result="queued")
+
+    def _discard(self, waiter):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    async def run(self, fn, *args, timeout: float | None = None, is_disconnected=None, **kwargs):
+        """
+        Submits fn(*args, **kwargs) to the pool and awaits it.
+        is_disconnected: optional coroutine function (e.g. Request.is_disconnected) polled while waiting.
+        """
+        await self._admit()
+
+        self.start()
+        loop = asyncio.get_running_loop()
+        submitted = time.perf_counter()
+        try:
+            cfut = self._pool.submit(fn, *args, **kwargs)
+        except Exception:
+            self._release()
+            raise
+        cfut.add_done_callback(lambda _: loop.call_soon_threadsafe(self._job_done, time.perf_counter() - submitted))
+        job = asyncio.wrap_future(cfut, loop=loop)
+
+        watcher = asyncio.create_task(_watch_disconnect(is_disconnected)) if is_disconnected else None
+        waiters = {job} if watcher is None else {job, watcher}
+        timeout = self.timeout if timeout is None else timeout
+
+        try:
+            done, _ = await asyncio.wait(waiters, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            job.cancel()
+            raise
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+
+        if job in done:
+            return job.result()
+
+        # Solo se cancela si aun no empezo; si ya corre, el resultado se descarta
+        job.cancel()
+        if not done:
+            raise JobTimeoutError(f"El trabajo excedio {timeout:g}s")
+        raise ClientDisconnectedError("El cliente cerro la conexion")
+
+
+async def _watch_disconnect(is_disconnected, interval: float = 0.5):
+    while not await is_disconnected():
+        await asyncio.sleep(interval)
+
+
+model_executor = ModelExecutor(
+    max_workers=config.EXECUTOR_WORKERS,
+    queue_size=config.EXECUTOR_QUEUE_SIZE,
+    timeout=config.EXECUTOR_JOB_TIMEOUT,
+    kind=config.EXECUTOR_KIND,
+    queue_timeout=config.EXECUTOR_QUEUE_TIMEOUT,
+)
+
+
+@register_collector
+def _executor_metrics():
+    yield (
+        "ecopredict_executor_in_flight",
+        "gauge",
+        "Model jobs holding a worker slot (running, or abandoned but still running).",
+        [({}, model_executor.in_flight)],
+    )
+    yield "ecopredict_executor_capacity", "gauge", "Maximum admitted model jobs.", [({}, model_executor.capacity)]
+    yield "ecopredict_executor_queue_depth", "gauge", "Model jobs waiting for a worker.", [({}, model_executor.queued)]
@@ -0,0 +1,89 @@
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from services.hourly import HourlyFrame
+
+
+class FeatureLayout:
+    """
+    Column layout of the shared design matrix: base variables first, then the lag block of
+    every target in order. Depends only on the frame schema and the lag spec, so one
+    instance is shared by every location with the same columns.
+    """
+
+    def __init__(self, base_cols: tuple, lag_spec: tuple):
+        self.base_cols = base_cols
+        self.lag_spec = lag_spec  # ((target, (lag, ...)), ...)
+        self.columns = list(base_cols) + [
+            f"{target}_lag{lag}" for target, lags in lag_spec for lag in lags
+        ]
+        self.index = {col: i for i, col in enumerate(self.columns)}
+        self.lags = dict(lag_spec)
+
+    def lag_columns(self, target: str):
+        return [f"{target}_lag{lag}" for lag in self.lags[target]]
+
+    def features_for(self, target: str):
+        """Feature names for one target: every base variable except the target, then its lags."""
+        return [col for col in self.base_cols if col != target] + self.lag_columns(target)
+
+    def lag_indices(self, target: str) -> np.ndarray:
+        return np.array([self.index[col] for col in self.lag_columns(target)], dtype=np.intp)
+
+    def indices_for(self, target: str) -> np.ndarray:
+        return np.array([self.index[col] for col in self.features_for(target)], dtype=np.intp)
+
+
+@lru_cache(maxsize=64)
+def get_layout(base_cols: tuple, lag_spec: tuple) -> FeatureLayout:
+    return FeatureLayout(base_cols, lag_spec)
+
+
+def build_design_matrix(df: "pd.DataFrame | HourlyFrame", lag_spec: tuple):
+    """
+    Builds one C-contiguous float32 matrix with the base variables and every target's lags.
+    df is a weather DataFrame (``time`` + variables) or an HourlyFrame (read as is).
+    Lags come from a single sliding-window view per target (no per-lag shift/copy of the frame);
+    leading rows without enough history hold NaN.
+    Returns (X, layout).
+    """
+    if isinstance(df, HourlyFrame):
+        base_cols, base = df.columns, df.matrix()
+    else:
+        base_cols = tuple(col for col in df.columns if col != "time")
+        base = df[list(base_cols)].to_numpy(dtype=np.float32)
+    layout = get_layout(base_cols, lag_spec)
+
+    n = len(df)
+    X = np.empty((n, len(layout.columns)), dtype=np.float32)
+    n_base = len(base_cols)
+    X[:, :n_base] = base
+
+    col = n_base
+    for target, lags in lag_spec:
+        max_lag = max(lags)
+        series = X[:, base_cols.index(target)]
+        padded = np.concatenate([np.full(max_lag, np.nan, dtype=np.float32), series])
+        # windows[i, max_lag - lag] == series[i - lag]
+        windows = sliding_window_view(padded, max_lag + 1)
+        X[:, col:col + len(lags)] = windows[:, [max_lag - lag for lag in lags]]
+        col += len(lags)
+
+    return X, layout
+
+
+def valid_rows(X: np.ndarray, columns: np.ndarray) -> np.ndarray:
+    """Boolean mask of rows with no NaN in the given columns."""
+    return ~np.isnan(X[:, columns]).any(axis=1)
+
+
+def take_rows(a: np.ndarray, rows: np.ndarray) -> np.ndarray:
+    """Row selection that returns a view (no copy) when rows form a contiguous range."""
+    if len(rows) == 0:
+        return a[:0]
+    if rows[-1] - rows[0] + 1 == len(rows):
+        return a[rows[0]:rows[-1] + 1]
+    return a[rows]
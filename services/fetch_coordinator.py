@@ -0,0 +1,147 @@
+import asyncio
+import contextvars
+import time
+
+import httpx
+
+import config
+from services.http_client import get_json_with_retries
+from services.metrics import Counter, observe_stage
+
+# Agrupa descargas de varias ubicaciones en una sola llamada a Open-Meteo
+# (latitude=a,b,c&longitude=x,y,z) durante una ventana corta.
+
+UPSTREAM_BATCHES = Counter(
+    "ecopredict_upstream_batches_total",
+    "Upstream calls issued by the fetch coordinator, by stage.",
+    ("stage",),
+)
+UPSTREAM_BATCH_LOCATIONS = Counter(
+    "ecopredict_upstream_batch_locations_total",
+    "Locations served by coordinated upstream calls, by stage (divide by batches for the mean batch size).",
+    ("stage",),
+)
+
+
+class _Batch:
+    def __init__(self, build_url, stage: str, timeout: float):
+        self.build_url = build_url
+        self.stage = stage
+        self.timeout = timeout
+        # (lat, lon) -> futuros de quienes esperan ese punto
+        self.points: dict = {}
+        self.timer: asyncio.TimerHandle | None = None
+
+
+class FetchCoordinator:
+    """
+    Micro-batches single-location upstream requests. Requests with the same batch key (same
+    endpoint and same non-location parameters, e.g. the archive date range) that arrive within
+    ``window`` seconds are sent as one multi-location call, with at most ``max_locations``
+    points per call, and the response list is split back per location. The same point asked
+    twice in a window is fetched once.
+
+    If a multi-location call fails with a client error (one bad coordinate rejects the whole
+    call), every point is retried on its own so the others still succeed. window <= 0
+    disables batching.
+    """
+
+    def __init__(self, window: float, max_locations: int):
+        self.window = window
+        self.max_locations = max(1, max_locations)
+        self._pending: dict = {}
+        # Referencias a las llamadas en curso: el loop solo guarda referencias debiles a las tareas
+        self._tasks: set = set()
+
+    async def fetch(self, key, build_url, lat: float, lon: float, stage: str, timeout: float = 15):
+        """
+        Payload of one location. build_url(latitudes, longitudes) returns the request URL for
+        comma-separated coordinate lists; key identifies every other parameter of that URL.
+        """
+        if self.window <= 0:
+            return await get_json_with_retries(build_url(lat, lon), timeout=timeout, stage=stage)
+
+        batch = self._pending.get(key)
+        if batch is None:
+            batch = self._pending[key] = _Batch(build_url, stage, timeout)
+            batch.timer = asyncio.get_running_loop().call_later(self.window, self._flush, key)
+
+        future = asyncio.get_running_loop().create_future()
+        batch.points.setdefault((lat, lon), []).append(future)
+        if len(batch.points) >= self.max_locations:
+            batch.timer.cancel()
+            self._flush(key)
+
+        start = time.perf_counter()
+        try:
+            return await future
+        finally:
+            # La llamada se mide una vez en el lote; aqui solo la espera de esta peticion
+            observe_stage(stage, time.perf_counter() - start, histogram=False)
+
+    def _flush(self, key):
+        batch = self._pending.pop(key, None)
+        if batch is None:
+            return
+        # Contexto vacio: la llamada compartida no se atribuye a la peticion que abrio el lote.
+        # create_task copia el contexto actual, asi que crearla dentro de uno vacio basta (3.8+)
+        task = contextvars.Context().run(asyncio.create_task, self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: _Batch):
+        points = list(batch.points)
+        UPSTREAM_BATCHES.inc(stage=batch.stage)
+        UPSTREAM_BATCH_LOCATIONS.inc(len(points), stage=batch.stage)
+        try:
+            payloads = await self._call(batch, points)
+        except httpx.HTTPStatusError as e:
+            if len(points) == 1 or not 400 <= e.response.status_code < 500:
+                return self._fail(batch, e)
+            # Una coordenada invalida rechaza el lote completo: se reintenta punto por punto
+            outcomes = await asyncio.gather(*[self._call(batch, [p]) for p in points], return_exceptions=True)
+            payloads = [o if isinstance(o, BaseException) else o[0] for o in outcomes]
+        except Exception as e:
+            return self._fail(batch, e)
+
+        for point, payload in zip(points, payloads):
+            for future in batch.points[point]:
+                if future.done():
+                    continue
+                if isinstance(payload, BaseException):
+                    future.set_exception(payload)
+                else:
+                    future.set_result(payload)
+
+    async def _call(self, batch: _Batch, points) -> list:
+        latitudes = ",".join(str(lat) for lat, _ in points)
+        longitudes = ",".join(str(lon) for _, lon in points)
+        payload = await get_json_with_retries(
+            batch.build_url(latitudes, longitudes), timeout=batch.timeout, stage=batch.stage
+        )
+        # Un punto: objeto; varios: lista en el mismo orden de las coordenadas
+        payloads = payload if isinstance(payload, list) else [payload]
+        if len(payloads) != len(points):
+            raise ValueError(f"Respuesta con {len(payloads)} ubicaciones para {len(points)} pedidas")
+        return payloads
+
+    @staticmethod
+    def _fail(batch: _Batch, error: Exception):
+        for futures in batch.points.values():
+            for future in futures:
+                if not future.done():
+                    future.set_exception(error)
+
+    def stats(self) -> dict:
+        return {
+            "window_ms": self.window * 1000,
+            "max_locations": self.max_locations,
+            "pending_batches": len(self._pending),
+            "running_calls": len(self._tasks),
+        }
+
+
+fetch_coordinator = FetchCoordinator(
+    window=config.FETCH_BATCH_WINDOW_MS / 1000,
+    max_locations=config.FETCH_BATCH_MAX_LOCATIONS,
+)
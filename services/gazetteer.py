@@ -0,0 +1,177 @@
+import bisect
+import difflib
+import re
+import unicodedata
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+import config
+from services.metrics import Counter
+
+# Gazetteer local (formato GeoNames) para geocoding y reverse geocoding sin red.
+# Las coincidencias exactas van antes que las APIs remotas; las aproximadas (prefijo,
+# difusa) solo despues, porque con una semilla pequeña confunden municipios parecidos.
+
+GEOCODE_LOOKUPS = Counter(
+    "ecopredict_geocode_lookups_total",
+    "Geocoding lookups by direction and source (local, cache, remote, miss).",
+    ("direction", "source"),
+)
+
+EARTH_RADIUS_KM = 6371.0
+
+# Columnas del dump de GeoNames (geoname table)
+_COL_NAME, _COL_ASCII, _COL_ALT, _COL_LAT, _COL_LON, _COL_CLASS, _COL_POP = 1, 2, 3, 4, 5, 6, 14
+
+
+def normalize_name(name: str) -> str:
+    """Accent- and case-insensitive form used by every name lookup."""
+    ascii_name = unicodedata.normalize("NFD", name).encode("ascii", "ignore").decode("utf-8")
+    return re.sub(r"[^a-z0-9]+", " ", ascii_name.lower()).strip()
+
+
+def _trigrams(text: str):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _unit_vectors(lat, lon) -> np.ndarray:
+    lat, lon = np.radians(lat), np.radians(lon)
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+class Gazetteer:
+    """
+    In-memory place index loaded from a GeoNames-format file (tab separated; only feature
+    class P, populated places). Names: exact, prefix (sorted list + bisect) and fuzzy
+    (trigram candidates ranked by difflib) over the normalized name, ascii name and
+    alternate names; ties go to the most populated place. Coordinates: KD-tree over unit
+    vectors, so the nearest neighbour is exact on the sphere.
+    """
+
+    def __init__(self, places):
+        # places: [(name, lat, lon, population, [names...]), ...]
+        self.names = [p[0] for p in places]
+        self.lat = np.array([p[1] for p in places], dtype=np.float64)
+        self.lon = np.array([p[2] for p in places], dtype=np.float64)
+        self.population = np.array([p[3] for p in places], dtype=np.int64)
+
+        exact = {}
+        for i, place in enumerate(places):
+            for alias in {normalize_name(n) for n in place[4] if n}:
+                if alias:
+                    exact.setdefault(alias, []).append(i)
+        # Por alias, el lugar mas poblado primero
+        self._exact = {k: sorted(v, key=lambda i: -self.population[i]) for k, v in exact.items()}
+        self._sorted = sorted(self._exact)
+        self._trigram_index = {}
+        for alias in self._sorted:
+            for gram in _trigrams(alias):
+                self._trigram_index.setdefault(gram, []).append(alias)
+
+        self._tree = cKDTree(_unit_vectors(self.lat, self.lon)) if places else None
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def from_file(cls, path, min_population: int = 0) -> "Gazetteer":
+        places = []
+        with open(path, encoding="utf-8") as fh:
+            for line in fh:
+                if not line.strip() or line.startswith("#"):
+                    continue
+                cols = line.rstrip("\n").split("\t")
+                if len(cols) <= _COL_POP or cols[_COL_CLASS] != "P":
+                    continue
+                population = int(cols[_COL_POP] or 0)
+                if population < min_population:
+                    continue
+                aliases = [cols[_COL_NAME], cols[_COL_ASCII]] + cols[_COL_ALT].split(",")
+                places.append((cols[_COL_NAME], float(cols[_COL_LAT]), float(cols[_COL_LON]), population, aliases))
+        return cls(places)
+
+    def _place(self, i: int):
+        return float(self.lat[i]), float(self.lon[i]), self.names[i]
+
+    def _best(self, aliases):
+        ids = {i for alias in aliases for i in self._exact[alias]}
+        return max(ids, key=lambda i: self.population[i]) if ids else None
+
+    def geocode(self, query: str, fuzzy_cutoff: float = 0.8, approximate: bool = True):
+        """
+        (lat, lon, name) for a place name, or None. Exact, then (with approximate) prefix,
+        then fuzzy match.
+        """
+        key = normalize_name(query)
+        if not key:
+            return None
+        if key in self._exact:
+            return self._place(self._exact[key][0])
+        if not approximate:
+            return None
+
+        if len(key) >= 3:
+            start = bisect.bisect_left(self._sorted, key)
+            end = bisect.bisect_left(self._sorted, key + "\x7f")
+            best = self._best(self._sorted[start:end])
+            if best is not None:
+                return self._place(best)
+
+        # Difuso: candidatos que comparten trigramas, ordenados por similitud
+        counts = {}
+        for gram in _trigrams(key):
+            for alias in self._trigram_index.get(gram, ()):
+                counts[alias] = counts.get(alias, 0) + 1
+        candidates = sorted(counts, key=counts.get, reverse=True)[:200]
+        matches = difflib.get_close_matches(key, candidates, n=3, cutoff=fuzzy_cutoff)
+        best = self._best(matches[:1])
+        return self._place(best) if best is not None else None
+
+    def reverse(self, lat: float, lon: float, max_km: float):
+        """(name, distance_km) of the nearest place within max_km, or None."""
+        if self._tree is None:
+            return None
+        chord, i = self._tree.query(_unit_vectors([lat], [lon])[0])
+        distance_km = 2 * EARTH_RADIUS_KM * np.arcsin(min(1.0, chord / 2))
+        if distance_km > max_km:
+            return None
+        return self.names[i], float(distance_km)
+
+
+@lru_cache(maxsize=1)
+def get_gazetteer() -> Gazetteer | None:
+    """Loaded once per process from config.GAZETTEER_PATH; None when unset or missing."""
+    path = config.GAZETTEER_PATH
+    if not path or not Path(path).exists():
+        if path:
+            print(f"?? Gazetteer no encontrado en {path}; se usaran solo las APIs remotas")
+        return None
+    gazetteer = Gazetteer.from_file(path, config.GAZETTEER_MIN_POPULATION)
+    print(f"? Gazetteer cargado: {len(gazetteer)} lugares desde {path}")
+    return gazetteer
+
+
+def local_geocode(query: str, approximate: bool = False):
+    """
+    Exact local match by default. approximate=True also tries prefix and fuzzy matches: meant
+    only for after the remote geocoder found nothing ("Girardota" must not become Girardot).
+    """
+    gazetteer = get_gazetteer()
+    return gazetteer.geocode(query, config.GAZETTEER_FUZZY_CUTOFF, approximate) if gazetteer else None
+
+
+def local_reverse(lat: float, lon: float, max_km: float | None = None):
+    """
+    Nearest place within max_km (default config.GAZETTEER_REVERSE_KM, a few km). Only that
+    close is the seed place a safe label; farther points may be in a municipality missing
+    from the seed file, so the wider GAZETTEER_MAX_KM is only for when Nominatim fails.
+    """
+    gazetteer = get_gazetteer()
+    if gazetteer is None:
+        return None
+    found = gazetteer.reverse(lat, lon, config.GAZETTEER_REVERSE_KM if max_km is None else max_km)
+    return found[0] if found else None
@@ -0,0 +1,322 @@
+import asyncio
+import json
+import os
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import config
+from services.hourly import HOUR_NS, HourlyFrame
+from services.http_client import get_json_with_retries
+from services.metrics import Counter, register_collector
+from services.weather_service import HOURLY_PARAMS, _archive_url
+
+# Historia horaria local por ubicacion (celda de la grilla), para entrenar con ventanas
+# largas sin llamadas de red. Columnar y particionada por dia:
+#   <root>/<lat>_<lon>/columns.json
+#   <root>/<lat>_<lon>/<YYYY-MM-DD>.npy          dia completo (inmutable)
+#   <root>/<lat>_<lon>/<YYYY-MM-DD>.partial.npy  dia con horas faltantes (se reemplaza al reingestar)
+# Cada .npy es float32 de forma (variables, 24): una fila contigua por variable.
+
+COLUMNS = tuple(HOURLY_PARAMS.split(","))
+HOURS = 24
+# Los ultimos dias del archivo siguen incompletos unos dias: se vuelven a pedir a lo sumo
+# una vez por este intervalo (el archivo se actualiza por horas), no en cada pasada.
+PARTIAL_REFETCH_SECONDS = 3600.0
+
+HISTORY_DAYS_WRITTEN = Counter(
+    "ecopredict_history_days_written_total",
+    "Day partitions written to the local history store, by completeness.",
+    ("kind",),
+)
+HISTORY_INGEST_RUNS = Counter(
+    "ecopredict_history_ingest_runs_total",
+    "History ingest calls per location, by result.",
+    ("result",),
+)
+
+
+def location_of(name: str):
+    """(lat, lon) of a location folder name (inverse of HistoryStore.location_dir), or None."""
+    try:
+        lat, lon = (float(v) for v in name.split("_"))
+    except ValueError:
+        return None
+    return lat, lon
+
+
+class HistoryStore:
+    """
+    Append-only columnar store of hourly observations per location. Writes go one day at a
+    time through a temp file + os.replace, so readers (request handlers, pool workers) never
+    see half-written partitions. Reads memory-map the day files and place them by index
+    arithmetic (hours since the start of the range); there is no time column to parse.
+    """
+
+    def __init__(self, root: str, columns=COLUMNS):
+        self.root = Path(root)
+        self.columns = tuple(columns)
+
+    def location_dir(self, lat: float, lon: float) -> Path:
+        return self.root / f"{lat:+.4f}_{lon:+.4f}"
+
+    def _day_paths(self, folder: Path, day: date):
+        return folder / f"{day.isoformat()}.npy", folder / f"{day.isoformat()}.partial.npy"
+
+    def locations(self) -> list:
+        """(lat, lon) of every location with a folder in the store, sorted."""
+        if not self.root.exists():
+            return []
+        found = (location_of(folder.name) for folder in self.root.iterdir() if folder.is_dir())
+        return sorted(loc for loc in found if loc is not None)
+
+    def stored_days(self, lat: float, lon: float) -> list:
+        """Sorted days with a partition (complete or partial)."""
+        folder = self.location_dir(lat, lon)
+        if not folder.exists():
+            return []
+        return sorted({date.fromisoformat(path.name[:10]) for path in folder.glob("*.npy")})
+
+    def complete_days(self, lat: float, lon: float) -> set:
+        folder = self.location_dir(lat, lon)
+        if not folder.exists():
+            return set()
+        return {
+            date.fromisoformat(path.name[:10])
+            for path in folder.glob("*.npy")
+            if not path.name.endswith(".partial.npy")
+        }
+
+    def write_frame(self, lat: float, lon: float, frame) -> int:
+        """
+        Stores the hourly rows of frame (HourlyFrame, or DataFrame with naive UTC ``time``)
+        by day. Complete days already stored are left untouched; partial ones are merged
+        with the new values. Returns the number of day partitions written.
+        """
+        frame = HourlyFrame.of(frame)
+        if not len(frame):
+            return 0
+        folder = self.location_dir(lat, lon)
+        folder.mkdir(parents=True, exist_ok=True)
+        columns_file = folder / "columns.json"
+        if not columns_file.exists():
+            columns_file.write_text(json.dumps(list(self.columns)), encoding="utf-8")
+
+        days = frame.hours // HOURS
+        hours = frame.hours % HOURS
+        values = np.stack(
+            [frame.column(col) if col in frame else np.full(len(frame), np.nan, np.float32) for col in self.columns]
+        )
+
+        written = 0
+        for day in np.unique(days):
+            day_date = np.datetime64(int(day), "D").astype(date)
+            full_path, partial_path = self._day_paths(folder, day_date)
+            if full_path.exists():
+                continue
+            block = np.full((len(self.columns), HOURS), np.nan, dtype=np.float32)
+            if partial_path.exists():
+                block[:] = np.load(partial_path)
+            rows = days == day
+            new = values[:, rows]
+            block[:, hours[rows]] = np.where(np.isnan(new), block[:, hours[rows]], new)
+
+            complete = not np.isnan(block).any()
+            target = full_path if complete else partial_path
+            tmp = folder / f".{target.name}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as fh:
+                np.save(fh, block)
+            os.replace(tmp, target)
+            if complete and partial_path.exists():
+                partial_path.unlink(missing_ok=True)
+            HISTORY_DAYS_WRITTEN.inc(kind="complete" if complete else "partial")
+            written += 1
+        return written
+
+    def read_block(self, lat: float, lon: float, start: int, hours: int, columns=None) -> HourlyFrame:
+        """
+        ``hours`` hourly rows from epoch hour ``start`` in the given columns (default: all
+        stored ones). Hours not stored are NaN, so the result is always gap-free.
+        """
+        columns = self.columns if columns is None else tuple(columns)
+        rows = [self.columns.index(col) if col in self.columns else None for col in columns]
+        hours = max(0, hours)
+        first_day = start // HOURS
+        n_days = (start + hours - 1) // HOURS - first_day + 1 if hours else 0
+
+        out = np.full((len(columns), n_days * HOURS), np.nan, dtype=np.float32)
+        folder = self.location_dir(lat, lon)
+        for i in range(n_days):
+            day = np.datetime64(first_day + i, "D").astype(date)
+            for path in self._day_paths(folder, day):
+                if path.exists():
+                    block = np.load(path, mmap_mode="r")
+                    for j, row in enumerate(rows):
+                        if row is not None:
+                            out[j, i * HOURS:(i + 1) * HOURS] = block[row]
+                    break
+
+        offset = start - first_day * HOURS
+        return HourlyFrame(start, columns, out[:, offset:offset + hours])
+
+    def read_all(self, lat: float, lon: float) -> HourlyFrame:
+        """Every stored hour from the first to the last stored day (missing days are NaN)."""
+        days = self.stored_days(lat, lon)
+        if not days:
+            return HourlyFrame.empty(self.columns)
+        first = (days[0] - date(1970, 1, 1)).days
+        return self.read_block(lat, lon, first * HOURS, ((days[-1] - days[0]).days + 1) * HOURS)
+
+    def read_range(self, lat: float, lon: float, start, end) -> pd.DataFrame:
+        """Hourly DataFrame for [start, end) (naive UTC timestamps, floored to the hour)."""
+        first = int(pd.Timestamp(start).floor("h").value // HOUR_NS)
+        last = int(pd.Timestamp(end).floor("h").value // HOUR_NS)
+        return self.read_block(lat, lon, first, last - first).to_frame()
+
+
+def with_history(frame: HourlyFrame, location, days: int, store: "HistoryStore | None" = None) -> HourlyFrame:
+    """
+    frame with ``days`` days of stored history prepended (the hours right before its first
+    row, same columns). Local reads only; returns frame unchanged when nothing is stored.
+    """
+    if days <= 0 or location is None or not len(frame):
+        return frame
+    store = store or history_store
+    past = store.read_block(location[0], location[1], frame.start - days * HOURS, days * HOURS, frame.columns)
+    if np.isnan(past.values).all():
+        return frame
+    # Contiguo por construccion: basta concatenar las matrices
+    return HourlyFrame(past.start, frame.columns, np.concatenate([past.values, frame.values], axis=1))
+
+
+class HistoryIngester:
+    """
+    Background filler of the history store. Locations are registered by the API as they are
+    requested; every ``interval`` seconds each one gets the days missing from the last
+    ``days`` days in a single archive call, with at most ``concurrency`` calls at a time.
+    Days already stored as partial (the recent ones the archive has not finalized yet) are
+    only refetched once per ``partial_refetch`` seconds; absent days are fetched right away.
+    """
+
+    def __init__(
+        self,
+        store: HistoryStore,
+        days: int,
+        interval: float,
+        concurrency: int,
+        max_locations: int,
+        partial_refetch: float = PARTIAL_REFETCH_SECONDS,
+    ):
+        self.store = store
+        self.days = days
+        self.interval = interval
+        self.concurrency = max(1, concurrency)
+        self.max_locations = max_locations
+        self.partial_refetch = partial_refetch
+        self._locations: dict = {}
+        # Ultima descarga por ubicacion que incluyo dias parciales
+        self._partial_fetched: dict = {}
+        self.last_run = None
+
+    def track(self, lat: float, lon: float):
+        key = (round(lat, 4), round(lon, 4))
+        if key not in self._locations and len(self._locations) >= self.max_locations:
+            # Descarta la menos reciente
+            oldest = min(self._locations, key=self._locations.get)
+            del self._locations[oldest]
+            self._partial_fetched.pop(oldest, None)
+        self._locations[key] = time.time()
+
+    def missing_range(self, lat: float, lon: float, today: date | None = None, partial: bool = True):
+        """
+        (first, last) missing day in the window, or None when every day is complete. With
+        partial=False, days stored as partial do not count as missing.
+        """
+        today = today or datetime.utcnow().date()
+        window = [today - timedelta(days=i) for i in range(self.days, 0, -1)]
+        stored = self.store.complete_days(lat, lon) if partial else set(self.store.stored_days(lat, lon))
+        missing = [day for day in window if day not in stored]
+        return (missing[0], missing[-1]) if missing else None
+
+    async def ingest(self, lat: float, lon: float) -> int:
+        span = self.missing_range(lat, lon)
+        if span is None:
+            return 0
+        key = (round(lat, 4), round(lon, 4))
+        now = time.time()
+        if self.missing_range(lat, lon, partial=False) is None and now - self._partial_fetched.get(key, 0.0) < self.partial_refetch:
+            # Solo faltan horas de dias parciales y ya se pidieron hace poco
+            return 0
+        payload = await get_json_with_retries(_archive_url(lat, lon, span[0], span[1]), timeout=60, stage="history")
+        self._partial_fetched[key] = now
+        frame = HourlyFrame.from_payload(payload)
+        # Escritura en disco fuera del event loop
+        return await asyncio.to_thread(self.store.write_frame, lat, lon, frame)
+
+    async def run_once(self) -> dict:
+        limit = asyncio.Semaphore(self.concurrency)
+        start = time.perf_counter()
+
+        async def one(lat, lon):
+            async with limit:
+                return await self.ingest(lat, lon)
+
+        locations = list(self._locations)
+        outcomes = await asyncio.gather(*[one(lat, lon) for lat, lon in locations], return_exceptions=True)
+        written = 0
+        for (lat, lon), outcome in zip(locations, outcomes):
+            if isinstance(outcome, BaseException):
+                HISTORY_INGEST_RUNS.inc(result="error")
+                print(f"?? Ingesta de historia fallida para ({lat}, {lon}): {outcome}")
+            else:
+                HISTORY_INGEST_RUNS.inc(result="ok")
+                written += outcome
+        self.last_run = {
+            "at": time.time(),
+            "locations": len(locations),
+            "days_written": written,
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+        return self.last_run
+
+    def stats(self) -> dict:
+        return {
+            "enabled": config.HISTORY_INGEST_ENABLED,
+            "train_days": config.HISTORY_TRAIN_DAYS,
+            "store_days": self.days,
+            "interval": self.interval,
+            "locations": [
+                {"lat": lat, "lon": lon, "complete_days": len(self.store.complete_days(lat, lon))}
+                for lat, lon in self._locations
+            ],
+            "last_run": self.last_run,
+        }
+
+    async def run_forever(self):
+        """Background task started from the app lifespan."""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                result = await self.run_once()
+                if result["days_written"]:
+                    print(f"? Historia local: {result['days_written']} dias en {result['locations']} ubicaciones")
+            except Exception as e:
+                print(f"?? Error en ingesta de historia: {e}")
+
+
+history_store = HistoryStore(config.HISTORY_STORE_DIR)
+history_ingester = HistoryIngester(
+    history_store,
+    days=config.HISTORY_STORE_DAYS,
+    interval=config.HISTORY_INGEST_INTERVAL_SECONDS,
+    concurrency=config.HISTORY_INGEST_CONCURRENCY,
+    max_locations=config.HISTORY_INGEST_MAX_LOCATIONS,
+)
+
+
+@register_collector
+def _history_metrics():
+    yield "ecopredict_history_locations", "gauge", "Locations tracked by the history ingester.", [({}, len(history_ingester._locations))]
@@ -0,0 +1,150 @@
+import numpy as np
+import pandas as pd
+
+# Representacion liviana de series horarias: indice de horas desde 1970-01-01 (int64) y
+# una matriz float32 (variables, horas). Las filas son siempre horarias y sin huecos, asi
+# que la posicion de una hora es (hora - inicio): las fusiones son aritmetica de indices.
+
+HOUR_NS = 3_600_000_000_000
+
+
+def epoch_hours(times) -> np.ndarray:
+    """
+    int64 hours since the Unix epoch of Open-Meteo ISO timestamps ("YYYY-MM-DDTHH:MM").
+    Evenly spaced lists (the normal case) parse only the first and last item.
+    """
+    n = len(times)
+    if n == 0:
+        return np.empty(0, dtype=np.int64)
+    first, last = np.array([times[0], times[-1]], dtype="datetime64[m]").astype("datetime64[h]").astype(np.int64)
+    if last - first == n - 1:
+        return np.arange(first, last + 1, dtype=np.int64)
+    return np.array(times, dtype="datetime64[m]").astype("datetime64[h]").astype(np.int64)
+
+
+class HourlyFrame:
+    """
+    Gap-free hourly series: ``start`` (epoch hour of the first row), ``columns`` and a
+    float32 ``values`` matrix of shape (len(columns), hours), one contiguous row per
+    variable. Used on the ingestion path (JSON -> arrays -> merge, no intermediate
+    DataFrames) and as the light input of model jobs: it pickles as a few raw buffers and
+    columns are read as views. Treat instances as read-only.
+    """
+
+    __slots__ = ("start", "columns", "values")
+
+    def __init__(self, start: int, columns, values: np.ndarray):
+        self.start = int(start)
+        self.columns = tuple(columns)
+        self.values = values
+
+    def __len__(self) -> int:
+        return self.values.shape[1]
+
+    def __contains__(self, column) -> bool:
+        return column in self.columns
+
+    @property
+    def end(self) -> int:
+        """Epoch hour just after the last row."""
+        return self.start + len(self)
+
+    @property
+    def hours(self) -> np.ndarray:
+        return np.arange(self.start, self.end, dtype=np.int64)
+
+    @property
+    def times(self) -> np.ndarray:
+        """Naive UTC timestamps (datetime64[ns]) of every row."""
+        return (self.hours * HOUR_NS).astype("datetime64[ns]")
+
+    def column(self, name: str) -> np.ndarray:
+        return self.values[self.columns.index(name)]
+
+    def matrix(self, columns=None) -> np.ndarray:
+        """(hours, variables) float32 view, in the given column order (default: all)."""
+        if columns is None:
+            return self.values.T
+        return self.values[[self.columns.index(col) for col in columns]].T
+
+    def slice(self, first: int, last: int | None = None) -> "HourlyFrame":
+        """Rows [first, last) by position (a view, no copy)."""
+        last = len(self) if last is None else last
+        return HourlyFrame(self.start + first, self.columns, self.values[:, first:last])
+
+    @classmethod
+    def empty(cls, columns=()) -> "HourlyFrame":
+        return cls(0, columns, np.empty((len(columns), 0), dtype=np.float32))
+
+    @classmethod
+    def place(cls, hours: np.ndarray, columns, values: np.ndarray) -> "HourlyFrame":
+        """Frame from rows at arbitrary hours: missing hours are NaN, repeated ones keep the last."""
+        if len(hours) == 0:
+            return cls.empty(columns)
+        start = int(hours.min())
+        n = int(hours.max()) - start + 1
+        if n == len(hours) and hours[0] == start and (np.diff(hours) == 1).all():
+            return cls(start, columns, np.ascontiguousarray(values, dtype=np.float32))
+        out = np.full((len(columns), n), np.nan, dtype=np.float32)
+        out[:, hours - start] = values
+        return cls(start, columns, out)
+
+    @classmethod
+    def from_payload(cls, payload) -> "HourlyFrame":
+        """
+        Parses the ``hourly`` block of an Open-Meteo response straight into float32 arrays
+        (null -> NaN). Every key other than ``time`` becomes a column, in payload order.
+        """
+        data = payload.get("hourly", {}) if payload else {}
+        times = data.get("time") or []
+        columns = [key for key in data if key != "time"]
+        if not times:
+            return cls.empty(columns)
+        values = np.array([data[col] for col in columns], dtype=np.float32).reshape(len(columns), len(times))
+        return cls.place(epoch_hours(times), columns, values)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame) -> "HourlyFrame":
+        """View of a weather DataFrame (``time`` + variables); gaps become NaN rows."""
+        times = pd.to_datetime(df["time"])
+        if times.dt.tz is not None:
+            times = times.dt.tz_convert(None)
+        hours = times.to_numpy().astype("datetime64[h]").astype(np.int64)
+        columns = [col for col in df.columns if col != "time"]
+        values = df[columns].to_numpy(dtype=np.float32).T
+        return cls.place(hours, columns, values)
+
+    @classmethod
+    def of(cls, frame) -> "HourlyFrame":
+        return frame if isinstance(frame, HourlyFrame) else cls.from_frame(frame)
+
+    @classmethod
+    def merge(cls, frames) -> "HourlyFrame":
+        """
+        One frame spanning all of them; earlier frames take precedence on overlapping hours
+        (same rule as concat + drop_duplicates(keep="first")). Hours no frame covers are NaN.
+        """
+        frames = [f for f in frames if len(f)]
+        if not frames:
+            return cls.empty()
+        columns = list(dict.fromkeys(col for f in frames for col in f.columns))
+        start = min(f.start for f in frames)
+        out = np.full((len(columns), max(f.end for f in frames) - start), np.nan, dtype=np.float32)
+        # Del de menor a mayor prioridad: cada bloque sobrescribe sus horas por posicion
+        for f in reversed(frames):
+            rows = [columns.index(col) for col in f.columns]
+            out[rows, f.start - start:f.end - start] = f.values
+        return cls(start, columns, out)
+
+    def to_frame(self) -> pd.DataFrame:
+        """DataFrame with naive UTC ``time`` and float32 columns."""
+        frame = {"time": self.times}
+        for i, col in enumerate(self.columns):
+            frame[col] = self.values[i]
+        return pd.DataFrame(frame)
+
+    def __getstate__(self):
+        return self.start, self.columns, np.ascontiguousarray(self.values)
+
+    def __setstate__(self, state):
+        self.start, self.columns, self.values = state
@@ -0,0 +1,68 @@
+import asyncio
+import time
+import httpx
+
+from services.metrics import UPSTREAM_ERRORS, UPSTREAM_RETRIES, observe_stage
+
+# Pool compartido: reutiliza conexiones keep-alive hacia Open-Meteo / Nominatim
+_client: httpx.AsyncClient | None = None
+
+DEFAULT_LIMITS = httpx.Limits(max_connections=50, max_keepalive_connections=20, keepalive_expiry=30)
+
+
+def new_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(limits=DEFAULT_LIMITS, follow_redirects=True)
+
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Returns the process-wide AsyncClient, creating it lazily on first use.
+    """
+    global _client
+    if _client is None or _client.is_closed:
+        _client = new_client()
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None and not _client.is_closed:
+        await _client.aclose()
+    _client = None
+
+
+async def get_json_with_retries(
+    url: str,
+    *,
+    timeout: float = 15,
+    attempts: int = 3,
+    backoff: float = 1.5,
+    headers=None,
+    client: httpx.AsyncClient | None = None,
+    stage: str = "upstream",
+):
+    """
+    Async GET with retries + non-blocking backoff; raises last exception on failure.
+    The whole call (retries included) is recorded as ``stage`` in the metrics.
+    """
+    client = client or get_client()
+    last_err = None
+    start = time.perf_counter()
+    try:
+        for attempt in range(attempts):
+            try:
+                resp = await client.get(url, timeout=timeout, headers=headers)
+                resp.raise_for_status()
+                return resp.json()
+            except httpx.HTTPError as err:
+                last_err = err
+                if attempt == attempts - 1:
+                    UPSTREAM_ERRORS.inc(stage=stage)
+                    raise
+                UPSTREAM_RETRIES.inc(stage=stage)
+                await asyncio.sleep(backoff ** attempt)
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+    if last_err:
+        raise last_err
+    raise RuntimeError("Unexpected error fetching remote data")
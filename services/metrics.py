@@ -0,0 +1,223 @@
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+# Metricas estilo Prometheus en memoria (sin dependencia de prometheus_client) y
+# tiempos por etapa de cada peticion para el header Server-Timing.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+MEMORY_BUCKETS = tuple(1024 * 4 ** k for k in range(2, 10))  # 16 KiB .. 256 MiB
+
+_metrics = {}
+_collectors = []
+# Etapas de la peticion en curso: lista de (etapa, segundos) o None fuera de una peticion
+_request_stages: ContextVar[list | None] = ContextVar("request_stages", default=None)
+
+
+def _label_str(labelnames, values) -> str:
+    if not labelnames:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    """Monotonic counter with optional labels."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics[name] = self
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(labels.get(name, "") for name in self.labelnames), 0)
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_label_str(self.labelnames, key)} {value:g}" for key, value in items]
+
+
+class Histogram:
+    """Cumulative-bucket histogram (seconds) with optional labels."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+        _metrics[name] = self
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+                    break
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self):
+        lines = []
+        with self._lock:
+            items = sorted((key, dict(s, counts=list(s["counts"]))) for key, s in self._series.items())
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, series["counts"]):
+                cumulative += count
+                labels = _label_str(self.labelnames + ("le",), key + (f"{bound:g}",))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _label_str(self.labelnames + ("le",), key + ("+Inf",))
+            lines.append(f"{self.name}_bucket{labels} {series['count']}")
+            base = _label_str(self.labelnames, key)
+            lines.append(f"{self.name}_sum{base} {series['sum']:.6f}")
+            lines.append(f"{self.name}_count{base} {series['count']}")
+        return lines
+
+
+def register_collector(fn):
+    """
+    fn() -> iterable of (name, kind, help, [(labels_dict, value), ...]) evaluated at scrape
+    time, for values that already live elsewhere (cache counters, pool occupancy).
+    """
+    _collectors.append(fn)
+    return fn
+
+
+def render() -> str:
+    """Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for metric in _metrics.values():
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    for collector in _collectors:
+        for name, kind, help_text, samples in collector():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                labelnames = tuple(labels)
+                lines.append(f"{name}{_label_str(labelnames, tuple(labels.values()))} {value:g}")
+    return "\n".join(lines) + "\n"
+
+
+STAGE_SECONDS = Histogram(
+    "ecopredict_stage_seconds",
+    "Duration of request stages (geocoding, upstream fetches, features, fit, predict, serialize).",
+    ("stage",),
+)
+REQUEST_SECONDS = Histogram(
+    "ecopredict_request_seconds",
+    "End-to-end HTTP request duration.",
+    ("method", "handler", "status"),
+)
+REQUEST_MEMORY_BYTES = Histogram(
+    "ecopredict_request_memory_peak_bytes",
+    "Peak Python heap growth while serving a request (tracemalloc, ECOPREDICT_MEMORY_PROFILE=1).",
+    ("handler",),
+    buckets=MEMORY_BUCKETS,
+)
+UPSTREAM_RETRIES = Counter(
+    "ecopredict_upstream_retries_total",
+    "Upstream HTTP attempts that failed and were retried.",
+    ("stage",),
+)
+UPSTREAM_ERRORS = Counter(
+    "ecopredict_upstream_errors_total",
+    "Upstream HTTP calls that failed after every retry.",
+    ("stage",),
+)
+
+
+def begin_request():
+    """Starts collecting stage timings for the current request. Returns (stages, token)."""
+    stages = []
+    return stages, _request_stages.set(stages)
+
+
+def end_request(token):
+    _request_stages.reset(token)
+
+
+def start_memory_profile():
+    """Starts tracemalloc (one frame per allocation: enough for totals, cheapest to trace)."""
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(1)
+
+
+def memory_begin() -> int | None:
+    """Heap size at the start of a request (and resets the peak); None when not tracing."""
+    if not tracemalloc.is_tracing():
+        return None
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    return current
+
+
+def memory_end(start: int) -> dict:
+    """
+    {"peak", "retained"} bytes since memory_begin. tracemalloc is process-wide, so with
+    concurrent requests the figures include the others' allocations: read them under
+    sequential load (benchmarks, profiling runs).
+    """
+    current, peak = tracemalloc.get_traced_memory()
+    return {"peak": max(0, peak - start), "retained": current - start}
+
+
+def observe_stage(stage: str, seconds: float, histogram: bool = True):
+    """
+    Records a stage duration in the histogram and, inside a request, for Server-Timing.
+    histogram=False only reports it to the current request (the work itself was already
+    measured elsewhere, e.g. one shared upstream call waited on by several requests).
+    """
+    if histogram:
+        STAGE_SECONDS.observe(seconds, stage=stage)
+    stages = _request_stages.get()
+    if stages is not None:
+        stages.append((stage, seconds))
+
+
+@contextmanager
+def timed(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+
+def server_timing(stages, total: float | None = None) -> str:
+    """
+    Server-Timing header value; repeated stages (e.g. several fetches) are summed.
+    Durations in milliseconds as the spec requires.
+    """
+    totals = {}
+    for stage, seconds in stages:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    if total is not None:
+        totals["total"] = total
+    return ", ".join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in totals.items())
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+import joblib
+
+import config
+from services import compact_model
+
+MANIFEST = "latest.json"
+# Sube cuando cambia el formato de los bundles o de la matriz de features (invalida claves previas)
+REGISTRY_FORMAT = "2"
+
+# Extension de cada formato de bundle
+SUFFIXES = {"compact": ".cmodel", "joblib": ".joblib"}
+
+# Bundles ya deserializados en este proceso, por (key, version)
+_loaded: OrderedDict = OrderedDict()
+_LOADED_MAX = 32
+
+
+def registry_key(lat: float, lon: float, target: str, features, engine: str = "blend", history_days: int = 0) -> str:
+    """
+    Key = rounded location + target + hash of the ordered feature schema, engine and training
+    window (days of stored history prepended), so a model is never reused with a different
+    column layout, model type or amount of training data.
+    """
+    raw = f"{REGISTRY_FORMAT}:{engine}:" + ",".join(features)
+    if history_days > 0:
+        # Sin historia la clave no cambia: los modelos ya registrados siguen validos
+        raw += f":history={history_days}d"
+    schema = hashlib.sha1(raw.encode("utf-8")).hexdigest()[:10]
+    rlat = round(lat, config.MODEL_REGISTRY_DECIMALS)
+    rlon = round(lon, config.MODEL_REGISTRY_DECIMALS)
+    return f"{rlat:+.{config.MODEL_REGISTRY_DECIMALS}f}_{rlon:+.{config.MODEL_REGISTRY_DECIMALS}f}_{target}_{schema}"
+
+
+def _key_dir(key: str) -> Path:
+    return Path(config.MODEL_REGISTRY_DIR) / key
+
+
+def _versions(folder: Path):
+    out = set()
+    for suffix in SUFFIXES.values():
+        for path in folder.glob(f"v*{suffix}"):
+            try:
+                out.add(int(path.stem[1:]))
+            except ValueError:
+                continue
+    return sorted(out)
+
+
+def read_manifest(key: str):
+    path = _key_dir(key) / MANIFEST
+    try:
+        with open(path, "r", encoding="utf-8") as fh:
+            return json.load(fh)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def save_model(key: str, bundle: dict, meta: dict | None = None) -> dict:
+    """
+    Stores a fitted bundle (scaler/lr/rf/...) as the next version and points the manifest at it.
+    Returns the manifest. Safe across worker processes: version files are claimed exclusively
+    and the manifest is swapped atomically. With MODEL_FORMAT=compact, bundles that have a
+    compact layout (everything but HGB) are written as flat arrays (services/compact_model.py).
+    """
+    folder = _key_dir(key)
+    folder.mkdir(parents=True, exist_ok=True)
+
+    fmt = "compact" if config.MODEL_FORMAT == "compact" and compact_model.packable(bundle) else "joblib"
+    existing = _versions(folder)
+    version = (existing[-1] if existing else 0) + 1
+    while True:
+        path = folder / f"v{version:04d}{SUFFIXES[fmt]}"
+        try:
+            fh = open(path, "xb")
+            break
+        except FileExistsError:
+            version += 1
+    with fh:
+        if fmt == "compact":
+            compact_model.dump(bundle, fh)
+        else:
+            joblib.dump(bundle, fh)
+
+    manifest = {
+        "key": key,
+        "version": version,
+        "file": path.name,
+        "format": fmt,
+        "trained_at": time.time(),
+        **(meta or {}),
+    }
+    tmp = folder / f".{MANIFEST}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(manifest, fh)
+    os.replace(tmp, folder / MANIFEST)
+
+    _prune(folder, keep=config.MODEL_REGISTRY_KEEP, current=version)
+    return manifest
+
+
+def _prune(folder: Path, keep: int, current: int):
+    for version in _versions(folder)[:-keep] if keep > 0 else []:
+        if version == current:
+            continue
+        for suffix in SUFFIXES.values():
+            try:
+                (folder / f"v{version:04d}{suffix}").unlink()
+            except FileNotFoundError:
+                pass
+
+
+def load_model(key: str, max_age: float | None = None):
+    """
+    Returns (bundle, manifest) for the latest version, or None when missing or older than max_age seconds.
+    """
+    manifest = read_manifest(key)
+    if not manifest:
+        return None
+    if max_age is not None and time.time() - manifest.get("trained_at", 0) > max_age:
+        return None
+    memo_key = (key, manifest.get("version"))
+    bundle = _loaded.get(memo_key)
+    if bundle is None:
+        try:
+            path = _key_dir(key) / manifest["file"]
+            if path.suffix == SUFFIXES["compact"]:
+                # Mapeado en memoria: carga casi instantanea y paginas compartidas entre procesos
+                bundle = compact_model.load(path)
+            else:
+                bundle = joblib.load(path)
+        except (FileNotFoundError, EOFError, KeyError, ValueError):
+            return None
+        _loaded[memo_key] = bundle
+        while len(_loaded) > _LOADED_MAX:
+            _loaded.popitem(last=False)
+    else:
+        _loaded.move_to_end(memo_key)
+    return bundle, manifest
@@ -1,10 +1,25 @@
+import time
 import pandas as pd
 import numpy as np
-from sklearn.linear_model import LinearRegression
-from sklearn.ensemble import RandomForestRegressor
 from sklearn.metrics import mean_absolute_error, precision_score, recall_score, f1_score
 from sklearn.preprocessing import StandardScaler
-from datetime import datetime, timezone, timedelta
+from datetime import datetime
+
+import config
+from services import model_registry
+from services.engines import get_engine
+from services.features import build_design_matrix, take_rows, valid_rows
+from services.history_store import with_history
+from services.hourly import HourlyFrame
+
+TARGETS = (
+    "temperature_2m",
+    "relative_humidity_2m",
+    "pressure_msl",
+    "precipitation",
+    "wind_speed_10m",
+)
+RAIN_THRESHOLD = 0.05  # mm (ligera llovizna)
 
 
 def _get_lags_for_target(target: str):
@@ -19,109 +34,91 @@ def _get_lags_for_target(target: str):
     return custom.get(target, (1, 2, 3))
 
 
-def _add_lag_features(df: pd.DataFrame, target: str) -> pd.DataFrame:
-    """
-    Adds lagged versions of the target to capture short-term autocorrelation.
-    Drops rows made NaN by the shifts.
-    """
-    df = df.copy()
-    for lag in _get_lags_for_target(target):
-        df[f"{target}_lag{lag}"] = df[target].shift(lag)
-    df = df.dropna().reset_index(drop=True)
-    return df
-
-
-def train_and_predict(df: pd.DataFrame, target="temperature_2m", retrain=False):
-    """
-    Trains a blended LR + RandomForest model with lag features on past data
-    and predicts the next 24 hours (or available future rows) using forecast features.
-    Returns predictions, MAE (vs futuros conocidos) y los valores reales/timestamps del horizonte futuro.
-    """
+def _lag_spec(targets) -> tuple:
+    return tuple((target, _get_lags_for_target(target)) for target in targets)
 
-    if target not in df.columns:
-        raise ValueError(f"Variable '{target}' not found in dataset")
 
-    df_aug = _add_lag_features(df, target)
-
-    # Use all columns except target and time as features (includes lags)
-    features = [col for col in df_aug.columns if col not in ["time", target]]
-    X = df_aug[features]
-    y = df_aug[target]
+def _empty_result():
+    return {
+        "predictions": [],
+        "mae": None,
+        "actual": [],
+        "timestamps": [],
+    }
 
-    if X.empty or y.empty:
-        print(f"?? No data available for {target} after lagging.")
-        return {
-            "predictions": [],
-            "mae": None,
-            "actual": [],
-            "timestamps": [],
-        }
 
-    # Split past vs future based on current UTC time
-    now_utc = datetime.utcnow().replace(tzinfo=timezone.utc)
-    times_utc = pd.to_datetime(df_aug["time"], utc=True)
+def _split_rows(times_utc: np.ndarray):
+    """
+    Splits row positions into (train, future, observed_tail) around the current UTC time.
+    future is capped to the next 24 rows; falls back to the last 24 rows when no future exists.
+    """
+    now_utc = np.datetime64(datetime.utcnow(), "ns")
+    n = len(times_utc)
 
-    df_past = df_aug.loc[times_utc < now_utc]
-    df_future = df_aug.loc[times_utc >= now_utc]
+    past = np.flatnonzero(times_utc < now_utc)
+    future = np.flatnonzero(times_utc >= now_utc)
 
     # Past observed (últimas 24h reales)
-    obs_tail = df_past.tail(24)
-    obs_past = obs_tail[target] if not obs_tail.empty else pd.Series([], dtype=float)
-    obs_past_ts = obs_tail["time"] if not obs_tail.empty else pd.Series([], dtype=str)
+    obs_tail = past[-24:]
 
     # Futuro: limitar a próximas 24 filas
-    df_future = df_future.head(24)
+    future = future[:24]
 
     # Si no hay futuro, usar filas recientes como fallback, pero no mezclar con pasado observado
-    if df_future.empty:
-        df_future = df_aug.tail(24)
-        df_past = df_aug.iloc[:-len(df_future)] if len(df_aug) > len(df_future) else df_aug.head(0)
+    if len(future) == 0:
+        future = np.arange(max(0, n - 24), n)
+        past = np.arange(0, n - len(future)) if n > len(future) else np.arange(0)
+
+    return past, future, obs_tail
 
-    X_train = df_past[features]
-    y_train = df_past[target]
-    X_future = df_future[features]
-    y_future = df_future[target]
 
+def _target_to_model_space(target, y_train):
     # Transform target for precipitation to handle skew/zeros
-    transform_target = target == "precipitation"
-    rain_metrics = None
-    rain_threshold = 0.05  # mm (ligera llovizna)
-    if transform_target:
-        y_train_model = np.log1p(np.clip(y_train, a_min=0, a_max=None))
-    else:
-        y_train_model = y_train
+    if target == "precipitation":
+        return np.log1p(np.clip(y_train, a_min=0, a_max=None))
+    return y_train
 
-    scaler = StandardScaler()
-    X_train_scaled = scaler.fit_transform(X_train)
-    X_future_scaled = scaler.transform(X_future)
 
-    lr = LinearRegression()
-    rf = RandomForestRegressor(n_estimators=200, random_state=42)
+def _time_strings(times) -> list:
+    return pd.Series(times).astype(str).tolist()
 
-    lr.fit(X_train_scaled, y_train_model)
-    rf.fit(X_train, y_train_model)  # RF no necesita escalado
 
-    preds_lr = lr.predict(X_future_scaled)
-    preds_rf = rf.predict(X_future)
-    blended = (preds_lr + preds_rf) / 2
+def _float_list(values) -> list:
+    # Las series son float32: se pasan por su texto mas corto para que 12.3 siga siendo 12.3
+    # en el JSON (y no 12.300000190734863)
+    return np.asarray(values, dtype=np.float32).astype(str).astype(np.float64).tolist()
 
-    if transform_target:
-        blended = np.expm1(blended)
-        blended = np.clip(blended, a_min=0, a_max=None)
 
-        # Classification metrics for rain/no rain and thresholded regression output
-        y_true_rain = (y_future > rain_threshold).astype(int)
-        y_pred_rain = (blended > rain_threshold).astype(int)
+def _from_model_space(target, blended):
+    """
+    Inverse of _target_to_model_space: back to target units. Precipitation is clipped at 0
+    and values under RAIN_THRESHOLD are forced to zero.
+    """
+    if target != "precipitation":
+        return blended
+    blended = np.clip(np.expm1(blended), a_min=0, a_max=None)
+    return np.where(blended < RAIN_THRESHOLD, 0.0, blended)
 
-        rain_metrics = {
-            "threshold": rain_threshold,
-            "precision": precision_score(y_true_rain, y_pred_rain, zero_division=0),
-            "recall": recall_score(y_true_rain, y_pred_rain, zero_division=0),
-            "f1": f1_score(y_true_rain, y_pred_rain, zero_division=0),
-        }
 
-        # Force small values to zero for the regression output
-        blended = np.where(blended < rain_threshold, 0.0, blended)
+def _rain_metrics(y_true, y_pred) -> dict:
+    """Rain / no-rain classification metrics at RAIN_THRESHOLD."""
+    y_true_rain = (y_true > RAIN_THRESHOLD).astype(int)
+    y_pred_rain = (y_pred > RAIN_THRESHOLD).astype(int)
+    return {
+        "threshold": RAIN_THRESHOLD,
+        "precision": precision_score(y_true_rain, y_pred_rain, zero_division=0),
+        "recall": recall_score(y_true_rain, y_pred_rain, zero_division=0),
+        "f1": f1_score(y_true_rain, y_pred_rain, zero_division=0),
+    }
+
+
+def _build_result(target, blended, y_future, future_times, obs_values, obs_times, model_info=None):
+    """
+    Maps blended model output back to target units and computes MAE / rain metrics.
+    """
+    blended = _from_model_space(target, blended)
+    # Clasificacion lluvia / no lluvia sobre la salida ya umbralizada
+    rain_metrics = _rain_metrics(y_future, blended) if target == "precipitation" else None
 
     mae_test = mean_absolute_error(y_future, blended) if len(y_future) else None
     if mae_test is not None:
@@ -130,11 +127,266 @@ def train_and_predict(df: pd.DataFrame, target="temperature_2m", retrain=False):
         print(f"No MAE computed for {target}.")
 
     return {
-        "predictions": blended.tolist(),
+        "predictions": np.asarray(blended, dtype=np.float64).tolist(),
         "mae": mae_test,
-        "actual": y_future.tolist(),
-        "timestamps": df_future["time"].astype(str).tolist(),
+        "actual": _float_list(y_future),
+        "timestamps": _time_strings(future_times),
         "rain_metrics": rain_metrics,
-        "observed_past": obs_past.tolist(),
-        "observed_timestamps": obs_past_ts.astype(str).tolist(),
+        "observed_past": _float_list(obs_values),
+        "observed_timestamps": _time_strings(obs_times),
+        "model": model_info,
+    }
+
+
+def _slice_scaler(scaler: StandardScaler, idx) -> StandardScaler:
+    """
+    Per-target StandardScaler cut from a scaler fitted on a wider column union.
+    """
+    sliced = StandardScaler()
+    sliced.mean_ = scaler.mean_[idx]
+    sliced.var_ = scaler.var_[idx]
+    sliced.scale_ = scaler.scale_[idx]
+    sliced.n_features_in_ = len(idx)
+    sliced.n_samples_seen_ = scaler.n_samples_seen_
+    return sliced
+
+
+def _load_registered(location, target, features, retrain, engine_name, history_days=0):
+    """
+    Returns (registry_key, bundle, manifest); bundle is None when a refit is needed.
+    """
+    if location is None:
+        return None, None, None
+    key = model_registry.registry_key(location[0], location[1], target, features, engine_name, history_days)
+    if retrain:
+        return key, None, None
+    loaded = model_registry.load_model(key, max_age=config.MODEL_MAX_AGE_SECONDS)
+    if loaded is None:
+        return key, None, None
+    bundle, manifest = loaded
+    return key, bundle, manifest
+
+
+def _model_info(manifest, fitted: bool, engine_name: str, fit_ms: float | None, predict_ms: float):
+    info = {
+        "engine": engine_name,
+        "version": None,
+        "trained_at": None,
+        "fitted": fitted,
+        "fit_ms": round(fit_ms, 3) if fit_ms is not None else None,
+        "predict_ms": round(predict_ms, 3),
     }
+    if manifest is not None:
+        info["version"] = manifest["version"]
+        info["trained_at"] = manifest["trained_at"]
+    return info
+
+
+def _predict_target(target, features, location, retrain, engine_name, X_train, fit_scaler, y_train, X_future, history_days=0):
+    """
+    Inference-only with a fresh registered model when available; otherwise fits
+    (using fit_scaler() -> (scaler, X_train_scaled)) and registers the new model.
+    Returns (blended model-space predictions, model_info).
+    """
+    engine = get_engine(engine_name)
+    key, bundle, manifest = _load_registered(location, target, features, retrain, engine_name, history_days)
+
+    if bundle is not None:
+        start = time.perf_counter()
+        X_future_scaled = bundle["scaler"].transform(X_future)
+        blended = engine.predict(bundle["models"], X_future, X_future_scaled)
+        predict_ms = (time.perf_counter() - start) * 1000
+        return blended, _model_info(manifest, False, engine_name, None, predict_ms)
+
+    start = time.perf_counter()
+    scaler, X_train_scaled = fit_scaler()
+    models = engine.fit(X_train, X_train_scaled, _target_to_model_space(target, y_train))
+    fit_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    blended = engine.predict(models, X_future, scaler.transform(X_future))
+    predict_ms = (time.perf_counter() - start) * 1000
+
+    manifest = None
+    save_ms = None
+    if key is not None:
+        start = time.perf_counter()
+        bundle = {"scaler": scaler, "features": list(features), "target": target, "engine": engine_name, "models": models}
+        manifest = model_registry.save_model(
+            key,
+            bundle,
+            {
+                "target": target,
+                "engine": engine_name,
+                "features": list(features),
+                "rows": len(y_train),
+                "history_days": history_days,
+            },
+        )
+        save_ms = (time.perf_counter() - start) * 1000
+    info = _model_info(manifest, True, engine_name, fit_ms, predict_ms)
+    info["save_ms"] = round(save_ms, 3) if save_ms is not None else None
+    return blended, info
+
+
+def _row_groups(X: np.ndarray, layout, times, targets) -> list:
+    """
+    [(targets, (rows_past, rows_future, rows_obs) or None)]: targets grouped by their valid
+    rows (no NaN in the base variables nor in their lags, so the lag warm-up and gaps are
+    excluded), each group split into train / forecast horizon / observed tail. None when a
+    group has no valid row.
+    """
+    base_idx = np.arange(len(layout.base_cols))
+    # Agrupa targets con las mismas filas validas (misma profundidad de rezagos)
+    groups = {}
+    for target in targets:
+        mask = valid_rows(X, np.concatenate([base_idx, layout.lag_indices(target)]))
+        groups.setdefault(mask.tobytes(), (mask, []))[1].append(target)
+
+    out = []
+    for mask, group_targets in groups.values():
+        rows = np.flatnonzero(mask)
+        if len(rows) == 0:
+            out.append((group_targets, None))
+            continue
+        past, future, obs_tail = _split_rows(times[rows])
+        out.append((group_targets, (rows[past], rows[future], rows[obs_tail])))
+    return out
+
+
+def _train_and_predict_targets(frame: HourlyFrame, targets, retrain, location, engine, history_days=0):
+    """
+    Core of train_and_predict / train_and_predict_many. history_days (the stored history
+    already prepended to frame) is part of the registry key.
+    One float32 design matrix holds the base variables and every target's lags. Targets whose
+    valid rows coincide share the row split and one scaler fitted over the union of their
+    columns (column-wise scaling, so slicing it per target is exact).
+    """
+    start = time.perf_counter()
+    X, layout = build_design_matrix(frame, _lag_spec(targets))
+    features_ms = (time.perf_counter() - start) * 1000
+    times = frame.times
+    base_idx = np.arange(len(layout.base_cols))
+
+    results = {}
+    for group_targets, split in _row_groups(X, layout, times, targets):
+        if split is None:
+            for target in group_targets:
+                print(f"?? No data available for {target} after lagging.")
+                results[target] = _empty_result()
+            continue
+
+        rows_past, rows_future, rows_obs = split
+        X_past = take_rows(X, rows_past)
+        X_future_all = take_rows(X, rows_future)
+
+        union = np.concatenate([base_idx] + [layout.lag_indices(t) for t in group_targets])
+        union_pos = {col: i for i, col in enumerate(union)}
+
+        # Escalado por columna: una sola matriz escalada sirve a todo el grupo (se calcula solo si se entrena)
+        shared = {}
+
+        def shared_scaled():
+            if not shared:
+                scaler = StandardScaler()
+                shared["scaler"] = scaler
+                shared["X"] = scaler.fit_transform(X_past[:, union])
+            return shared["scaler"], shared["X"]
+
+        for target in group_targets:
+            cols = layout.indices_for(target)
+            idx = [union_pos[col] for col in cols]
+            y_col = frame.column(target).astype(np.float64)
+
+            def fit_scaler(idx=idx):
+                scaler, X_scaled = shared_scaled()
+                return _slice_scaler(scaler, idx), X_scaled[:, idx]
+
+            blended, info = _predict_target(
+                target, layout.features_for(target), location, retrain, engine,
+                X_past[:, cols], fit_scaler, y_col[rows_past], X_future_all[:, cols], history_days,
+            )
+            # La matriz de diseño es comun a todas las variables del trabajo
+            info["features_ms"] = round(features_ms, 3)
+            results[target] = _build_result(
+                target, blended, y_col[rows_future], times[rows_future],
+                y_col[rows_obs], times[rows_obs], info,
+            )
+
+    return {target: results[target] for target in targets}
+
+
+def observed_and_baseline(df: "pd.DataFrame | HourlyFrame", targets=TARGETS) -> dict:
+    """
+    Observed last 24 h and forecast baseline for the next rows of each target, on the same
+    valid rows and split as train_and_predict (gaps and the lag warm-up excluded), so they
+    line up with the predictions and can be shown before any model is fitted. Timestamps
+    are per target: targets with different lag depths can have different valid rows.
+    """
+    frame = HourlyFrame.of(df)
+    X, layout = build_design_matrix(frame, _lag_spec(targets))
+    times = frame.times
+    empty = np.arange(0)
+    series = {"observed_timestamps": {}, "observed": {}, "timestamps": {}, "baseline": {}}
+    for group_targets, split in _row_groups(X, layout, times, targets):
+        _, rows_future, rows_obs = split if split is not None else (empty, empty, empty)
+        for target in group_targets:
+            column = frame.column(target)
+            series["observed_timestamps"][target] = _time_strings(times[rows_obs])
+            series["observed"][target] = _float_list(column[rows_obs])
+            series["timestamps"][target] = _time_strings(times[rows_future])
+            series["baseline"][target] = _float_list(column[rows_future])
+    return series
+
+
+def _with_history(frame: HourlyFrame, location, history_days):
+    """
+    (frame with stored history prepended, days actually prepended). Nothing stored means 0
+    days: the registry key reflects the data the model is really trained on.
+    """
+    days = config.HISTORY_TRAIN_DAYS if history_days is None else history_days
+    extended = with_history(frame, location, days)
+    return extended, (days if len(extended) > len(frame) else 0)
+
+
+def train_and_predict(
+    df: "pd.DataFrame | HourlyFrame", target="temperature_2m", retrain=False, location=None, engine=None, history_days=None
+):
+    """
+    Trains a blended LR + RandomForest model with lag features on past data
+    and predicts the next 24 hours (or available future rows) using forecast features.
+    Returns predictions, MAE (vs futuros conocidos) y los valores reales/timestamps del horizonte futuro.
+
+    location: optional (lat, lon). When given, a fresh model from the registry is reused
+    (inference only) unless retrain=True; newly fitted models are registered.
+    engine: model engine name (see services.engines); defaults to config.MODEL_ENGINE.
+    df may also be its HourlyFrame view (services.hourly), the lighter form sent to workers.
+    history_days: days of locally stored history (services.history_store) prepended to df
+    for training, read from disk without network calls; defaults to config.HISTORY_TRAIN_DAYS.
+    """
+    engine = engine or config.MODEL_ENGINE
+    get_engine(engine)
+
+    frame = HourlyFrame.of(df)
+    if target not in frame:
+        raise ValueError(f"Variable '{target}' not found in dataset")
+
+    frame, history_days = _with_history(frame, location, history_days)
+    return _train_and_predict_targets(frame, [target], retrain, location, engine, history_days)[target]
+
+
+def train_and_predict_many(df: "pd.DataFrame | HourlyFrame", targets=TARGETS, retrain=False, location=None, engine=None, history_days=None):
+    """
+    Same model as train_and_predict for several targets in one call: one design matrix,
+    shared row splits and scalers, one worker job. Returns {target: result}.
+    """
+    engine = engine or config.MODEL_ENGINE
+    get_engine(engine)
+
+    frame = HourlyFrame.of(df)
+    missing = [t for t in targets if t not in frame]
+    if missing:
+        raise ValueError(f"Variable '{missing[0]}' not found in dataset")
+
+    frame, history_days = _with_history(frame, location, history_days)
+    return _train_and_predict_targets(frame, list(targets), retrain, location, engine, history_days)
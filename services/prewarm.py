@@ -0,0 +1,157 @@
+import asyncio
+import time
+
+import config
+from services.metrics import Counter, Histogram, register_collector
+
+# Pre-calentamiento: recalcula las ubicaciones mas pedidas justo despues de cada
+# actualizacion horaria de Open-Meteo, para que no paguen fetch + fit en frio.
+
+PREWARM_RUNS = Counter("ecopredict_prewarm_runs_total", "Pre-warm cycles executed.")
+PREWARM_REFRESHES = Counter(
+    "ecopredict_prewarm_refreshes_total",
+    "Hot locations recomputed by the pre-warm scheduler, by result.",
+    ("result",),
+)
+PREWARM_CYCLE_SECONDS = Histogram("ecopredict_prewarm_cycle_seconds", "Duration of a whole pre-warm cycle.")
+
+
+class Prewarmer:
+    """
+    Tracks request counts per (location, engine) and, every ``interval`` seconds at
+    ``offset`` seconds past the cycle start (default: a few minutes after each hour),
+    recomputes the ``top_n`` hottest ones with at most ``concurrency`` at a time.
+    Counts decay by ``decay`` after each cycle so the hot set follows current traffic.
+
+    The refresh itself is a callback (set by the API router): refresh(entry, ttl), where ttl
+    keeps the fresh predictions cached until the next cycle has run.
+    """
+
+    def __init__(
+        self,
+        top_n: int,
+        min_hits: float,
+        interval: float,
+        offset: float,
+        concurrency: int,
+        decay: float,
+        max_tracked: int,
+    ):
+        self.top_n = top_n
+        self.min_hits = min_hits
+        self.interval = interval
+        self.offset = offset
+        self.concurrency = max(1, concurrency)
+        self.decay = decay
+        self.max_tracked = max_tracked
+        self._tracked = {}
+        self._refresh = None
+        self.last_run = None
+
+    def set_refresh(self, refresh):
+        self._refresh = refresh
+
+    def track(self, location_key, engine: str, **info):
+        """
+        Counts one request for (location_key, engine); info (lat, lon, city) is kept for the
+        refresh and the stats. Several labels can share a grid cell: the latest one is shown.
+        """
+        key = (*location_key, engine)
+        entry = self._tracked.get(key)
+        if entry is None:
+            if len(self._tracked) >= self.max_tracked:
+                # Descarta la menos pedida para acotar memoria
+                coldest = min(self._tracked, key=lambda k: self._tracked[k]["hits"])
+                del self._tracked[coldest]
+            entry = self._tracked[key] = {"engine": engine, "hits": 0.0}
+        entry.update(info)
+        entry["hits"] += 1
+        entry["last_seen"] = time.time()
+
+    def hot_set(self) -> list:
+        ranked = sorted(self._tracked.values(), key=lambda e: e["hits"], reverse=True)
+        return [e for e in ranked if e["hits"] >= self.min_hits][: self.top_n]
+
+    def next_run(self, now: float | None = None) -> float:
+        """Epoch seconds of the next cycle: the next multiple of interval, plus offset."""
+        now = time.time() if now is None else now
+        return ((now - self.offset) // self.interval + 1) * self.interval + self.offset
+
+    async def run_once(self) -> dict:
+        entries = self.hot_set()
+        # Hasta despues de la siguiente corrida, con margen para que termine
+        ttl = self.next_run() - time.time() + self.interval * 0.1
+        limit = asyncio.Semaphore(self.concurrency)
+        start = time.perf_counter()
+
+        async def refresh(entry):
+            async with limit:
+                await self._refresh(entry, ttl)
+
+        outcomes = await asyncio.gather(*[refresh(e) for e in entries], return_exceptions=True)
+        failed = 0
+        for entry, outcome in zip(entries, outcomes):
+            if isinstance(outcome, BaseException):
+                failed += 1
+                print(f"?? Pre-calentamiento fallido para {entry.get('city')}: {outcome}")
+        PREWARM_REFRESHES.inc(len(entries) - failed, result="ok")
+        PREWARM_REFRESHES.inc(failed, result="error")
+        PREWARM_RUNS.inc()
+        PREWARM_CYCLE_SECONDS.observe(time.perf_counter() - start)
+
+        for entry in self._tracked.values():
+            entry["hits"] *= self.decay
+        self.last_run = {
+            "at": time.time(),
+            "locations": len(entries),
+            "failed": failed,
+            "seconds": round(time.perf_counter() - start, 3),
+        }
+        return self.last_run
+
+    async def run_forever(self):
+        """Background task started from the app lifespan."""
+        while True:
+            await asyncio.sleep(max(0.0, self.next_run() - time.time()))
+            if self._refresh is None:
+                continue
+            try:
+                result = await self.run_once()
+                print(f"? Pre-calentamiento: {result['locations']} ubicaciones en {result['seconds']}s")
+            except Exception as e:
+                print(f"?? Error en pre-calentamiento: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "enabled": config.PREWARM_ENABLED,
+            "interval": self.interval,
+            "offset": self.offset,
+            "top_n": self.top_n,
+            "min_hits": self.min_hits,
+            "concurrency": self.concurrency,
+            "next_run": self.next_run(),
+            "last_run": self.last_run,
+            "tracked": len(self._tracked),
+            "hot": [
+                {k: e.get(k) for k in ("city", "lat", "lon", "engine")} | {"hits": round(e["hits"], 2)}
+                for e in self.hot_set()
+            ],
+        }
+
+
+prewarmer = Prewarmer(
+    top_n=config.PREWARM_TOP_N,
+    min_hits=config.PREWARM_MIN_HITS,
+    interval=config.PREWARM_INTERVAL_SECONDS,
+    offset=config.PREWARM_OFFSET_SECONDS,
+    concurrency=config.PREWARM_CONCURRENCY,
+    decay=config.PREWARM_DECAY,
+    max_tracked=config.PREWARM_MAX_TRACKED,
+)
+
+
+@register_collector
+def _prewarm_metrics():
+    yield "ecopredict_prewarm_tracked", "gauge", "Locations with request counts.", [({}, len(prewarmer._tracked))]
+    yield "ecopredict_prewarm_hot", "gauge", "Locations in the current hot set.", [({}, len(prewarmer.hot_set()))]
+    yield "ecopredict_prewarm_next_run_timestamp", "gauge", "Epoch seconds of the next cycle.", [({}, prewarmer.next_run())]
@@ -0,0 +1,46 @@
+import time
+from collections import OrderedDict
+
+from services.metrics import Counter
+
+# Limite de frecuencia por cliente (token bucket) para endpoints caros como /api/update
+
+RATE_LIMITED = Counter(
+    "ecopredict_rate_limited_total",
+    "Requests rejected with 429 by the per-client rate limiter, by endpoint.",
+    ("endpoint",),
+)
+
+
+class RateLimiter:
+    """
+    Token bucket per client: ``burst`` requests at once, refilled at ``per_minute`` per minute.
+    Only the ``max_clients`` most recently seen clients are tracked (LRU), so memory stays
+    bounded; a forgotten client simply starts again with a full bucket. per_minute <= 0
+    disables the limit.
+    """
+
+    def __init__(self, name: str, per_minute: float, burst: int, max_clients: int = 10_000):
+        self.name = name
+        self.rate = per_minute / 60.0
+        self.burst = max(1, burst)
+        self.max_clients = max_clients
+        self._buckets: OrderedDict = OrderedDict()
+
+    def acquire(self, client: str) -> float:
+        """Takes a token for client. Returns 0 when allowed, else seconds until the next token."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        tokens, last = self._buckets.pop(client, (float(self.burst), now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets[client] = (tokens, now)
+        while len(self._buckets) > self.max_clients:
+            self._buckets.popitem(last=False)
+        if allowed:
+            return 0.0
+        RATE_LIMITED.inc(endpoint=self.name)
+        return (1 - tokens) / self.rate
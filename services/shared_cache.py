@@ -0,0 +1,303 @@
+import io
+import json
+import os
+import socket
+import sqlite3
+import struct
+import threading
+import time
+from datetime import date, datetime
+from functools import lru_cache
+from pathlib import Path
+from urllib.parse import urlparse
+
+import numpy as np
+import pandas as pd
+
+import config
+from services.hourly import HourlyFrame
+
+# Nivel compartido entre procesos (varios workers de uvicorn) detras de cada TTLCache:
+# la cache en memoria sigue siendo el primer nivel y este backend el segundo.
+
+
+class CacheBackend:
+    """
+    Cross-process key/value store used as second tier by TTLCache. Values are opaque bytes
+    (serialized by the cache's codec) stored with their expiry, stale deadline and version,
+    so every worker sees the same freshness and the same ETag version.
+    """
+
+    kind = "base"
+
+    def get(self, namespace: str, key: str):
+        """(payload, expires_at, stale_until, version) or None."""
+        raise NotImplementedError
+
+    def set(self, namespace: str, key: str, payload: bytes, expires_at: float, stale_until: float, version: int):
+        raise NotImplementedError
+
+    def delete(self, namespace: str, key: str):
+        raise NotImplementedError
+
+    def sweep(self, namespace: str) -> int:
+        """Drops entries past their stale deadline; backends with native expiry do nothing."""
+        return 0
+
+    def describe(self) -> dict:
+        return {"kind": self.kind}
+
+
+class SQLiteBackend(CacheBackend):
+    """
+    Shared local SQLite file (WAL mode, so readers do not block the writer). One connection
+    per process, opened lazily: uvicorn workers and forked children never share a handle.
+    """
+
+    kind = "sqlite"
+
+    def __init__(self, path: str, timeout: float = 1.0):
+        self.path = path
+        self.timeout = timeout
+        self._conn = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None or self._pid != os.getpid():
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " namespace TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL,"
+                " expires_at REAL NOT NULL, stale_until REAL NOT NULL, version INTEGER NOT NULL,"
+                " PRIMARY KEY (namespace, key))"
+            )
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def get(self, namespace: str, key: str):
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT value, expires_at, stale_until, version FROM entries"
+                " WHERE namespace = ? AND key = ? AND stale_until >= ?",
+                (namespace, key, time.time()),
+            ).fetchone()
+        return (bytes(row[0]), row[1], row[2], row[3]) if row else None
+
+    def set(self, namespace: str, key: str, payload: bytes, expires_at: float, stale_until: float, version: int):
+        with self._lock:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                (namespace, key, sqlite3.Binary(payload), expires_at, stale_until, version),
+            )
+
+    def delete(self, namespace: str, key: str):
+        with self._lock:
+            self._connection().execute("DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key))
+
+    def sweep(self, namespace: str) -> int:
+        with self._lock:
+            cursor = self._connection().execute(
+                "DELETE FROM entries WHERE namespace = ? AND stale_until < ?", (namespace, time.time())
+            )
+        return cursor.rowcount
+
+    def describe(self) -> dict:
+        return {"kind": self.kind, "path": self.path}
+
+
+# Cabecera de cada valor en Redis: expires_at, stale_until, version
+_REDIS_HEADER = struct.Struct("<ddQ")
+
+
+class RedisBackend(CacheBackend):
+    """
+    Minimal blocking client for the Redis protocol (RESP2: GET / SET PX / DEL), enough for
+    Redis, Valkey, KeyDB or any local stand-in speaking the same protocol. Keys expire
+    natively at the end of the stale window. Calls block, so TTLCache makes them from worker
+    threads (never the event loop); the socket timeout bounds the worst case.
+    """
+
+    kind = "redis"
+
+    def __init__(self, url: str, timeout: float = 0.25, prefix: str = "ecopredict"):
+        parsed = urlparse(url)
+        self.url = url
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+        self.prefix = prefix
+        self._sock = None
+        self._reader = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._sock, self._reader, self._pid = sock, sock.makefile("rb"), os.getpid()
+        if self.password:
+            self._send("AUTH", self.password)
+        if self.db:
+            self._send("SELECT", str(self.db))
+
+    def _close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = self._reader = None
+
+    def _send(self, *args):
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self._sock.sendall(b"".join(parts))
+        return self._read_reply()
+
+    def _read_reply(self):
+        line = self._reader.readline()
+        if not line:
+            raise ConnectionError("Conexion cerrada por el servidor de cache")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest
+        if kind == b"-":
+            raise RuntimeError(rest.decode("utf-8", "replace"))
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            size = int(rest)
+            if size < 0:
+                return None
+            data = self._reader.read(size + 2)
+            return data[:-2]
+        if kind == b"*":
+            return [self._read_reply() for _ in range(int(rest))]
+        raise ConnectionError(f"Respuesta RESP inesperada: {line!r}")
+
+    def _command(self, *args):
+        with self._lock:
+            if self._sock is None or self._pid != os.getpid():
+                self._connect()
+            try:
+                return self._send(*args)
+            except (OSError, ConnectionError):
+                self._close()
+                raise
+
+    def _key(self, namespace: str, key: str) -> str:
+        return f"{self.prefix}:{namespace}:{key}"
+
+    def get(self, namespace: str, key: str):
+        raw = self._command("GET", self._key(namespace, key))
+        if raw is None:
+            return None
+        expires_at, stale_until, version = _REDIS_HEADER.unpack_from(raw)
+        return raw[_REDIS_HEADER.size:], expires_at, stale_until, version
+
+    def set(self, namespace: str, key: str, payload: bytes, expires_at: float, stale_until: float, version: int):
+        ttl_ms = int((stale_until - time.time()) * 1000)
+        if ttl_ms <= 0:
+            return
+        value = _REDIS_HEADER.pack(expires_at, stale_until, version) + payload
+        self._command("SET", self._key(namespace, key), value, "PX", str(ttl_ms))
+
+    def delete(self, namespace: str, key: str):
+        self._command("DEL", self._key(namespace, key))
+
+    def describe(self) -> dict:
+        return {"kind": self.kind, "url": f"redis://{self.host}:{self.port}/{self.db}"}
+
+
+def make_backend(kind: str) -> CacheBackend | None:
+    """Backend for ECOPREDICT_CACHE_BACKEND: memory (None: in-process only), sqlite or redis."""
+    kind = (kind or "memory").strip().lower()
+    if kind == "memory":
+        return None
+    if kind == "sqlite":
+        return SQLiteBackend(config.CACHE_SQLITE_PATH, timeout=config.CACHE_SHARED_TIMEOUT * 4)
+    if kind == "redis":
+        return RedisBackend(config.CACHE_REDIS_URL, timeout=config.CACHE_SHARED_TIMEOUT)
+    raise ValueError(f"ECOPREDICT_CACHE_BACKEND no soportado: {kind}. Opciones: memory, sqlite, redis")
+
+
+@lru_cache(maxsize=1)
+def get_backend() -> CacheBackend | None:
+    backend = make_backend(config.CACHE_BACKEND)
+    if backend is not None:
+        print(f"? Cache compartida entre procesos: {backend.describe()}")
+    return backend
+
+
+# --- Serializacion de valores ---
+
+
+def key_text(key) -> str:
+    """Stable text form of a cache key (tuples of floats / strings)."""
+    return json.dumps(key, separators=(",", ":"), ensure_ascii=False)
+
+
+def _json_default(obj):
+    if isinstance(obj, (np.generic, np.ndarray)):
+        return obj.tolist()
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f"No serializable: {type(obj).__name__}")
+
+
+class JsonCodec:
+    """Prediction responses and geocoding results (tuples come back as lists)."""
+
+    @staticmethod
+    def dumps(value) -> bytes:
+        return json.dumps(value, separators=(",", ":"), default=_json_default).encode("utf-8")
+
+    @staticmethod
+    def loads(payload: bytes):
+        return json.loads(payload)
+
+
+class FrameCodec:
+    """
+    Raw weather frame entries ({"frame", "hour", "archive_end", "archive_until"}, frame an
+    HourlyFrame). The float32 matrix is written as is in an uncompressed .npz (no pickle),
+    with start hour and column names in the JSON meta.
+    """
+
+    @staticmethod
+    def dumps(entry: dict) -> bytes:
+        frame = entry["frame"]
+        meta = {
+            "start": frame.start,
+            "columns": list(frame.columns),
+            "hour": entry["hour"].isoformat(),
+            "archive_end": entry["archive_end"].isoformat(),
+            "archive_until": pd.Timestamp(entry["archive_until"]).isoformat(),
+        }
+        buffer = io.BytesIO()
+        np.savez(buffer, meta=np.array(json.dumps(meta)), values=np.ascontiguousarray(frame.values))
+        return buffer.getvalue()
+
+    @staticmethod
+    def loads(payload: bytes) -> dict:
+        with np.load(io.BytesIO(payload), allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            values = data["values"]
+        return {
+            "frame": HourlyFrame(meta["start"], meta["columns"], values),
+            "hour": datetime.fromisoformat(meta["hour"]),
+            "archive_end": date.fromisoformat(meta["archive_end"]),
+            "archive_until": pd.Timestamp(meta["archive_until"]),
+        }
+
+
+JSON_CODEC = JsonCodec()
+FRAME_CODEC = FrameCodec()
@@ -1,57 +1,263 @@
-import time
-import requests
+import asyncio
+import math
+from contextlib import asynccontextmanager
+import httpx
 import pandas as pd
 from datetime import datetime, timedelta
 
+import config
+from services.cache import TTLCache
+from services.fetch_coordinator import fetch_coordinator
+from services.hourly import HOUR_NS, HourlyFrame
+from services.shared_cache import FRAME_CODEC, get_backend
+from services.http_client import get_json_with_retries, new_client
+from services.metrics import register_collector, timed
 
-def _get_json_with_retries(url: str, *, timeout: int = 15, attempts: int = 3, backoff: float = 1.5, headers=None):
-    """GET with retries + backoff; raises last exception on failure."""
-    last_err = None
-    for attempt in range(attempts):
-        try:
-            resp = requests.get(url, timeout=timeout, headers=headers)
-            resp.raise_for_status()
-            return resp.json()
-        except requests.RequestException as err:
-            last_err = err
-            if attempt == attempts - 1:
-                raise
-            time.sleep(backoff ** attempt)
-    if last_err:
-        raise last_err
-    raise RuntimeError("Unexpected error fetching remote data")
+HOURLY_PARAMS = "temperature_2m,relative_humidity_2m,pressure_msl,precipitation,wind_speed_10m"
+FORECAST_DAYS = 7
 
-def fetch_weather_data(lat: float, lon: float):
-    hourly_params = "temperature_2m,relative_humidity_2m,pressure_msl,precipitation,wind_speed_10m"
+# Cache de datos crudos por ubicacion, alineada al ciclo horario de Open-Meteo.
+# El TTL solo limita cuanto se conserva una ubicacion sin uso; la validez la da la hora.
+frame_cache = TTLCache(
+    "frame",
+    ttl=6 * 3600,
+    max_entries=config.FRAME_CACHE_MAX_ENTRIES,
+    max_bytes=int(config.FRAME_CACHE_MAX_MB * 1024 * 1024),
+    backend=get_backend(),
+    codec=FRAME_CODEC,
+)
+frame_cache_stats = {"hits": 0, "full": 0, "delta": 0}
 
-    # Observed/reanalysis pasado (últimas 24h) desde archivo
-    end_date = datetime.utcnow().date()
-    start_date = (datetime.utcnow() - timedelta(hours=24)).date()
-    archive_url = (
-        "https://archive-api.open-meteo.com/v1/archive"
+
+@register_collector
+def _frame_metrics():
+    samples = [({"result": name}, value) for name, value in frame_cache_stats.items()]
+    yield "ecopredict_frame_lookups_total", "counter", "Weather frame lookups by result (hits, delta, full).", samples
+
+
+# Un lock por ubicacion mientras alguien lo usa: ubicaciones distintas nunca esperan la
+# descarga de otra (y pueden entrar al mismo lote del fetch coordinator)
+_frame_locks: dict = {}
+
+
+@asynccontextmanager
+async def _frame_lock(key):
+    entry = _frame_locks.get(key)
+    if entry is None:
+        entry = _frame_locks[key] = [asyncio.Lock(), 0]
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0:
+            del _frame_locks[key]
+
+
+def snap_to_grid(lat: float, lon: float, resolution: float | None = None):
+    """
+    Nearest node of a regular lat/lon grid of the given resolution (default
+    config.GRID_RESOLUTION). Points inside the same upstream model cell get identical
+    coordinates, hence identical frames, cache entries and registered models.
+    """
+    resolution = config.GRID_RESOLUTION if resolution is None else resolution
+    if resolution <= 0:
+        return round(lat, 4), round(lon, 4)
+    lat = min(90.0, max(-90.0, math.floor(lat / resolution + 0.5) * resolution))
+    lon = (math.floor(lon / resolution + 0.5) * resolution + 180.0) % 360.0 - 180.0
+    # Redondeo final: sin ruido de punto flotante en las claves
+    return round(lat, 6), round(lon, 6)
+
+
+def grid_cell(lat: float, lon: float) -> dict:
+    """Snapped cell as exposed in API responses."""
+    return {"lat": lat, "lon": lon, "resolution": config.GRID_RESOLUTION}
+
+
+def _archive_url(lat, lon, start_date, end_date) -> str:
+    # lat / lon: un punto o listas separadas por comas (llamadas multi-ubicacion)
+    return (
+        f"{config.ARCHIVE_URL}"
         f"?latitude={lat}&longitude={lon}"
         f"&start_date={start_date}&end_date={end_date}"
-        f"&hourly={hourly_params}"
+        f"&hourly={HOURLY_PARAMS}"
         "&timezone=UTC"
     )
-    archive_json = _get_json_with_retries(archive_url, timeout=15)
-    archive_data = archive_json.get("hourly", {}) if archive_json else {}
-    df_archive = pd.DataFrame(archive_data) if archive_data else pd.DataFrame()
 
-    # Forecast futuro (siguiente 7 días; luego se recorta a 24h en el modelo)
-    forecast_url = (
-        f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}"
-        f"&hourly={hourly_params}"
+
+def _forecast_url(lat, lon, start_hour=None, end_hour=None) -> str:
+    url = (
+        f"{config.FORECAST_URL}?latitude={lat}&longitude={lon}"
+        f"&hourly={HOURLY_PARAMS}"
         "&timezone=UTC"
     )
-    forecast_json = _get_json_with_retries(forecast_url, timeout=15)
-    forecast_data = forecast_json.get("hourly", {}) if forecast_json else {}
-    df_forecast = pd.DataFrame(forecast_data) if forecast_data else pd.DataFrame()
+    if start_hour is not None and end_hour is not None:
+        url += f"&start_hour={start_hour:%Y-%m-%dT%H:%M}&end_hour={end_hour:%Y-%m-%dT%H:%M}"
+    return url
+
+
+def _hourly_frame(payload) -> pd.DataFrame:
+    frame = HourlyFrame.from_payload(payload)
+    return frame.to_frame() if len(frame) else pd.DataFrame()
+
+
+def _epoch_hour(ts) -> int:
+    return int(pd.Timestamp(ts).value // HOUR_NS)
+
+
+def _past_window(now: datetime):
+    """(start_date, end_date) of the archive window: last 24h rounded to whole days."""
+    return (now - timedelta(hours=24)).date(), now.date()
+
+
+async def _fetch_point(key, build_url, lat: float, lon: float, stage: str, client: httpx.AsyncClient | None = None):
+    """
+    One location's payload. With the shared client the request goes through the fetch
+    coordinator (batched with other locations); an explicit client calls directly.
+    """
+    if client is not None:
+        return await get_json_with_retries(build_url(lat, lon), timeout=15, client=client, stage=stage)
+    return await fetch_coordinator.fetch(key, build_url, lat, lon, stage=stage, timeout=15)
+
+
+async def _fetch_hourly(lat: float, lon: float, client: httpx.AsyncClient | None = None) -> HourlyFrame:
+    """
+    Downloads archive (last 24h) and forecast hourly data concurrently and merges them.
+    Uses the shared pooled client (and batched upstream calls) unless one is given.
+    """
+    # Observed/reanalysis pasado (últimas 24h) desde archivo
+    start_date, end_date = _past_window(datetime.utcnow())
+
+    # Forecast futuro (siguiente 7 días; luego se recorta a 24h en el modelo)
+    # Ambas llamadas en paralelo sobre el mismo pool de conexiones
+    archive_json, forecast_json = await asyncio.gather(
+        _fetch_point(
+            ("archive", start_date, end_date),
+            lambda lats, lons: _archive_url(lats, lons, start_date, end_date),
+            lat, lon, "archive", client,
+        ),
+        _fetch_point(("forecast",), _forecast_url, lat, lon, "forecast", client),
+    )
+
+    with timed("merge"):
+        # JSON -> arreglos float32 por hora; el archivo gana en horas repetidas
+        merged = HourlyFrame.merge([HourlyFrame.from_payload(archive_json), HourlyFrame.from_payload(forecast_json)])
+        if not len(merged):
+            raise ValueError("No se pudieron obtener datos de archivo ni forecast.")
+        return merged
+
+
+async def fetch_weather_data_async(lat: float, lon: float, client: httpx.AsyncClient | None = None) -> pd.DataFrame:
+    """_fetch_hourly as a DataFrame (naive UTC ``time`` + variables), for scripts."""
+    return (await _fetch_hourly(lat, lon, client)).to_frame()
+
+
+def fetch_weather_data(lat: float, lon: float):
+    """
+    Blocking wrapper around fetch_weather_data_async for scripts and notebooks.
+    Must not be called from inside a running event loop.
+    """
+    async def _run():
+        async with new_client() as client:
+            return await fetch_weather_data_async(lat, lon, client=client)
+
+    return asyncio.run(_run())
+
+
+class _NotContiguous(Exception):
+    pass
+
+
+async def _refresh_delta(lat: float, lon: float, entry: dict, now: datetime) -> dict:
+    """
+    Fetches only what can have changed since the cached hour: archive days from the last
+    cached end date, and forecast hours from the current hour on.
+    """
+    start_date, end_date = _past_window(now)
+    archive_from = max(start_date, entry["archive_end"])
+    current_hour = now.replace(minute=0, second=0, microsecond=0)
+    forecast_end = datetime.combine(now.date() + timedelta(days=FORECAST_DAYS - 1), datetime.min.time()) + timedelta(hours=23)
+
+    archive_json, forecast_json = await asyncio.gather(
+        _fetch_point(
+            ("archive", archive_from, end_date),
+            lambda lats, lons: _archive_url(lats, lons, archive_from, end_date),
+            lat, lon, "archive",
+        ),
+        _fetch_point(
+            ("forecast", current_hour, forecast_end),
+            lambda lats, lons: _forecast_url(lats, lons, current_hour, forecast_end),
+            lat, lon, "forecast",
+        ),
+    )
+    with timed("merge"):
+        cached = entry["frame"]
+        archive = HourlyFrame.from_payload(archive_json)
+        forecast = HourlyFrame.from_payload(forecast_json)
+
+        archive_until = entry["archive_until"]
+        if len(archive):
+            archive_until = max(archive_until, pd.Timestamp((archive.end - 1) * HOUR_NS))
+        # El archivo gana sobre el forecast en horas repetidas (igual que la descarga completa)
+        keep_from = _epoch_hour(archive_until) + 1 - forecast.start
+        forecast = forecast.slice(min(len(forecast), max(0, keep_from)))
+
+        # Lo nuevo debe continuar lo guardado sin huecos; si no, descarga completa
+        covered = cached.end
+        for part in sorted((p for p in (archive, forecast) if len(p)), key=lambda p: p.start):
+            if part.start > covered:
+                raise _NotContiguous()
+            covered = max(covered, part.end)
+
+        # Posicion = horas desde el inicio: sin concat + dedupe + sort
+        merged = HourlyFrame.merge([archive, forecast, cached])
+        first = min(len(merged), max(0, _epoch_hour(start_date) - merged.start))
+        frame = merged.slice(first)
+
+    return {"frame": frame, "hour": current_hour, "archive_end": end_date, "archive_until": archive_until}
+
+
+async def _full_entry(lat: float, lon: float, now: datetime) -> dict:
+    frame = await _fetch_hourly(lat, lon)
+    start_date, end_date = _past_window(now)
+    # Ultima hora cubierta por el archivo: fin del dia end_date
+    archive_until = pd.Timestamp(end_date) + pd.Timedelta(hours=23)
+    return {
+        "frame": frame,
+        "hour": now.replace(minute=0, second=0, microsecond=0),
+        "archive_end": end_date,
+        "archive_until": archive_until,
+    }
+
+
+async def get_weather_frame(lat: float, lon: float) -> HourlyFrame:
+    """
+    Hour-aligned cached version of fetch_weather_data_async shared by every target, as the
+    HourlyFrame model jobs take (call .to_frame() where a DataFrame is really needed).
+    Within the same UTC hour the cached frame is returned as is (treat it as read-only);
+    on a new hour only the changed archive/forecast rows are downloaded and merged.
+    """
+    key = (round(lat, 4), round(lon, 4))
+    async with _frame_lock(key):
+        now = datetime.utcnow()
+        current_hour = now.replace(minute=0, second=0, microsecond=0)
+        entry = await frame_cache.aget(key)
+
+        if entry and entry["hour"] == current_hour:
+            frame_cache_stats["hits"] += 1
+            return entry["frame"]
+
+        if entry:
+            try:
+                entry = await _refresh_delta(lat, lon, entry, now)
+                frame_cache_stats["delta"] += 1
+            except _NotContiguous:
+                entry = None
 
-    df_all = pd.concat([df_archive, df_forecast], ignore_index=True)
-    if df_all.empty:
-        raise ValueError("No se pudieron obtener datos de archivo ni forecast.")
+        if not entry:
+            entry = await _full_entry(lat, lon, now)
+            frame_cache_stats["full"] += 1
 
-    df_all["time"] = pd.to_datetime(df_all["time"])
-    df_all = df_all.drop_duplicates(subset=["time"]).sort_values("time").reset_index(drop=True)
-    return df_all
+        frame_cache.set(key, entry)
+        return entry["frame"]